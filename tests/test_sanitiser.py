@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Tests of runSanitiser(), Sanitiser and the -S 2 deletion, with a fake
+# ot-sanitise (fake-ots-sanitize) whose result depends on the font file.
+# Run with: python tests/test_sanitiser.py
+
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_FOLDER))
+import ttfdiet
+
+FAKE_OTS = os.path.join(TESTS_FOLDER, "fake-ots-sanitize")
+
+class SanitiserTest(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.folder, True)
+
+	def makeFont(self, name, content):
+		path = os.path.join(self.folder, name)
+		f = open(path, "wb")
+		f.write(content)
+		f.close()
+		return path
+
+	def testPassed(self):
+		path = self.makeFont("pass.ttf", "pass")
+		result = ttfdiet.runSanitiser(path, FAKE_OTS, 10)
+		self.assertEqual(result.status, "passed")
+		self.assertEqual(result.returncode, 0)
+		self.assertEqual(result.messages, [])
+
+	def testFailed(self):
+		path = self.makeFont("fail.ttf", "fail")
+		result = ttfdiet.runSanitiser(path, FAKE_OTS, 10)
+		self.assertEqual(result.status, "failed")
+		self.assertEqual(result.returncode, 1)
+		self.assertEqual(result.messages, ["ERROR: bad table"])
+
+	def testFailedOnOutput(self):
+		# ot-sanitise prints nothing if it finds no problems
+		path = self.makeFont("warn.ttf", "warn")
+		result = ttfdiet.runSanitiser(path, FAKE_OTS, 10)
+		self.assertEqual(result.status, "failed")
+		self.assertEqual(result.returncode, 0)
+
+	def testTimeout(self):
+		path = self.makeFont("hang.ttf", "hang")
+		start = time.time()
+		result = ttfdiet.runSanitiser(path, FAKE_OTS, 1)
+		self.assertEqual(result.status, "timeout")
+		self.assertEqual(result.messages, ["ot-sanitise did not finish within 1 seconds"])
+		# the sleeping child of the script is killed too, else communicate() waits for it:
+		self.assertTrue(time.time() - start < 30)
+
+	def testMissing(self):
+		path = self.makeFont("pass.ttf", "pass")
+		result = ttfdiet.runSanitiser(path, os.path.join(self.folder, "no-ots-sanitize"), 10)
+		self.assertEqual(result.status, "missing")
+		self.assertEqual(result.returncode, None)
+
+	def testSanitiser(self):
+		options = ttfdiet.dietOptions(otsSanitise=1, otsPathOrCommand=FAKE_OTS, otsTimeout=1)
+		sanitiser = ttfdiet.Sanitiser(options, 2)
+		for status in ("pass", "fail", "hang"):
+			sanitiser.submit(self.makeFont(status + ".ttf", status), status)
+		results = dict(sanitiser.getResults(wait=True))
+		sanitiser.close()
+		self.assertEqual(dict((key, result.status) for key, result in results.items()),
+			{"pass": "passed", "fail": "failed", "hang": "timeout"})
+
+	def testRemoveUnsanitised(self):
+		# with -S 2, fonts that fail or time out are deleted, others are kept
+		options = ttfdiet.dietOptions(otsSanitise=2, otsPathOrCommand=FAKE_OTS, otsTimeout=1)
+		paths = {}
+		for status in ("pass", "fail", "hang"):
+			paths[status] = self.makeFont(status + ".ttf", status)
+			ttfdiet.removeUnsanitised(ttfdiet.runSanitiser(paths[status], FAKE_OTS, 1), options)
+		self.assertTrue(os.path.exists(paths["pass"]))
+		self.assertFalse(os.path.exists(paths["fail"]))
+		self.assertFalse(os.path.exists(paths["hang"]))
+
+	def testKeepUnsanitised(self):
+		# with -S 1, they are only reported
+		options = ttfdiet.dietOptions(otsSanitise=1, otsPathOrCommand=FAKE_OTS, otsTimeout=1)
+		path = self.makeFont("fail.ttf", "fail")
+		self.assertEqual(ttfdiet.reportSanitised(ttfdiet.runSanitiser(path, FAKE_OTS, 1), options, ttfdiet.ignoreMessage), 1)
+		self.assertTrue(os.path.exists(path))
+
+	def testSanitiseFontDeletes(self):
+		# the single-font command line: -S 2 reports the failure and deletes the font
+		options = ttfdiet.dietOptions(otsSanitise=2, otsPathOrCommand=FAKE_OTS, otsTimeout=1)
+		path = self.makeFont("fail.ttf", "fail")
+		self.assertEqual(ttfdiet.sanitiseFont(path, options, ttfdiet.ignoreMessage), 1)
+		self.assertFalse(os.path.exists(path))
+		self.assertEqual(ttfdiet.sanitiseFont(self.makeFont("pass.ttf", "pass"), options, ttfdiet.ignoreMessage), 0)
+
+if __name__ == "__main__":
+	unittest.main()
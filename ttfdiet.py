@@ -47,18 +47,73 @@ try:
 except ImportError: 
 	import unicodedata
 
+import glob
+import hashlib
+import itertools
+import base64
+import csv
+import errno
+import json
+import marshal
+import mmap
+import multiprocessing
+import multiprocessing.pool
 import optparse
+import Queue
+import select
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
 from copy import deepcopy
-from struct import pack
+from io import BytesIO
+from struct import pack, unpack
 from subprocess import PIPE, Popen
 
 try:
-	from fontTools.ttLib import TTFont, TTLibError, newTable
+	import fontTools
+	from fontTools.ttLib import TTCollection, TTFont, TTLibError, newTable
+	from fontTools.ttLib.sfnt import calcChecksum
+	from fontTools.ttLib.ttFont import getSearchRange
 	from fontTools.ttLib.tables.otTables import *
+	from fontTools.ttLib.tables._g_l_y_f import ARG_1_AND_2_ARE_WORDS, ARGS_ARE_XY_VALUES, MORE_COMPONENTS, USE_MY_METRICS, \
+		WE_HAVE_A_SCALE, WE_HAVE_AN_X_AND_Y_SCALE, WE_HAVE_A_TWO_BY_TWO
+	from fontTools.ttLib.tables.DefaultTable import DefaultTable
+	from fontTools.ttLib.tables.TupleVariation import TupleVariation, decompileSharedTuples
+	from fontTools.ttLib.tables._g_v_a_r import compileGlyph_, decompileGlyph_
+	from fontTools.varLib import varStore # adds VarStore.subset_varidxes()
+	import fontTools.subset.cff # adds remove_unused_subroutines() to the 'CFF ' and 'CFF2' tables
+	from fontTools.misc import psCharStrings
+	from fontTools.pens.boundsPen import BoundsPen
+	from fontTools.misc.arrayTools import intRect
 except: 
 	print "Install https://github.com/behdad/fonttools/archive/master.zip" 
 	sys.exit(1)
 
+try:
+	import brotli # for WOFF2 output only
+except ImportError:
+	brotli = None
+
+try:
+	import numpy # for the visual check (verifyDecompositions) only
+except ImportError:
+	numpy = None
+
+try:
+	import ctypes # for inotify in watch mode only
+	import ctypes.util
+except ImportError:
+	ctypes = None
+
+try:
+	import resource
+except ImportError: # Windows
+	resource = None
+
 try: set
 except NameError: from sets import Set as set
 def cleanUpList(l):
@@ -78,6 +133,7 @@ REMOVE_PRECOMPOSED_FROM_GPOS_KERN = 1
 REMOVE_ALL_BUT_WIN_CMAP_SUBTABLES = 1
 REMOVE_ALL_BUT_WIN_NAME_RECORDS   = 1
 REMOVE_POST_GLYPHNAMES            = 1
+REMOVE_DUPLICATE_OUTLINES         = 0 # glyphs with identical 'glyf' data become references to one of them
 
 DECOMPOSE_PRECOMPOSED_IN_CCMP     = 1
 SAVE_FEA_FILE                     = 0
@@ -88,13 +144,94 @@ DEFAULT_OUTPATH_ADDITION          = u".diet"
 
 REPORT_MISSING_MARKS              = 1
 CORRECT_MARK_CLASS                = 1
+VERIFY_DECOMPOSITIONS             = 0 # tolerance in 1/1000 em for comparing blanked glyphs with their decompositions; 0 means no check
 SKIP_MARKS                        = u"031B,0338" # you may not want to decompose precomposed ones that involve horn or overstruck long solidus
-SKIP_MARKS_FINAL                  = None
 
 ADD_DUMMY_DSIG                    = 0
 
 OTS_SANITISE                      = 0
 OTS_PATH_OR_COMMAND               = "ots-sanitize" # this expects that the ot-sanitise binary is present in a system-known bin folder
+OTS_TIMEOUT                       = 60 # seconds per font, 0 means no timeout
+
+ESTIMATE                          = 0 # only predict the diet efficiency, don't save anything
+OUTPUT_FORMATS                    = u"ttf" # any of ttf, woff, woff2, comma-separated
+FONT_FLAVORS                      = {"ttf": None, "woff": "woff", "woff2": "woff2"} # TTFont.flavor of each output format
+
+BATCH_MODE                        = 0
+BATCH_JOBS                        = 0 # number of worker processes, 0 means one per CPU
+BATCH_OUTDIR                      = ""
+BATCH_FONT_EXTENSIONS             = [".ttf", ".ttc", ".otf", ".otc"]
+WATCH                             = 0 # keep running and re-diet the inputfonts when they change
+WATCH_DELAY                       = 0.3 # seconds a changed inputfont must stay unchanged before it is re-dieted
+WATCH_POLL_INTERVAL               = 1.0 # seconds between checks of the inputfonts where inotify is not available
+WATCH_MEMO_SIZE                   = 16 # dieted 'GPOS' and 'GSUB' tables watch mode keeps for fonts whose next edit leaves them as they are
+WORKER                            = 0 # keep running and diet the fonts of JSON-lines requests on stdin
+WORKER_IGNORED_OPTIONS            = ["batch", "jobs", "outdir", "watch", "worker", "sweep", "family"] # options of the worker itself, not of one request
+FAMILY                            = 0 # in batch and worker mode, decompose once for all inputfonts with the same 'cmap' and glyph order
+SWEEP                             = 0 # diet with each combination of the core diet options and save the smallest valid outputfont
+
+TRACE_FILE                        = "" # save the timing and memory of each phase of the diet to this file
+TRACE_FORMAT                      = u"json" # or "chrome", the Chrome trace-event format (chrome://tracing, Perfetto)
+TRACE_FORMATS                     = ["json", "chrome"]
+PROFILE_FILE                      = "" # save cProfile statistics of the diet to this file
+REPORT_FILE                       = "" # save the bytes of each table and blanked glyph to this .json or .csv file
+
+CACHE                             = 0 # reuse the outputfonts of earlier diets of the same font with the same options
+CACHE_FOLDER                      = "" # empty means "results" in the Unicode tables folder, ~/.cache/ttfdiet
+CACHE_SIZE                        = 512 # megabytes; the least recently used results are removed beyond this
+
+# The values above are defaults only and are never changed at runtime.
+# One diet is described by an immutable DietOptions, so several diets
+# (in threads, or in a long-lived build process) can run side by side:
+DietOptions = namedtuple("DietOptions", [
+	"verbose",
+	"removePrecomposedOutlines",
+	"removePrecomposedFromGposKern",
+	"removeAllButWinCmapSubtables",
+	"removeAllButWinNameRecords",
+	"removePostGlyphnames",
+	"removeDuplicateOutlines",
+	"decomposePrecomposedInCcmp",
+	"saveFeaFile",
+	"renameFont",
+	"renameFontAddition",
+	"reportMissingMarks",
+	"correctMarkClass",
+	"verifyDecompositions", # tolerance in 1/1000 em, see verifyDecompositions()
+	"skipMarks", # list of int codepoints
+	"addDummyDsig",
+	"otsSanitise",
+	"otsPathOrCommand",
+	"otsTimeout",   # seconds
+	"estimate",     # only predict the outputfont size, see estimateDiet()
+	"formats",      # list of output formats, see FONT_FLAVORS
+	"traceFile",    # see DietTrace
+	"traceFormat",
+	"profileFile",
+	"reportFile",   # see getSizeReport()
+	"cache",        # see getCacheKey()
+	"cacheFolder",
+	"cacheSize",    # megabytes
+	])
+
+# what diet() and estimateDiet() return; data is None if the font was not
+# suitable for a diet, or if the diet was only estimated:
+DietResult = namedtuple("DietResult", [
+	"data",         # the dieted font as a string of bytes
+	"fea",          # the 'ccmp' lookup in AFDKO syntax, or None
+	"inSize",       # size of the inputfont in bytes, if known
+	"outSize",
+	"decomposed",   # list of (glyph name, [decomposition glyph names])
+	"missingMarks", # list of hex codepoints
+	"messages",     # list of strings
+	])
+
+BatchOptions = namedtuple("BatchOptions", ["mode", "jobs", "outdir", "watch", "worker", "sweep", "family", "inputs",
+	"defaults", # the parsed command-line options, which the options of worker requests change
+	])
+
+class DietError(Exception):
+	pass
 
 class NoWrapHelpFormatter(optparse.IndentedHelpFormatter):
  	def _formatter(self, text):
@@ -110,34 +247,85 @@ class NoWrapHelpFormatter(optparse.IndentedHelpFormatter):
 		else:
 			return ""
 
-def handleOptions():
-	global TOOL_VERSION
-	global TOOL_URL
-	global VERBOSE
-	global REMOVE_PRECOMPOSED_OUTLINES 
-	global REMOVE_PRECOMPOSED_FROM_GPOS_KERN 
-	global REMOVE_ALL_BUT_WIN_CMAP_SUBTABLES 
-	global REMOVE_ALL_BUT_WIN_NAME_RECORDS 
-	global REMOVE_POST_GLYPHNAMES 
-
-	global DECOMPOSE_PRECOMPOSED_IN_CCMP 
-	global SAVE_FEA_FILE 
-
-	global RENAME_FONT 
-	global RENAME_FONT_ADDITION
-
-	global REPORT_MISSING_MARKS 
-	global SKIP_MARKS 
-	global SKIP_MARKS_FINAL 
+def parseSkipMarks(skipMarks):
+	# returns a sorted list of int codepoints
+	skipMarksAddkToDefault              = "+" in skipMarks
+	skipMarks                           = skipMarks.replace("+","")
+	try:
+		# integer means:
+		# a) don't skip any marks
+		# b) skip all marks
+		# c) a hex codepoint was misunderstood as being an integer, do as d)
+		skipInt = int(skipMarks)
+		if skipInt == 0: # process all marks (including default skip marks)
+				skipMarksFinal = ""
+		elif skipInt == 1: # skip all marks (including default skip marks)
+				skipMarksFinal = deepcopy(SKIP_MARKS)
+		else: # a single mark hex codepoint that int() unfortunately accepts, do as d)
+			if skipMarksAddkToDefault:
+				skipMarksFinal = "%s,%s" % (skipMarks,SKIP_MARKS)
+			else:
+				skipMarksFinal =            skipMarks
+	except:
+		# d) skip marks as defined by hex codepoints
+			if skipMarksAddkToDefault:
+				skipMarksFinal = "%s,%s" % (skipMarks,SKIP_MARKS)
+			else:
+				skipMarksFinal =            skipMarks
+	skipMarksFinal = skipMarksFinal.strip().replace(","," ").replace(";"," ").replace("-"," ").replace("/"," ").split()
+	skipMarksFinal = cleanUpList([int(m, 16) for m in skipMarksFinal if len(m) ]) ; m=None
+	return skipMarksFinal
 
-	global ADD_DUMMY_DSIG 
+def parseFormats(formats):
+	# returns a list of output formats, in the given order
+	formatsFinal = []
+	for f in formats.lower().replace(","," ").replace(";"," ").replace("/"," ").split():
+		if f not in FONT_FLAVORS:
+			raise ValueError("Unknown output format '%s', use %s" % (f, ", ".join(sorted(FONT_FLAVORS))))
+		if f not in formatsFinal:
+			formatsFinal += [f]
+	if not formatsFinal:
+		raise ValueError("No output format given, use %s" % ", ".join(sorted(FONT_FLAVORS)))
+	return formatsFinal
 
-	global OTS_SANITISE 
-	global OTS_PATH_OR_COMMAND 
+def dietOptions(**changes):
+	# the default DietOptions, with the given fields changed
+	options = DietOptions(
+		verbose                       = VERBOSE,
+		removePrecomposedOutlines     = REMOVE_PRECOMPOSED_OUTLINES,
+		removePrecomposedFromGposKern = REMOVE_PRECOMPOSED_FROM_GPOS_KERN,
+		removeAllButWinCmapSubtables  = REMOVE_ALL_BUT_WIN_CMAP_SUBTABLES,
+		removeAllButWinNameRecords    = REMOVE_ALL_BUT_WIN_NAME_RECORDS,
+		removePostGlyphnames          = REMOVE_POST_GLYPHNAMES,
+		removeDuplicateOutlines       = REMOVE_DUPLICATE_OUTLINES,
+		decomposePrecomposedInCcmp    = DECOMPOSE_PRECOMPOSED_IN_CCMP,
+		saveFeaFile                   = SAVE_FEA_FILE,
+		renameFont                    = RENAME_FONT,
+		renameFontAddition            = RENAME_FONT_ADDITION,
+		reportMissingMarks            = REPORT_MISSING_MARKS,
+		correctMarkClass              = CORRECT_MARK_CLASS,
+		verifyDecompositions          = VERIFY_DECOMPOSITIONS,
+		skipMarks                     = parseSkipMarks(SKIP_MARKS),
+		addDummyDsig                  = ADD_DUMMY_DSIG,
+		otsSanitise                   = OTS_SANITISE,
+		otsPathOrCommand              = OTS_PATH_OR_COMMAND,
+		otsTimeout                    = OTS_TIMEOUT,
+		estimate                      = ESTIMATE,
+		formats                       = parseFormats(OUTPUT_FORMATS),
+		traceFile                     = TRACE_FILE,
+		traceFormat                   = TRACE_FORMAT,
+		profileFile                   = PROFILE_FILE,
+		reportFile                    = REPORT_FILE,
+		cache                         = CACHE,
+		cacheFolder                   = CACHE_FOLDER,
+		cacheSize                     = CACHE_SIZE,
+		)
+	return options._replace(**changes)
 
-	# parse argv:
+def getOptionParser():
+	# the command-line options; worker requests use the same names and defaults
 	parser = optparse.OptionParser(formatter=NoWrapHelpFormatter(), 
-		usage=u"usage: python %prog [options] inputfont.ttf [outputfont.ttf]", 
+		usage=u"usage: python %prog [options] inputfont.ttf [outputfont.ttf]\n       python %prog [options] -b 1 fonts|folders|globs|@manifest ...", 
 		version=u"%prog v" + TOOL_VERSION)
 
 	parser.description = u"""%prog v""" + TOOL_VERSION + u"""
@@ -164,8 +352,8 @@ Requirements
 ------------
 1. The tool requires Python 2.6 or newer and the fontTools/TTX package from:
    https://github.com/behdad/fonttools/
-2. inputfont must be a TrueType-flavored (.ttf) fonts that contains
-   a 'glyf' table. It does NOT work with CFF-flavored .otf fonts.
+2. inputfont must be an OpenType font with a 'glyf' table (.ttf) or a 'CFF '
+   or 'CFF2' table (.otf), or a collection (.ttc, .otc) of them.
 3. inputfont should contain a 'GSUB' table.
 4. inputfont should contain combining marks (U+03xx) which should be assigned
    to the mark class (3) in the 'GDEF' table.
@@ -180,7 +368,7 @@ The tool applies a 'diet' to a .ttf font. The diet consists of two steps:
 1. It 'blanks' all glyphs that, in the 'cmap' table, represent precomposed
    Unicode characters (such as U+00E1, LATIN SMALL LETTER A WITH ACUTE),
    i.e. it removes all contours and components for those glyphs from the
-   'glyf' table (note: the tool cannot process the 'CFF' table).
+   'glyf' table, or empties their charstrings in the 'CFF ' or 'CFF2' table.
 2. It adds a 'GSUB' lookup that substitutes every glyph that represents
    a precomposed Unicode character with a sequence of glyphs that represent
    the Unicode canonical decomposition of that precomposed character,
@@ -216,6 +404,21 @@ Not specified options will use the default values shown below."""
 		default=OTS_SANITISE, 
 		metavar=str(OTS_SANITISE), 
 		nargs=1 )
+	group.add_option("-O", "--otstimeout", 
+		help=u"stop 'ot-sanitise' after this many seconds and count the font as failed; 0 means no timeout", 
+		default=OTS_TIMEOUT, 
+		metavar=str(OTS_TIMEOUT), 
+		nargs=1 )
+	group.add_option("-w", "--formats", 
+		help=u"save the outputfont in these formats: ttf, woff, woff2 (comma-separated); the diet efficiency is reported for each format", 
+		default=OUTPUT_FORMATS, 
+		metavar=str("list"), 
+		nargs=1 )
+	group.add_option("-e", "--estimate", 
+		help=u"only estimate the outputfont size from the inputfont, don't save anything", 
+		default=ESTIMATE, 
+		metavar=str(ESTIMATE), 
+		nargs=1 )
 	parser.add_option_group(group)
 	group = optparse.OptionGroup(parser, u"Core diet options")
 	group.add_option("-g", "--glyf", 
@@ -224,7 +427,7 @@ Not specified options will use the default values shown below."""
 		metavar=str(REMOVE_PRECOMPOSED_OUTLINES), 
 		nargs=1 )
 	group.add_option("-k", "--kern", 
-		help=u"remove precomposed glyphs from 'GPOS' kern PairPosFormat1 subtables", 
+		help=u"remove precomposed glyphs from 'GPOS' kern PairPos subtables and from the 'kern' table", 
 		default=REMOVE_PRECOMPOSED_FROM_GPOS_KERN, 
 		metavar=str(REMOVE_PRECOMPOSED_FROM_GPOS_KERN), 
 		nargs=1 )
@@ -260,6 +463,11 @@ Not specified options will use the default values shown below."""
 		default=REMOVE_POST_GLYPHNAMES, 
 		metavar=str(REMOVE_POST_GLYPHNAMES), 
 		nargs=1 )
+	group.add_option("-u", "--duplicates", 
+		help=u"replace glyphs whose outlines are identical to another glyph's with a reference to it, or map them to it in 'cmap' if nothing else uses them", 
+		default=REMOVE_DUPLICATE_OUTLINES, 
+		metavar=str(REMOVE_DUPLICATE_OUTLINES), 
+		nargs=1 )
 	parser.add_option_group(group)
 	group = optparse.OptionGroup(parser, u"Various options")
 	group.add_option("-r", "--rename", 
@@ -273,101 +481,334 @@ Not specified options will use the default values shown below."""
 		metavar=str(ADD_DUMMY_DSIG), 
 		nargs=1 )
 	parser.add_option_group(group)
+	group = optparse.OptionGroup(parser, u"Batch processing")
+	group.add_option("-b", "--batch",
+		help=u"treat all arguments as inputs: fonts, folders, glob patterns or @manifest files (one path per line); implied by folders, globs and manifests",
+		default=BATCH_MODE,
+		metavar=str(BATCH_MODE),
+		nargs=1 )
+	group.add_option("-j", "--jobs",
+		help=u"number of worker processes in batch mode and for --sweep; 0 means one per CPU",
+		default=BATCH_JOBS,
+		metavar=str(BATCH_JOBS),
+		nargs=1 )
+	group.add_option("-o", "--outdir",
+		help=u"save batch outputfonts into this folder instead of next to the inputfonts",
+		default=BATCH_OUTDIR,
+		metavar=str("folder"),
+		nargs=1 )
+	group.add_option("-W", "--watch",
+		help=u"keep running, and re-diet the inputfonts (also new ones in folders and globs) whenever they change; uses inotify on Linux and polling elsewhere",
+		default=WATCH,
+		metavar=str(WATCH),
+		nargs=1 )
+	group.add_option("-J", "--worker",
+		help=u"keep running as a worker: read one JSON request per line on stdin, diet its font in a pool of -j processes, and write one JSON result per line to stdout",
+		default=WORKER,
+		metavar=str(WORKER),
+		nargs=1 )
+	group.add_option("-F", "--family",
+		help=u"plan the decompositions once for all inputfonts with the same 'cmap', glyph order and skip marks, such as the members of a family, in each -j process of batch and worker mode; the 'GDEF' and 'GPOS' checks still run for each font",
+		default=FAMILY,
+		metavar=str(FAMILY),
+		nargs=1 )
+	group.add_option("-X", "--sweep",
+		help=u"diet with each combination of -g, -k, -C, -c, -n, -p and -s (the given skip marks, and none), check each outputfont with 'ot-sanitise', and save the smallest one that passes; the font is read and planned once, and the combinations run in -j processes",
+		default=SWEEP,
+		metavar=str(SWEEP),
+		nargs=1 )
+	parser.add_option_group(group)
+	group = optparse.OptionGroup(parser, u"Diagnostics")
+	group.add_option("-V", "--verify",
+		help=u"compare the outline of each dieted glyph with its decomposition, positioned by the 'mark' and 'mkmk' anchors, and report the glyphs whose bounds or advance differ by more than this many 1/1000 em; 0 means no check; needs NumPy",
+		default=VERIFY_DECOMPOSITIONS,
+		metavar=str(VERIFY_DECOMPOSITIONS),
+		nargs=1 )
+	group.add_option("-T", "--trace",
+		help=u"save the time, memory and glyph or pair counts of each phase of the diet to this file; in batch mode, the font name is added to the file name",
+		default=TRACE_FILE,
+		metavar=str("file"),
+		nargs=1 )
+	group.add_option("-t", "--traceformat",
+		help=u"format of the --trace file: json, or chrome for the Chrome trace-event format",
+		default=TRACE_FORMAT,
+		metavar=str(TRACE_FORMAT),
+		nargs=1 )
+	group.add_option("-P", "--profile",
+		help=u"run cProfile during the diet and save its statistics to this file",
+		default=PROFILE_FILE,
+		metavar=str("file"),
+		nargs=1 )
+	group.add_option("-R", "--report",
+		help=u"save the bytes of each table before and after the diet, and the outline, kerning and 'ccmp' bytes of each blanked glyph, to this file; CSV if it ends with .csv, else JSON; in batch mode, the font name is added to the file name",
+		default=REPORT_FILE,
+		metavar=str("file"),
+		nargs=1 )
+	parser.add_option_group(group)
+	group = optparse.OptionGroup(parser, u"Result cache")
+	group.add_option("-K", "--cache",
+		help=u"1: reuse the outputfonts of earlier diets of the same inputfont with the same options; 'stats': print cache statistics; 'clear': empty the cache",
+		default=CACHE,
+		metavar=str(CACHE),
+		nargs=1 )
+	group.add_option("-D", "--cachedir",
+		help=u"cache folder; default is ~/.cache/ttfdiet/results, or results in $XDG_CACHE_HOME/ttfdiet",
+		default=CACHE_FOLDER,
+		metavar=str("folder"),
+		nargs=1 )
+	group.add_option("-M", "--cachesize",
+		help=u"maximum cache size in megabytes; the least recently used results are removed beyond it",
+		default=CACHE_SIZE,
+		metavar=str(CACHE_SIZE),
+		nargs=1 )
+	parser.add_option_group(group)
 
 	parser.epilog = u"""License
 -------
 This tool is open-source under the Apache 2 license, and is available from:
 %s """ % (TOOL_URL)
+	return parser
 
-	options, args = parser.parse_args()
-
-	# reset options:
-	VERBOSE                             = int( options.__dict__["verbose"     ] )
-	REMOVE_PRECOMPOSED_OUTLINES         = int( options.__dict__["glyf"        ] )
-	REMOVE_PRECOMPOSED_FROM_GPOS_KERN   = int( options.__dict__["kern"        ] )
-	REMOVE_ALL_BUT_WIN_CMAP_SUBTABLES   = int( options.__dict__["cmap"        ] )
-	REMOVE_ALL_BUT_WIN_NAME_RECORDS     = int( options.__dict__["name"        ] )
-	REMOVE_POST_GLYPHNAMES              = int( options.__dict__["post"        ] )
-
-	DECOMPOSE_PRECOMPOSED_IN_CCMP       = int( options.__dict__["ccmp"        ] )
-	SAVE_FEA_FILE                       = int( options.__dict__["fea"         ] )
-
+def getDietSettings(options):
+	# the DietOptions of parsed command-line options; raises DietError for invalid values
+	verbose                             = int( options.__dict__["verbose"     ] )
+	cacheFolder                         = getCacheFolder( options.__dict__["cachedir"] )
+	cacheSize                           = float( options.__dict__["cachesize"] )
+	try:
+		cache                           = int( options.__dict__["cache"] )
+	except ValueError:
+		raise DietError("Use -K 0, 1, stats or clear.")
 	renameFont                          =      options.__dict__["rename"      ]
+	renameFontAddition                  = RENAME_FONT_ADDITION
 	try:
 		# integer means: do it, and use predefined default
-		RENAME_FONT                     = int(renameFont)
+		renameFont                      = int(renameFont)
 	except:
 		# non-integer i.e. string means: do it, with the string provided
-		RENAME_FONT                     = 1
-		RENAME_FONT_ADDITION            = str(renameFont)
-	if RENAME_FONT:
-		REMOVE_ALL_BUT_WIN_NAME_RECORDS = 1
-
-	REPORT_MISSING_MARKS                = int( options.__dict__["repmarks"    ] )
-	skipMarks                           =      options.__dict__["skipmarks"   ]
-	skipMarksAddkToDefault              = "+" in skipMarks
-	skipMarks                           = skipMarks.replace("+","")
+		renameFontAddition              = str(renameFont)
+		renameFont                      = 1
+	skipMarks                           = parseSkipMarks( options.__dict__["skipmarks"] )
 	try:
-		# integer means: 
-		# a) don't skip any marks
-		# b) skip all marks
-		# c) a hex codepoint was misunderstood as being an integer, do as d)
-		skipInt = int(skipMarks)
-		if skipInt == 0: # process all marks (including default skip marks)
-				SKIP_MARKS_FINAL = ""
-		elif skipInt == 1: # skip all marks (including default skip marks)
-				SKIP_MARKS_FINAL = deepcopy(SKIP_MARKS)
-		else: # a single mark hex codepoint that int() unfortunately accepts, do as d)
-			if skipMarksAddkToDefault:
-				SKIP_MARKS_FINAL = "%s,%s" % (skipMarks,SKIP_MARKS)
-			else:
-				SKIP_MARKS_FINAL =            skipMarks
-	except:
-		# d) skip marks as defined by hex codepoints
-			if skipMarksAddkToDefault:
-				SKIP_MARKS_FINAL = "%s,%s" % (skipMarks,SKIP_MARKS)
-			else:
-				SKIP_MARKS_FINAL =            skipMarks
-	SKIP_MARKS_FINAL = SKIP_MARKS_FINAL.strip().replace(","," ").replace(";"," ").replace("-"," ").replace("/"," ").split()
-	SKIP_MARKS_FINAL = cleanUpList(SKIP_MARKS_FINAL)
-	SKIP_MARKS_FINAL.sort()
-	if len(SKIP_MARKS_FINAL) == 1:
-		if VERBOSE: print "Skipping mark with codepoint %s."   % " ".join(SKIP_MARKS_FINAL)
-	elif SKIP_MARKS_FINAL:
-		if VERBOSE: print "Skipping marks with codepoints %s." % " ".join(SKIP_MARKS_FINAL)
-	SKIP_MARKS_FINAL = [int(m, 16) for m in SKIP_MARKS_FINAL if len(m) ] ; m=None
+		formats                         = parseFormats( options.__dict__["formats"] )
+	except ValueError, e:
+		raise DietError(str(e))
+	if "woff2" in formats and brotli is None:
+		raise DietError("WOFF2 output needs the brotli module: pip install brotli")
+	verifyDecompositions                = float( options.__dict__["verify"] )
+	if verifyDecompositions and numpy is None:
+		raise DietError("The visual check needs the numpy module: pip install numpy")
+	traceFormat                         = options.__dict__["traceformat"].lower()
+	if traceFormat not in TRACE_FORMATS:
+		raise DietError("Unknown trace format '%s', use %s" % (traceFormat, ", ".join(TRACE_FORMATS)))
 
-	ADD_DUMMY_DSIG                      = int( options.__dict__["dsig"        ] )
+	dietSettings = dietOptions(
+		verbose                       = verbose,
+		removePrecomposedOutlines     = int( options.__dict__["glyf"        ] ),
+		removePrecomposedFromGposKern = int( options.__dict__["kern"        ] ),
+		removeAllButWinCmapSubtables  = int( options.__dict__["cmap"        ] ),
+		removeAllButWinNameRecords    = int( options.__dict__["name"        ] ) or renameFont,
+		removePostGlyphnames          = int( options.__dict__["post"        ] ),
+		removeDuplicateOutlines       = int( options.__dict__["duplicates"  ] ),
+		decomposePrecomposedInCcmp    = int( options.__dict__["ccmp"        ] ),
+		saveFeaFile                   = int( options.__dict__["fea"         ] ),
+		renameFont                    = renameFont,
+		renameFontAddition            = renameFontAddition,
+		reportMissingMarks            = int( options.__dict__["repmarks"    ] ),
+		skipMarks                     = skipMarks,
+		verifyDecompositions          = verifyDecompositions,
+		addDummyDsig                  = int( options.__dict__["dsig"        ] ),
+		otsSanitise                   = int( options.__dict__["sanitise"    ] ),
+		otsTimeout                    = float( options.__dict__["otstimeout"] ),
+		estimate                      = int( options.__dict__["estimate"    ] ),
+		formats                       = formats,
+		traceFile                     =      options.__dict__["trace"       ],
+		traceFormat                   = traceFormat,
+		profileFile                   =      options.__dict__["profile"     ],
+		reportFile                    =      options.__dict__["report"      ],
+		cache                         = cache,
+		cacheFolder                   = cacheFolder,
+		cacheSize                     = cacheSize,
+		)
+	return dietSettings
 
-	OTS_SANITISE            = int( options.__dict__["sanitise"    ] )
+def handleOptions():
+	# returns DietOptions, BatchOptions and a list of (inPath, outPath)
+
+	# parse argv:
+	options, args = getOptionParser().parse_args()
+
+	# read options:
+	verbose                             = int( options.__dict__["verbose"     ] )
+	cache                               = options.__dict__["cache"       ]
+	if cache in ("stats", "clear"):
+		cacheFolder                     = getCacheFolder( options.__dict__["cachedir"] )
+		if cache == "stats":
+			printCacheStats(cacheFolder, float( options.__dict__["cachesize"] ))
+		else:
+			clearCache(cacheFolder)
+			if verbose: print "Cleared %s." % cacheFolder
+		sys.exit(0)
+	try:
+		dietSettings                    = getDietSettings(options)
+	except DietError, e:
+		print e
+		sys.exit(2)
+
+	batch = BatchOptions(
+		mode   = int( options.__dict__["batch"       ] ),
+		jobs   = int( options.__dict__["jobs"        ] ),
+		outdir =      options.__dict__["outdir"      ],
+		watch  = int( options.__dict__["watch"       ] ),
+		worker = int( options.__dict__["worker"      ] ),
+		sweep  = int( options.__dict__["sweep"       ] ),
+		family = int( options.__dict__["family"      ] ),
+		inputs = args,
+		defaults = options,
+		)
+	for a in args:
+		if os.path.isdir(a) or isGlobPattern(a) or a.startswith("@"):
+			batch = batch._replace(mode=1)
+	a=None
+	skipMarks                           = dietSettings.skipMarks
+	if batch.worker: # stdout is for the results
+		pass
+	elif len(skipMarks) == 1:
+		if verbose: print "Skipping mark with codepoint %s."   % " ".join([unicodeIntToHexstr(m) for m in skipMarks])
+	elif skipMarks:
+		if verbose: print "Skipping marks with codepoints %s." % " ".join([unicodeIntToHexstr(m) for m in skipMarks])
 
 	# return file names:
-	if len(args) < 1: 
+	if batch.worker:
+		return dietSettings, batch, []
+	elif len(args) < 1:
 		print "Please specify an inputfont."
 		sys.exit(2)
-	elif len(args) < 2: 
+	elif batch.mode:
+		return dietSettings, batch, collectBatchJobs(args, batch.outdir)
+	elif len(args) < 2:
 		inPath = args[0]
-		outPath = os.path.splitext(inPath)[0] + DEFAULT_OUTPATH_ADDITION.lower().strip() + os.path.splitext(inPath)[1]
-	else: 
+		outPath = defaultOutPath(inPath)
+	else:
 		inPath = args[0]
 		outPath = args[1]
-	return inPath, outPath
+	return dietSettings, batch, [(inPath, outPath)]
 
 #########################################################################################################
 
-MARK_GLYPH_CODEPOINT_RANGE = [ int(m) for m in range(65000) if unicodedata.category(unichr(m)) == "Mn" ]; m=None # also allow for "M"?
-MARK_GLYPH_CODEPOINT_RANGE.remove(int("034F", 16))
+# Unicode tables: the mark codepoints and the canonical decompositions of all
+# planes. Scanning 0x110000 codepoints takes about a second, so the tables are
+# built once per Unicode version, stored in a small marshal file in the user's
+# cache folder, and loaded lazily on first use.
+UNICODE_TABLES_FORMAT = 2
+UNICODE_TABLES_FOLDER = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "ttfdiet")
+NOT_A_MARK_CODEPOINTS = [0x034F] # COMBINING GRAPHEME JOINER is Mn but has no shape
+
+UnicodeTables = namedtuple("UnicodeTables", [
+	"version",              # unicodedata.unidata_version the tables were built from
+	"marks",                # frozenset of the codepoints of "Mn" marks
+	"decompositions",       # dict codepoint: tuple of codepoints, one level of canonical decomposition
+	])
+
+_unicodeTables = {}
+_unicodeTablesLock = threading.Lock()
+
+def unicodeChar(u):
+	try:
+		c = unichr(u)
+	except ValueError:
+		return None
+	if len(c) != 1: # narrow Python build: a surrogate pair beyond the BMP
+		return None
+	return c
+
+def buildUnicodeTables():
+	# returns (markRanges, decompositions) for all planes; the marks are stored as
+	# sorted (first, last) codepoint ranges, which keeps the marshal file small
+	markRanges = []
+	decompositions = {}
+	for u in range(0x110000):
+		c = unicodeChar(u)
+		if c is None:
+			break
+		if unicodedata.category(c) == "Mn" and u not in NOT_A_MARK_CODEPOINTS: # also allow for "M"?
+			if markRanges and markRanges[-1][1] == u - 1:
+				markRanges[-1] = (markRanges[-1][0], u)
+			else:
+				markRanges += [(u, u)]
+		dec = unicodedata.decomposition(c)
+		if dec and not dec[:1] == "<": # canonical decompositions only
+			decompositions[u] = tuple([int(s, 16) for s in dec.split()])
+	return markRanges, decompositions
+
+def getUnicodeTables():
+	version = unicodedata.unidata_version
+	tables = _unicodeTables.get(version)
+	if tables is not None:
+		return tables
+	_unicodeTablesLock.acquire()
+	try:
+		tables = _unicodeTables.get(version)
+		if tables is None:
+			tables = loadUnicodeTables(version)
+			_unicodeTables[version] = tables
+	finally:
+		_unicodeTablesLock.release()
+	return tables
 
-PPF2_SUPPORTED = 0 # not tested yet! and deactivated ...
+def loadUnicodeTables(version):
+	path = os.path.join(UNICODE_TABLES_FOLDER, "unicode-%s-%s-%s.marshal" % (version, UNICODE_TABLES_FORMAT, sys.maxunicode))
+	data = None
+	try:
+		f = open(path, "rb")
+		try:
+			data = marshal.loads(f.read())
+		finally:
+			f.close()
+		if data[0] != version:
+			data = None
+	except (IOError, OSError, EOFError, ValueError, TypeError, IndexError, KeyError):
+		data = None
+	if data is None:
+		markRanges, decompositions = buildUnicodeTables()
+		data = (version, markRanges, decompositions)
+		# store it for the next run; write to a temporary file first
+		# so that parallel processes never read a half-written file:
+		tempPath = "%s.%s.tmp" % (path, os.getpid())
+		try:
+			ensureFolder(UNICODE_TABLES_FOLDER)
+			f = open(tempPath, "wb")
+			try:
+				f.write(marshal.dumps(data))
+			finally:
+				f.close()
+			if os.path.exists(path) and sys.platform == "win32":
+				os.remove(path)
+			os.rename(tempPath, path)
+		except (IOError, OSError):
+			if os.path.exists(tempPath):
+				os.remove(tempPath)
+	version, markRanges, decompositions = data
+	marks = []
+	for first, last in markRanges:
+		marks.extend(range(first, last + 1))
+	return UnicodeTables(version, frozenset(marks), decompositions)
 
 #########################################################################################################
 
+def ensureFolder(directory):
+	# creates directory unless it exists; pool processes may create it at the same time
+	try:
+		os.makedirs(directory)
+	except OSError, e:
+		if e.errno != errno.EEXIST or not os.path.isdir(directory):
+			raise
+
 def saveFile(data,file):
 	modus = "wb"
 	file = os.path.abspath(file)
 	if os.path.exists(file): os.remove(file)
 	directory = os.path.dirname(file)
-	if not os.path.exists(directory): os.makedirs(directory)
+	ensureFolder(directory)
 	theFile = open(file,modus)
 	theFile.write(data)
 	theFile.close()
@@ -376,24 +817,86 @@ def unicodeIntToHexstr(intUnicode):
 	hexUnicode = "%X".lstrip("0x") % intUnicode
 	return "0"*(4-len(hexUnicode)) + hexUnicode
 
+def defaultOutPath(inPath):
+	return os.path.splitext(inPath)[0] + DEFAULT_OUTPATH_ADDITION.lower().strip() + os.path.splitext(inPath)[1]
+
+def isGlobPattern(path):
+	return "*" in path or "?" in path or "[" in path
+
+def isBatchFont(path):
+	# don't pick up our own output when dieting a folder a second time:
+	base, ext = os.path.splitext(path)
+	if ext.lower() not in BATCH_FONT_EXTENSIONS:
+		return 0
+	if base.lower().endswith(DEFAULT_OUTPATH_ADDITION.lower().strip()):
+		return 0
+	return 1
+
+def collectBatchJobs(args, outdir=""):
+	# returns a list of (inPath, outPath) for fonts, folders, glob patterns and @manifest files
+	found = [] # list of (inPath, relative path used below outdir, outPath from manifest)
+	for a in args:
+		if a.startswith("@"):
+			# manifest: one inputfont per line, optionally followed by a tab and the outputfont
+			manifest = open(a[1:], "rb")
+			lines = manifest.read().decode("utf-8").splitlines()
+			manifest.close()
+			for line in lines:
+				line = line.strip()
+				if not line or line.startswith("#"):
+					continue
+				if "\t" in line:
+					inPath, outPath = [s.strip() for s in line.split("\t", 1)]
+					found += [(inPath, None, outPath)]
+				else:
+					found += [(line, os.path.basename(line), None)]
+		elif os.path.isdir(a):
+			for root, dirs, files in os.walk(a):
+				dirs.sort()
+				for f in sorted(files):
+					path = os.path.join(root, f)
+					if isBatchFont(path):
+						found += [(path, os.path.relpath(path, a), None)]
+		elif isGlobPattern(a):
+			for path in sorted(glob.glob(a)):
+				if os.path.isfile(path) and isBatchFont(path):
+					found += [(path, os.path.basename(path), None)]
+		else:
+			found += [(a, os.path.basename(a), None)]
+	jobs = []
+	seen = set()
+	for inPath, relPath, outPath in found:
+		if inPath in seen:
+			continue
+		seen.add(inPath)
+		if not outPath:
+			if outdir:
+				outPath = os.path.join(outdir, relPath)
+				if os.path.abspath(outPath) == os.path.abspath(inPath):
+					outPath = defaultOutPath(outPath)
+			else:
+				outPath = defaultOutPath(inPath)
+		jobs += [(inPath, outPath)]
+	return jobs
+
 #########################################################################################################
 
-def testFont(ttx,umap,nmap,markGlyphs):
+def testFont(ttx,umap,nmap,markGlyphs,options,log):
 	fontIsFine = 1
 	# are mark glyphs there?
-	codes = umap.keys()
-	marksFound = len(strictSets(MARK_GLYPH_CODEPOINT_RANGE,codes))
+	markCodepoints = getUnicodeTables().marks
+	marksFound = len(markCodepoints.intersection(umap))
 	if not marksFound:
-				if VERBOSE: print "Mark table glyphs missing."
+				log("Mark table glyphs missing.")
 				fontIsFine = 0			
 	# is GSUB there? (Won't create one yet.)
 	if "GSUB" not in ttx:
 				fontIsFine = 0
-				if VERBOSE: print "'GSUB' table missing."
+				log("'GSUB' table missing.")
 	# is GPOS there and is mark feature there?
 	if "GPOS" not in ttx:
 				fontIsFine = 0
-				if VERBOSE: print "'GPOS' table missing."
+				log("'GPOS' table missing.")
 	else:
 		markThere = 0	
 		for r in ttx["GPOS"].table.FeatureList.FeatureRecord:
@@ -401,112 +904,538 @@ def testFont(ttx,umap,nmap,markGlyphs):
 				markThere = 1
 		if not markThere:
 				fontIsFine = 0
-				if VERBOSE: print "'GPOS' table misses 'mark' feature."
+				log("'GPOS' table misses 'mark' feature.")
 	# is GDEF there and are marks classified as mark glyphs?
 	if "GDEF" not in ttx:
 				fontIsFine = 0
-				if VERBOSE: print "'GDEF' table missing."
+				log("'GDEF' table missing.")
 	else:
 		try:
 				classdefs = ttx["GDEF"].table.GlyphClassDef.classDefs
 		except:
 				classdefs = 0
 				fontIsFine = 0
-				if VERBOSE: print "'GDEF' table misses GlyphClassDef."
+				log("'GDEF' table misses GlyphClassDef.")
 		if classdefs:
-			# by unicode codepoint:
-			for n in nmap:
-				if n in classdefs:
-					isMark = 0
-					for uuu in nmap[n]:
-						if uuu in MARK_GLYPH_CODEPOINT_RANGE:
-							isMark = 1
-					if isMark:
-						if n in classdefs:
-							if classdefs[n] != 3 and CORRECT_MARK_CLASS:
-								classdefs[n] = 3
-								if VERBOSE: print "'GDEF' table's GlyphClassDef doesn't flag glyph '%s' as mark. Corrected." % n
-						else:
-							# do that anyway ...
-								classdefs[n] = 3
-								if VERBOSE: print "'GDEF' table's GlyphClassDef doesn't contain mark glyph '%s'. Added." % n
+			# by unicode codepoint (one pass over the mark codepoints the font maps):
+			markGlyphsByCodepoint = set(umap[u] for u in markCodepoints.intersection(umap))
+			for n in sorted(markGlyphsByCodepoint.intersection(classdefs)):
+						if classdefs[n] != 3 and options.correctMarkClass:
+							classdefs[n] = 3
+							log("'GDEF' table's GlyphClassDef doesn't flag glyph '%s' as mark. Corrected." % n)
 			n=None
 			# by actual use in mark, mkmk, liga-mark lookups:
 			for n in markGlyphs:
 						if n in classdefs:
-							if classdefs[n] != 3 and CORRECT_MARK_CLASS:
+							if classdefs[n] != 3 and options.correctMarkClass:
 								classdefs[n] = 3
-								if VERBOSE: print "'GDEF' table's GlyphClassDef doesn't flag glyph '%s' as mark. Corrected." % n
+								log("'GDEF' table's GlyphClassDef doesn't flag glyph '%s' as mark. Corrected." % n)
 						else:
 							# do that anyway ...
 								classdefs[n] = 3
-								if VERBOSE: print "'GDEF' table's GlyphClassDef doesn't contain mark glyph '%s'. Added." % n
+								log("'GDEF' table's GlyphClassDef doesn't contain mark glyph '%s'. Added." % n)
 	# report:
 	return fontIsFine
 
 def getMarkGlyphs(ttx):
 	if "GPOS" not in ttx:
 		return []
-	lookupIndices = []
-	for r in ttx["GPOS"].table.FeatureList.FeatureRecord:
-		if r.FeatureTag in ["mark","mkmk"]:
-			for l in r.Feature.LookupListIndex:
-				if l not in lookupIndices:
-					lookupIndices += [int( l )]
-#	print "lookupIndices",lookupIndices
-	marks = []
+	lookupIndices = getFeatureLookupIndices(ttx["GPOS"].table,["mark","mkmk"])
+	marks = set()
 	for lIdx in lookupIndices:
 		lookup = ttx["GPOS"].table.LookupList.Lookup[lIdx]
-#		print lookup.LookupType
-		if lookup.LookupType in [4,5]:
-#			print dir(lookup)
-			for s in lookup.SubTable:
-				if lookup.LookupType in [4,5]:
-					subtable = s
-				elif lookup.LookupType == 9 and s.ExtensionLookupType in [4,5]:
-					subtable = s.ExtSubTable
-				else:
-					continue
-				marks += subtable.MarkCoverage.glyphs
-		elif lookup.LookupType == 6:
-#			print dir(lookup)
-			for s in lookup.SubTable:
-				if lookup.LookupType == 6:
-					subtable = s
-				elif lookup.LookupType == 9 and s.ExtensionLookupType == 6:
-					subtable = s.ExtSubTable
-				else:
-					continue
-				marks += subtable.Mark1Coverage.glyphs
-				marks += subtable.Mark2Coverage.glyphs
-	marks = cleanUpList(marks)
-	return marks
+		for s in lookup.SubTable:
+			if lookup.LookupType == 9:
+				lookupType = s.ExtensionLookupType
+				subtable = s.ExtSubTable
+			else:
+				lookupType = lookup.LookupType
+				subtable = s
+			if lookupType in [4,5]:
+				marks.update(subtable.MarkCoverage.glyphs)
+			elif lookupType == 6:
+				marks.update(subtable.Mark1Coverage.glyphs)
+				marks.update(subtable.Mark2Coverage.glyphs)
+	return sorted(marks)
 
-def removeOutlines(ttx,glyphs_removeOutlinesAndInstructions):
-	# remove contours and components:
-	if "glyf" not in ttx:
-		if VERBOSE: print "This is not a 'glyf' based font. Won't remove contours/components."
+def removeOutlines(ttx,glyphs_removeOutlinesAndInstructions,log):
+	# remove contours and components, or charstrings:
+	if "glyf" not in ttx and not getCffTag(ttx):
+		log("This font has no 'glyf', 'CFF ' or 'CFF2' table. Won't remove contours/components.")
 		return
 	if not glyphs_removeOutlinesAndInstructions:
 		return
-	glyphs = ttx["glyf"].glyphs
+	removeGlyphVariations(  ttx,glyphs_removeOutlinesAndInstructions)
+	removeMetricsVariations(ttx,glyphs_removeOutlinesAndInstructions)
+	if "glyf" in ttx:
+		setGlyphData(ttx["glyf"], dict((n, "") for n in glyphs_removeOutlinesAndInstructions))
+	else:
+		removeCharStrings(ttx,glyphs_removeOutlinesAndInstructions)
+	# set LSB = 0 (metrics is a dict of (advance, lsb) tuples):
+	metrics = ttx["hmtx"].metrics
 	for n in glyphs_removeOutlinesAndInstructions:
-		glyphs[n].data = ""
-	# set LSB = 0:
-	if not glyphs_removeOutlinesAndInstructions:
+		if n in metrics:
+			metrics[n] = (metrics[n][0], 0)
+	removeLegacyGlyphData(ttx,glyphs_removeOutlinesAndInstructions)
+
+# CFF outlines: CFF has no composite glyphs, so a precomposed glyph is a charstring of
+# its own, usually calling subroutines that it shares with its base and mark glyphs.
+# Its charstring is emptied, and the subroutines that only the emptied charstrings
+# called are removed, with fontTools.subset, which renumbers the remaining ones.
+CFF_TAGS = ["CFF ", "CFF2"]
+
+def getCffTag(ttx):
+	# the tag of the CFF table of ttx, or None if it has none
+	for tag in CFF_TAGS:
+		if tag in ttx:
+			return tag
+	return None
+
+def getCharStrings(ttx):
+	return ttx[getCffTag(ttx)].cff.topDictIndex[0].CharStrings
+
+def getBlankProgram(charString,width,isCFF2):
+	# the program of an empty charstring; in 'CFF ', it has the width, which is
+	# the advance in 'hmtx', so that the two agree without decompiling charString
+	if isCFF2:
+		return [] # the widths are in 'hmtx' only, and there is no 'endchar'
+	private = charString.private
+	if width != private.defaultWidthX:
+		return [width - private.nominalWidthX, "endchar"]
+	return ["endchar"]
+
+def reachesFontBounds(ttx,bounds):
+	# whether any of the glyph bounds (from getOutlineBounds()) reaches the 'head' bounding box
+	# or an 'hhea' extent, or keeps head.flags bit 1 off, so that they may change without them
+	head    = ttx["head"]
+	hhea    = ttx["hhea"]
+	metrics = ttx["hmtx"].metrics
+	for name, (xMin, yMin, xMax, yMax) in bounds.iteritems():
+		advanceWidth, lsb = metrics[name]
+		if xMin <= head.xMin or yMin <= head.yMin or xMax >= head.xMax or yMax >= head.yMax:
+			return 1
+		if lsb <= hhea.minLeftSideBearing or advanceWidth - lsb - (xMax - xMin) <= hhea.minRightSideBearing \
+		or lsb + (xMax - xMin) >= hhea.xMaxExtent:
+			return 1
+		if lsb != xMin and not head.flags & 0x2:
+			return 1
+	return 0
+
+def removeCharStrings(ttx,glyphs):
+	# empties the charstrings of glyphs, and removes the subroutines nothing calls any more.
+	# Drawing all charstrings for the bounds takes long, so they are only recalculated
+	# if the emptied glyphs reached them.
+	tag = getCffTag(ttx)
+	charStrings = getCharStrings(ttx)
+	metrics = ttx["hmtx"].metrics
+	boundsChange = reachesFontBounds(ttx, getOutlineBounds(ttx, glyphs))
+	for n in glyphs:
+		charString = charStrings[n]
+		charString.program = getBlankProgram(charString, metrics[n][0], tag == "CFF2")
+		charString.bytecode = None
+	if boundsChange and not ttx.recalcBBoxes:
+		recalcBounds(ttx)
+	ttx[tag].remove_unused_subroutines()
+
+def removeLegacyGlyphData(ttx,glyphs):
+	# the per-glyph entries of the other tables for blanked glyphs: the top side bearing
+	# in 'vmtx' becomes 0 like the LSB, the 'VORG' record goes, and 'LTSH' scales them
+	# linearly from 1 ppem. 'hdmx' keeps their widths, which don't change, and 'VDMX'
+	# the extents, which the decomposed glyphs still reach.
+	if "vmtx" in ttx:
+		metrics = ttx["vmtx"].metrics
+		for n in glyphs:
+			if n in metrics:
+				metrics[n] = (metrics[n][0], 0)
+	if "VORG" in ttx:
+		records = ttx["VORG"].VOriginRecords
+		for n in glyphs:
+			records.pop(n, None)
+		ttx["VORG"].numVertOriginYMetrics = len(records)
+	if "LTSH" in ttx:
+		yPels = ttx["LTSH"].yPels
+		for n in glyphs:
+			if n in yPels:
+				yPels[n] = 1
+
+def setGlyphData(glyfTable,glyphData):
+	# replaces the compiled data of the glyphs in glyphData, a dict of glyph name: data
+	glyphs = glyfTable.glyphs
+	for n, data in glyphData.iteritems():
+		glyphs[n].data = data
+
+# Variable fonts: 'gvar' holds the deltas of the points of each glyph, followed by
+# four phantom points, whose deltas vary the advances and side bearings ('HVAR' and
+# 'VVAR' only repeat those). The diet keeps 'gvar' as raw data per glyph, so only the
+# glyphs it changes are decompiled, and the other glyphs aren't expanded.
+NUM_PHANTOM_POINTS = 4
+GVAR_HEADER_FORMAT = ">HHHHLHHL"
+GVAR_HEADER_SIZE   = 20
+SIDE_BEARING_VARIATION_MAPS = {"HVAR": ["LsbMap", "RsbMap"], "VVAR": ["TsbMap", "BsbMap", "VOrgMap"]}
+ADVANCE_VARIATION_MAPS      = {"HVAR": "AdvWidthMap", "VVAR": "AdvHeightMap"}
+
+class RawGlyphVariations(DefaultTable):
+	# the 'gvar' table as the compiled variation data of each glyph, in glyph order;
+	# compile() writes the same shared tuples and recomputes the offsets
+
+	def decompile(self, data, ttx):
+		self.version, self.reserved, axisCount, sharedTupleCount, offsetToSharedTuples, \
+			glyphCount, self.flags, offsetToData = unpack(GVAR_HEADER_FORMAT, data[:GVAR_HEADER_SIZE])
+		self.axisTags = [axis.axisTag for axis in ttx["fvar"].axes]
+		tupleSize = 2 * axisCount
+		self.sharedTuples = [data[offsetToSharedTuples + i * tupleSize:offsetToSharedTuples + (i + 1) * tupleSize] for i in range(sharedTupleCount)]
+		self.sharedTupleIndices = dict((coord, i) for i, coord in enumerate(self.sharedTuples))
+		self.sharedCoords = decompileSharedTuples(self.axisTags, sharedTupleCount, data, offsetToSharedTuples)
+		if self.flags & 1:
+			offsets = unpack(">%dL" % (glyphCount + 1), data[GVAR_HEADER_SIZE:GVAR_HEADER_SIZE + 4 * (glyphCount + 1)])
+		else:
+			offsets = [2 * offset for offset in unpack(">%dH" % (glyphCount + 1), data[GVAR_HEADER_SIZE:GVAR_HEADER_SIZE + 2 * (glyphCount + 1)])]
+		self.glyphData = [data[offsetToData + offsets[i]:offsetToData + offsets[i + 1]] for i in range(glyphCount)]
+
+	def compile(self, ttx):
+		offsets = [0]
+		for data in self.glyphData:
+			offsets += [offsets[-1] + len(data)]
+		if offsets[-1] <= 2 * 0xFFFF and not [offset for offset in offsets if offset & 1]:
+			flags = self.flags & ~1
+			compiledOffsets = pack(">%dH" % len(offsets), *[offset // 2 for offset in offsets])
+		else:
+			flags = self.flags | 1
+			compiledOffsets = pack(">%dL" % len(offsets), *offsets)
+		offsetToSharedTuples = GVAR_HEADER_SIZE + len(compiledOffsets)
+		sharedTuples = "".join(self.sharedTuples)
+		header = pack(GVAR_HEADER_FORMAT, self.version, self.reserved, len(self.axisTags), len(self.sharedTuples),
+			offsetToSharedTuples, len(self.glyphData), flags, offsetToSharedTuples + len(sharedTuples))
+		return header + compiledOffsets + sharedTuples + "".join(self.glyphData)
+
+	def getVariations(self, glyphID, pointCount):
+		# the TupleVariations of a glyph with pointCount points (without the phantom points)
+		return decompileGlyph_(pointCount + NUM_PHANTOM_POINTS, self.sharedCoords, self.axisTags, self.glyphData[glyphID])
+
+	def compileVariations(self, variations, pointCount):
+		return compileGlyph_(variations, pointCount + NUM_PHANTOM_POINTS, self.axisTags, self.sharedTupleIndices)
+
+def readGlyphVariations(ttx):
+	# the 'gvar' table of ttx as RawGlyphVariations, or None if there is none
+	if "gvar" not in ttx:
+		return None
+	if ttx.isLoaded("gvar") and isinstance(ttx["gvar"], RawGlyphVariations):
+		return ttx["gvar"]
+	gvar = RawGlyphVariations("gvar")
+	gvar.decompile(ttx.getTableData("gvar"), ttx) # compiles a decompiled 'gvar', with the glyphs it was decompiled for
+	return gvar
+
+def getGlyphVariations(ttx):
+	# like readGlyphVariations(), but the diet then changes and saves that table
+	gvar = readGlyphVariations(ttx)
+	if gvar is not None:
+		ttx.tables["gvar"] = gvar
+	return gvar
+
+def getPointCount(data):
+	# the number of points (of a simple glyph) or components (of a composite glyph)
+	# of a compiled glyph, as 'gvar' counts them
+	if len(data) < 10:
+		return 0
+	numberOfContours = unpack(">h", data[:2])[0]
+	if numberOfContours < 0:
+		return len(getComponentIDs(data))
+	if not numberOfContours:
+		return 0
+	return unpack(">H", data[10 + 2 * (numberOfContours - 1):10 + 2 * numberOfContours])[0] + 1
+
+def getPhantomVariations(variations,pointCount):
+	# the variations of only the phantom points of variations, for a glyph that now has
+	# pointCount points without deltas, so that its metrics keep varying
+	phantomVariations = []
+	for variation in variations:
+		deltas = variation.coordinates[-NUM_PHANTOM_POINTS:]
+		if [d for d in deltas if d is not None and d != (0, 0)]:
+			phantomVariations += [TupleVariation(variation.axes, [None] * pointCount + deltas)]
+	return phantomVariations
+
+def getBlankedGlyphVariationData(ttx,gvar,glyphs):
+	# {glyph ID: variation data} of the glyphs that removeOutlines() blanks
+	glyfTable = ttx["glyf"]
+	glyphData = {}
+	for n in glyphs:
+		glyphID = ttx.getGlyphID(n)
+		if not gvar.glyphData[glyphID]:
+			continue
+		variations = gvar.getVariations(glyphID, getPointCount(getGlyphData(glyfTable.glyphs[n], glyfTable)))
+		glyphData[glyphID] = gvar.compileVariations(getPhantomVariations(variations, 0), 0)
+	return glyphData
+
+def removeGlyphVariations(ttx,glyphs):
+	# removes the 'gvar' deltas of the outlines of glyphs; call before blanking them
+	gvar = getGlyphVariations(ttx)
+	if gvar is None:
 		return
-	for glyphname in ttx["hmtx"].metrics: # this is a dict!
-		if glyphname in glyphs_removeOutlinesAndInstructions:
-			try: 
-				ttx["hmtx"].metrics[glyphname][1] = 0
-			except: 
-				pass
-
-def renameFont(ttx):
+	for glyphID, data in getBlankedGlyphVariationData(ttx, gvar, glyphs).iteritems():
+		gvar.glyphData[glyphID] = data
+
+def getEmptyDeltaSet(store):
+	# the index of a delta set without deltas in an ItemVariationStore; adds one if there is none
+	for major, varData in enumerate(store.VarData):
+		for minor, item in enumerate(varData.Item):
+			if not [delta for delta in item if delta]:
+				return (major << 16) + minor
+	varData = store.VarData[-1]
+	varData.Item += [[0] * len(varData.VarRegionIndex)]
+	varData.ItemCount = len(varData.Item)
+	return ((len(store.VarData) - 1) << 16) + len(varData.Item) - 1
+
+def removeMetricsVariations(ttx,glyphs):
+	# the side bearings of blanked glyphs don't vary: points their 'HVAR' and 'VVAR'
+	# side bearing entries at a delta set without deltas, and removes the delta sets
+	# that nothing uses any more; the advances keep varying
+	for tag in sorted(SIDE_BEARING_VARIATION_MAPS):
+		if tag not in ttx:
+			continue
+		table = ttx[tag].table
+		varIdxMaps = [m for m in [getattr(table, name, None) for name in SIDE_BEARING_VARIATION_MAPS[tag]] if m]
+		if not varIdxMaps or not table.VarStore.VarData:
+			continue
+		emptyDeltaSet = getEmptyDeltaSet(table.VarStore)
+		for varIdxMap in varIdxMaps:
+			for n in glyphs:
+				varIdxMap.mapping[n] = emptyDeltaSet
+		advanceMap = getattr(table, ADVANCE_VARIATION_MAPS[tag], None)
+		if advanceMap:
+			varIdxMaps += [advanceMap]
+			used = set()
+		else:
+			used = set(range(len(ttx.getGlyphOrder()))) # the advances are indexed by glyph ID
+		for varIdxMap in varIdxMaps:
+			used.update(varIdxMap.mapping.values())
+		newVarIdxs = table.VarStore.subset_varidxes(used, retainFirstMap=not advanceMap)
+		for varIdxMap in varIdxMaps:
+			varIdxMap.mapping = dict((n, newVarIdxs[varIdx]) for n, varIdx in varIdxMap.mapping.iteritems())
+
+def getAdvanceDeltas(ttx,name):
+	# the 'HVAR' and 'VVAR' region indices and deltas of the advances of a glyph
+	deltas = []
+	for tag in sorted(ADVANCE_VARIATION_MAPS):
+		if tag in ttx:
+			table = ttx[tag].table
+			advanceMap = getattr(table, ADVANCE_VARIATION_MAPS[tag], None)
+			varIdx = advanceMap.mapping[name] if advanceMap else ttx.getGlyphID(name)
+			varData = table.VarStore.VarData[varIdx >> 16]
+			deltas += [(list(varData.VarRegionIndex), list(varData.Item[varIdx & 0xFFFF]))]
+	return deltas
+
+# Duplicate outlines: glyphs whose compiled 'glyf' data (contours, or component
+# references with their transforms, and instructions) is byte-identical. Each
+# duplicate becomes a composite of one component, the glyph with the lowest ID;
+# if nothing but 'cmap' refers to a duplicate, it is blanked instead and its
+# codepoints are mapped to that glyph.
+COMPOSITE_REFERENCE_SIZE = 16 # header with bbox, one component with byte offsets
+ALIAS_BLOCKING_TABLES = ["COLR", "SVG ", "sbix", "CBDT", "EBDT", "bdat", "MATH", "JSTF", "BASE"] # refer to glyph IDs
+
+def getGlyphData(glyph,glyfTable):
+	# the compiled data of a glyph, without expanding it
+	if hasattr(glyph, "data"):
+		return glyph.data
+	if not glyph.numberOfContours:
+		return ""
+	return glyph.compile(glyfTable)
+
+def getComponentIDs(data):
+	# the glyph IDs of the components of a compiled composite glyph
+	ids = []
+	pos = 10
+	flags = MORE_COMPONENTS
+	while flags & MORE_COMPONENTS and pos + 4 <= len(data):
+		flags, glyphID = unpack(">HH", data[pos:pos+4])
+		ids += [glyphID]
+		pos += 4 + (4 if flags & ARG_1_AND_2_ARE_WORDS else 2)
+		if flags & WE_HAVE_A_SCALE:
+			pos += 2
+		elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+			pos += 4
+		elif flags & WE_HAVE_A_TWO_BY_TWO:
+			pos += 8
+	return ids
+
+def getCompositeMaxpValues(glyphID,glyphDatas,cache):
+	# (points, contours, component depth) of a glyph as a component, from its compiled data
+	if glyphID in cache:
+		return cache[glyphID]
+	cache[glyphID] = (0, 0, 0) # against component cycles in broken fonts
+	data = glyphDatas[glyphID] if glyphID < len(glyphDatas) else ""
+	if len(data) < 10:
+		values = (0, 0, 0)
+	else:
+		numberOfContours = unpack(">h", data[:2])[0]
+		if numberOfContours >= 0:
+			endPts = unpack(">%dH" % numberOfContours, data[10:10+2*numberOfContours])
+			values = (endPts[-1] + 1 if endPts else 0, numberOfContours, 0)
+		else:
+			values = (0, 0, 0)
+			for componentID in getComponentIDs(data):
+				points, contours, depth = getCompositeMaxpValues(componentID, glyphDatas, cache)
+				values = (values[0] + points, values[1] + contours, max(values[2], depth + 1))
+	cache[glyphID] = values
+	return values
+
+def findDuplicateGlyphs(glyphDatas,variationDatas=None):
+	# [(canonical glyph ID, [duplicate glyph IDs])] of the glyphs whose data is
+	# identical and longer than a reference to another glyph; in a variable font,
+	# their 'gvar' data (variationDatas) must be identical too
+	groups = {}
+	for glyphID, data in enumerate(glyphDatas):
+		if len(data) > COMPOSITE_REFERENCE_SIZE:
+			key = (data, variationDatas[glyphID]) if variationDatas else data
+			groups.setdefault(key, []).append(glyphID)
+	return sorted([(ids[0], ids[1:]) for ids in groups.itervalues() if len(ids) > 1])
+
+def getPaddedSize(size):
+	# fontTools pads each glyph to 4 bytes
+	return (size + 3) & ~3
+
+def getReferencedGlyphs(ttx,candidates):
+	# the glyphs of candidates that a table other than 'cmap', 'glyf' and the
+	# 'GDEF' class defs refers to (those are compared by the caller)
+	referenced = set()
+	seen = set()
+	def walk(value):
+		if isinstance(value, basestring):
+			if value in candidates:
+				referenced.add(value)
+		elif isinstance(value, (list, tuple)):
+			for v in value:
+				walk(v)
+		elif isinstance(value, dict):
+			for k, v in value.iteritems():
+				walk(k)
+				walk(v)
+		elif hasattr(value, "__dict__") and id(value) not in seen:
+			seen.add(id(value))
+			if hasattr(value, "ensureDecompiled"):
+				value.ensureDecompiled()
+			for k, v in vars(value).items():
+				if k not in ("GlyphClassDef", "MarkAttachClassDef", "font", "reader"):
+					walk(v)
+	for tag in ["GSUB", "GPOS", "GDEF"]:
+		if tag in ttx:
+			walk(ttx[tag].table)
+	if "kern" in ttx:
+		for kernTable in getattr(ttx["kern"], "kernTables", []):
+			walk(getattr(kernTable, "kernTable", {}))
+	return referenced
+
+def getAliasableGlyphs(ttx,duplicates,glyphOrder,glyphDatas):
+	# the duplicates that may be replaced by their canonical glyph in 'cmap':
+	# only 'cmap' refers to them, and they have the same metrics and GDEF classes
+	if [tag for tag in ALIAS_BLOCKING_TABLES if tag in ttx]:
+		return set()
+	components = set()
+	for data in glyphDatas:
+		if len(data) >= 10 and unpack(">h", data[:2])[0] < 0:
+			components.update(getComponentIDs(data))
+	candidates = set([glyphOrder[d] for canonical, dups in duplicates for d in dups if d not in components])
+	candidates -= getReferencedGlyphs(ttx, candidates)
+	metricsTables = [ttx[tag].metrics for tag in ["hmtx", "vmtx"] if tag in ttx]
+	classDefs = []
+	if "GDEF" in ttx:
+		for name in ["GlyphClassDef", "MarkAttachClassDef"]:
+			classDef = getattr(ttx["GDEF"].table, name, None)
+			if classDef:
+				classDefs += [classDef.classDefs]
+	aliasable = set()
+	for canonical, dups in duplicates:
+		canonicalName = glyphOrder[canonical]
+		for d in dups:
+			name = glyphOrder[d]
+			if name not in candidates:
+				continue
+			if [m for m in metricsTables if m.get(name) != m.get(canonicalName)]:
+				continue
+			if getAdvanceDeltas(ttx, name) != getAdvanceDeltas(ttx, canonicalName):
+				continue
+			if [c for c in classDefs if c.get(name, 0) != c.get(canonicalName, 0)]:
+				continue
+			aliasable.add(name)
+	return aliasable
+
+def aliasCmapGlyphs(ttx,aliases):
+	# maps the codepoints of the glyphs in aliases (a dict of glyph name: glyph name) to the other glyphs
+	for table in ttx["cmap"].tables:
+		if table.format == 14:
+			for uvs, mappings in table.uvsDict.items():
+				table.uvsDict[uvs] = [(u, aliases.get(g, g)) for u, g in mappings]
+		else:
+			for u, g in table.cmap.items():
+				if g in aliases:
+					table.cmap[u] = aliases[g]
+
+def removeDuplicateOutlines(ttx,log):
+	# returns (number of glyphs made composites, number of glyphs aliased in 'cmap', bytes saved)
+	if "glyf" not in ttx:
+		return 0, 0, 0
+	glyfTable = ttx["glyf"]
+	glyphOrder = ttx.getGlyphOrder()
+	glyphDatas = [getGlyphData(glyfTable.glyphs[n], glyfTable) for n in glyphOrder]
+	gvar = getGlyphVariations(ttx)
+	duplicates = findDuplicateGlyphs(glyphDatas, gvar.glyphData if gvar else None)
+	if not duplicates:
+		return 0, 0, 0
+	aliasable = getAliasableGlyphs(ttx, duplicates, glyphOrder, glyphDatas)
+	metrics = ttx["hmtx"].metrics
+	newData = {}
+	aliases = {}
+	saved = 0
+	for canonical, dups in duplicates:
+		canonicalName = glyphOrder[canonical]
+		data = glyphDatas[canonical]
+		for d in dups:
+			name = glyphOrder[d]
+			if name in aliasable:
+				aliases[name] = canonicalName
+				saved += getPaddedSize(len(data))
+				continue
+			flags = ARGS_ARE_XY_VALUES
+			if metrics.get(name) == metrics.get(canonicalName):
+				flags |= USE_MY_METRICS
+			# same bounding box as the canonical glyph, so 'hmtx' and 'head' stay right:
+			newData[name] = pack(">h", -1) + data[2:10] + pack(">HHbb", flags, canonical, 0, 0)
+			saved += getPaddedSize(len(data)) - COMPOSITE_REFERENCE_SIZE
+			if gvar and gvar.glyphData[d]:
+				# the component doesn't move, the phantom points vary the metrics as before:
+				variations = getPhantomVariations(gvar.getVariations(d, getPointCount(data)), 1)
+				variationData = gvar.compileVariations(variations, 1)
+				saved += len(gvar.glyphData[d]) - len(variationData)
+				gvar.glyphData[d] = variationData
+	setGlyphData(glyfTable, newData)
+	# the new composites, and the composites that use a duplicate as a component,
+	# may be deeper or have more points than the composites before:
+	for name, data in newData.iteritems():
+		glyphDatas[ttx.getGlyphID(name)] = data
+	maxp = ttx["maxp"]
+	maxpCache = {}
+	for glyphID, data in enumerate(glyphDatas):
+		if len(data) >= 10 and unpack(">h", data[:2])[0] < 0:
+			points, contours, depth = getCompositeMaxpValues(glyphID, glyphDatas, maxpCache)
+			maxp.maxCompositePoints   = max(maxp.maxCompositePoints,   points)
+			maxp.maxCompositeContours = max(maxp.maxCompositeContours, contours)
+			maxp.maxComponentDepth    = max(maxp.maxComponentDepth,    depth)
+	if newData:
+		maxp.maxComponentElements = max(maxp.maxComponentElements, 1)
+	if aliases:
+		removeOutlines(ttx, sorted(aliases), log)
+		aliasCmapGlyphs(ttx, aliases)
+	log("Replaced %s duplicate glyphs with references to identical glyphs and mapped %s in 'cmap' to them, saving about %s bytes." % (len(newData), len(aliases), saved))
+	return len(newData), len(aliases), saved
+
+# name records that renameFont() changes, with and without a space after the addition:
+RENAME_NAME_IDS_WITH_SPACE    = [1,16,21, 3, 4,18]
+RENAME_NAME_IDS_WITHOUT_SPACE = [6, 20]
+
+def renameFont(ttx,renameFontAddition):
 	# string is prepared only for Win platform name strings ...
 	space         = "".join([ pack(">"+"H",ord(char)) for char in                                                    " " ]) ; char=None
-	renameWith    = "".join([ pack(">"+"H",ord(char)) for char in RENAME_FONT_ADDITION.strip().strip("'").strip('"')+" " ]) ; char=None
-	renameWithout = "".join([ pack(">"+"H",ord(char)) for char in RENAME_FONT_ADDITION.strip().strip("'").strip('"')     ]) ; char=None
+	renameWith    = "".join([ pack(">"+"H",ord(char)) for char in renameFontAddition.strip().strip("'").strip('"')+" " ]) ; char=None
+	renameWithout = "".join([ pack(">"+"H",ord(char)) for char in renameFontAddition.strip().strip("'").strip('"')     ]) ; char=None
 	# check font names:
 #	id1 = ""
 #	id4 = ""
@@ -518,14 +1447,11 @@ def renameFont(ttx):
 #			id6 = deepcopy(ttx["name"].names[nIdx].string)
 #		elif ttx["name"].names[nIdx].nameID == 1:
 #			id1 = deepcopy(ttx["name"].names[nIdx].string)
-	# strings with and without spaces:
-	namesWithSpaces    = [1,16,21, 3, 4,18]
-	namesWithoutSpaces = [6, 20]
 	# adjust font names:
 	for nIdx in range(len(ttx["name"].names)-1,-1,-1):
-		if   ttx["name"].names[nIdx].nameID in namesWithSpaces: # addition with space
+		if   ttx["name"].names[nIdx].nameID in RENAME_NAME_IDS_WITH_SPACE: # addition with space
 			ttx["name"].names[nIdx].string = renameWith    + ttx["name"].names[nIdx].string
-		elif ttx["name"].names[nIdx].nameID in namesWithoutSpaces: # addition without space
+		elif ttx["name"].names[nIdx].nameID in RENAME_NAME_IDS_WITHOUT_SPACE: # addition without space
 			ttx["name"].names[nIdx].string = renameWithout + ttx["name"].names[nIdx].string
 	# I add space before the name so all testfonts
 	# can be found in one range in font menus ...
@@ -541,134 +1467,224 @@ def removeAllButWinCmapSubtable(ttx):
 			del ttx["cmap"].tables[tIdx]	
 
 # continue here:
-def removeGPOSkern(ttx,glyphs_removeOutlinesAndInstructions):
+def getFeatureSubstitutionRecords(table):
+	# the FeatureTableSubstitutionRecords of the 'GSUB' or 'GPOS' FeatureVariations,
+	# which replace the features of the FeatureList on some regions of a variable font
+	featureVariations = getattr(table, "FeatureVariations", None)
+	if not featureVariations:
+		return []
+	return [s for r in featureVariations.FeatureVariationRecord for s in r.FeatureTableSubstitution.SubstitutionRecord]
+
+def getFeatureLookupIndices(table,featureTags):
+	# sorted indices of all lookups used by the given features, also where FeatureVariations replace them
+	lookupIndices = set()
+	for r in table.FeatureList.FeatureRecord:
+		if r.FeatureTag in featureTags:
+			lookupIndices.update(int(l) for l in r.Feature.LookupListIndex)
+	for s in getFeatureSubstitutionRecords(table):
+		if table.FeatureList.FeatureRecord[s.FeatureIndex].FeatureTag in featureTags:
+			lookupIndices.update(int(l) for l in s.Feature.LookupListIndex)
+	return sorted(lookupIndices)
+
+def removeGPOSkern(ttx,glyphs_removeOutlinesAndInstructions,log):
+	# returns the number of removed glyph pairs (Format 1) and classes (Format 2)
+	removedPairs = removedClasses = 0
 	if not glyphs_removeOutlinesAndInstructions:
-		return
-	lookupIndices = []
-	for r in ttx["GPOS"].table.FeatureList.FeatureRecord:
-		if r.FeatureTag == "kern":
-			for l in r.Feature.LookupListIndex:
-				if l not in lookupIndices:
-					lookupIndices += [int( l )]
-#	print "lookupIndices",lookupIndices
-	for lIdx in lookupIndices:
-		lookup = ttx["GPOS"].table.LookupList.Lookup[lIdx]
-#		print lookup.LookupType
-		if lookup.LookupType in [2,9]:
-#			print dir(lookup)
-			for s in lookup.SubTable:
-				if lookup.LookupType == 2:
-					subtable = s
-				elif lookup.LookupType == 9 and s.ExtensionLookupType == 2:
-					subtable = s.ExtSubTable
-				else:
+		return removedPairs, removedClasses
+	# a set, so that each membership test below is O(1):
+	glyphs_removeOutlinesAndInstructions = frozenset(glyphs_removeOutlinesAndInstructions)
+	for subtable in getKernSubtables(ttx):
+		if subtable.Format == 1:
+			# one pass over coverage and pair sets, keeping what isn't removed:
+			coverage = []
+			pairSets = []
+			for g, p in zip(subtable.Coverage.glyphs, subtable.PairSet):
+				if g in glyphs_removeOutlinesAndInstructions:
+					removedPairs += len(p.PairValueRecord)
 					continue
-#				print "subtable",dir(subtable)
-				if subtable.Format == 1:
-#					print "ppf1"
-					delPairSets = []
-					# coverage table:
-					for gIdx in range(len(subtable.Coverage.glyphs)-1,-1,-1):
-						if subtable.Coverage.glyphs[gIdx] in glyphs_removeOutlinesAndInstructions:
-							del subtable.Coverage.glyphs[gIdx]
-							delPairSets += [int(gIdx)]
-					# pair sets:
-					for pIdx in range(len(subtable.PairSet)-1,-1,-1):
-						if pIdx in delPairSets:
-							del subtable.PairSet[pIdx]
-						else:
-							p = subtable.PairSet[pIdx]
-							for pvIdx in range(len(p.PairValueRecord)-1,-1,-1):
-								if p.PairValueRecord[pvIdx].SecondGlyph in glyphs_removeOutlinesAndInstructions:
-									del p.PairValueRecord[pvIdx]
-				elif subtable.Format == 2 and PPF2_SUPPORTED:
-					# coverage table:
-					for gIdx in range(len(subtable.Coverage.glyphs)-1,-1,-1):
-						if subtable.Coverage.glyphs[gIdx] in glyphs_removeOutlinesAndInstructions:
-							del subtable.Coverage.glyphs[gIdx]
-					# class defs:
-					class1Before = cleanUpList([ int(subtable.ClassDef1.classDefs[g]) for g in subtable.ClassDef1.classDefs ]+[0]) # includes 0
-					class2Before = cleanUpList([ int(subtable.ClassDef2.classDefs[g]) for g in subtable.ClassDef2.classDefs ]+[0]) # includes 0
-					glyphs1 = subtable.ClassDef1.classDefs.keys()
-					class1glyphs = {}
-					class2glyphs = {}
-					for g1 in glyphs1:
-						try:    class1glyphs[ subtable.ClassDef1.classDefs[g1] ] += [g1]
-						except: class1glyphs[ subtable.ClassDef1.classDefs[g1] ]  = [g1]
-						if g1 in glyphs_removeOutlinesAndInstructions:
-							del subtable.ClassDef1.classDefs[g1]
-					glyphs2 = subtable.ClassDef2.classDefs.keys()
-					for g2 in glyphs2:
-						try:    class2glyphs[ subtable.ClassDef2.classDefs[g2] ] += [g2]
-						except: class2glyphs[ subtable.ClassDef2.classDefs[g2] ]  = [g2]
-						if g2 in glyphs_removeOutlinesAndInstructions:
-							del subtable.ClassDef2.classDefs[g2]
-					class1After = cleanUpList([ int(subtable.ClassDef1.classDefs[g]) for g in subtable.ClassDef1.classDefs ]+[0]) # includes 0
-					class2After = cleanUpList([ int(subtable.ClassDef2.classDefs[g]) for g in subtable.ClassDef2.classDefs ]+[0]) # includes 0
-					if VERBOSE: print "class1glyphs",class1glyphs
-					if VERBOSE: print "class2glyphs",class2glyphs
-					# THE PART BELOW IS NOT TESTED YET:
-					# class count:
-					# (mind that deleting glyphs from classes
-					# does not necessarily result in the class being deleted)
-					correctClass1 = 0
-					if subtable.Class1Count != len(class1After):
-						correctClass1 = 1
-						if VERBOSE: print "Deleted %s class1!" % (subtable.Class1Count-len(class1After))
-						subtable.Class1Count = len(class1After)
-					correctClass2 = 0
-					if subtable.Class2Count != len(class2After):
-						correctClass2 = 1
-						if VERBOSE: print "Deleted %s class2!" % (subtable.Class2Count-len(class2After))
-						subtable.Class2Count = len(class2After)
-					# class records:
-					for c1idx in range(len(subtable.Class1Record)-1,-1,-1):
-						if c1idx not in class1After:
-							del subtable.Class1Record[c1idx]
-						else:
-							for c2idx in range(len(subtable.Class1Record[c1idx].Class2Record)-1,-1,-1):
-								if c2idx not in class2After:
-									del subtable.Class1Record[c1idx].Class2Record[c2idx]
-					# adjust class defs:
-					if VERBOSE: print "class1After",class1After
-					if VERBOSE: print "class2After",class2After
-					if correctClass1:
-						for c1aIdx in range(len(class1After)):
-							if class1After[c1aIdx] != c1aIdx: # c1aIdx is new index, class1After[c1aIdx] is old index
-								for g in class1glyphs[ class1After[c1aIdx] ]:
-									if g not in glyphs_removeOutlinesAndInstructions:
-										subtable.ClassDef1.classDefs[g] = c1aIdx
-					if correctClass2:
-						for c2aIdx in range(len(class2After)):
-							if class2After[c2aIdx] != c2aIdx: # c1aIdx is new index, class1After[c1aIdx] is old index
-								for g in class2glyphs[ class2After[c1aIdx] ]:
-									if g not in glyphs_removeOutlinesAndInstructions:
-										subtable.ClassDef2.classDefs[g] = c2aIdx
+				pairCount = len(p.PairValueRecord)
+				p.PairValueRecord = [r for r in p.PairValueRecord if r.SecondGlyph not in glyphs_removeOutlinesAndInstructions]
+				p.PairValueCount = len(p.PairValueRecord)
+				removedPairs += pairCount - p.PairValueCount
+				coverage += [g]
+				pairSets += [p]
+			subtable.Coverage.glyphs = coverage
+			subtable.PairSet = pairSets
+			subtable.PairSetCount = len(pairSets)
+		elif subtable.Format == 2:
+			removedClasses += removePairPosFormat2Glyphs(subtable,glyphs_removeOutlinesAndInstructions,log)
+	return removedPairs, removedClasses
 
-def addCcmpLookup(ttx,ccmpSubs):
-	if not ccmpSubs:
-		return
+def getKernTablePairs(ttx):
+	# the pair dicts of the format 0 subtables of the legacy 'kern' table; the tool
+	# can't change the other formats, which fontTools keeps as raw data
+	if "kern" not in ttx:
+		return []
+	return [t.kernTable for t in getattr(ttx["kern"], "kernTables", []) if t.format == 0 and hasattr(t, "kernTable")]
+
+def removeKernTablePairs(ttx,glyphs_removeOutlinesAndInstructions):
+	# removes the pairs with a blanked glyph from the legacy 'kern' table; returns their number
+	glyphs_removeOutlinesAndInstructions = frozenset(glyphs_removeOutlinesAndInstructions)
+	removedPairs = 0
+	for pairs in getKernTablePairs(ttx):
+		for pair in [pair for pair in pairs if pair[0] in glyphs_removeOutlinesAndInstructions or pair[1] in glyphs_removeOutlinesAndInstructions]:
+			del pairs[pair]
+			removedPairs += 1
+	return removedPairs
+
+def getKernSubtables(ttx):
+	# the PairPos subtables of the 'kern' feature, also from Extension lookups
+	subtables = []
+	for lIdx in getFeatureLookupIndices(ttx["GPOS"].table,["kern"]):
+		lookup = ttx["GPOS"].table.LookupList.Lookup[lIdx]
+		for s in lookup.SubTable:
+			if lookup.LookupType == 2:
+				subtables += [s]
+			elif lookup.LookupType == 9 and s.ExtensionLookupType == 2:
+				subtables += [s.ExtSubTable]
+	return subtables
+
+def getPairPosFormat2Classes(subtable,glyphs_removeOutlinesAndInstructions):
+	# the old indices of the classes that keep at least one glyph, in their new order;
+	# class 0 holds all glyphs not listed in a class def, so it is always kept
+	class1After = set([0])
+	for g, c in subtable.ClassDef1.classDefs.iteritems():
+		if g not in glyphs_removeOutlinesAndInstructions:
+			class1After.add(c)
+	class2After = set([0])
+	for g, c in subtable.ClassDef2.classDefs.iteritems():
+		if g not in glyphs_removeOutlinesAndInstructions:
+			class2After.add(c)
+	return sorted(class1After), sorted(class2After)
+
+def removePairPosFormat2Glyphs(subtable,glyphs_removeOutlinesAndInstructions,log):
+	# returns the number of removed classes
+	# coverage table:
+	subtable.Coverage.glyphs = [g for g in subtable.Coverage.glyphs if g not in glyphs_removeOutlinesAndInstructions]
+	# class defs:
+	class1After, class2After = getPairPosFormat2Classes(subtable,glyphs_removeOutlinesAndInstructions)
+	classDefs1 = subtable.ClassDef1.classDefs
+	classDefs2 = subtable.ClassDef2.classDefs
+	for classDefs in [classDefs1, classDefs2]:
+		for g in glyphs_removeOutlinesAndInstructions.intersection(classDefs):
+			del classDefs[g]
+	removedClasses = subtable.Class1Count-len(class1After) + subtable.Class2Count-len(class2After)
+	if not removedClasses:
+		return 0
+	log("Deleted %s class1 and %s class2 from class kerning subtable" % (subtable.Class1Count-len(class1After), subtable.Class2Count-len(class2After)))
+	# renumber the remaining classes:
+	class1New = dict((c, i) for i, c in enumerate(class1After))
+	class2New = dict((c, i) for i, c in enumerate(class2After))
+	for g in classDefs1:
+		classDefs1[g] = class1New[classDefs1[g]]
+	for g in classDefs2:
+		classDefs2[g] = class2New[classDefs2[g]]
+	# shrink the Class1Record x Class2Record matrix:
+	class1Records = [subtable.Class1Record[c1] for c1 in class1After]
+	for r in class1Records:
+		r.Class2Record = [r.Class2Record[c2] for c2 in class2After]
+	subtable.Class1Record = class1Records
+	subtable.Class1Count = len(class1After)
+	subtable.Class2Count = len(class2After)
+	return removedClasses
+
+
+# The 'ccmp' lookup holds MultipleSubst subtables of at most MAX_SUBTABLE_SIZE bytes,
+# so their 16-bit offsets to their Coverage and Sequences can't overflow. Glyphs with
+# the same decomposition go into the same subtable, which stores the Sequence once.
+# If 'GSUB' may outgrow 16-bit offsets, the lookup becomes an Extension lookup, whose
+# subtables fontTools writes at the end of the table with 32-bit offsets: compiling
+# 'GSUB' then doesn't run into an overflow, which fontTools resolves by starting over.
+MAX_SUBTABLE_SIZE       = 0xFFFF
+EXTENSION_SUBTABLE_SIZE = 8
+
+def getMultipleSubstSize(glyphCount,sequence):
+	# the most bytes glyphCount glyphs with the same Sequence add to a MultipleSubst subtable:
+	# their Sequence offsets and Coverage format 1 entries (format 2 is only used if smaller)
+	return 2 * glyphCount + 2 * glyphCount + 2 + 2 * len(sequence)
+
+def splitCcmpSubs(ccmpSubs):
+	# ccmpSubs split into the ccmpSubs of each subtable of the 'ccmp' lookup, in glyph order
+	glyphs = {} # decomposition: glyphs
+	decompositions = []
+	for g, decomposition in ccmpSubs:
+		if tuple(decomposition) not in glyphs:
+			glyphs[tuple(decomposition)] = []
+			decompositions += [tuple(decomposition)]
+		glyphs[tuple(decomposition)] += [g]
+	groups = [[]]
+	size = 6 + 4 # MultipleSubst and Coverage headers
+	for decomposition in decompositions:
+		added = getMultipleSubstSize(len(glyphs[decomposition]), decomposition)
+		if groups[-1] and size + added > MAX_SUBTABLE_SIZE:
+			groups += [[]]
+			size = 6 + 4
+		groups[-1].extend(glyphs[decomposition])
+		size += added
+	position = dict((g, i) for i, (g, decomposition) in enumerate(ccmpSubs))
+	return [sorted([ccmpSubs[position[g]] for g in subtableGlyphs], key=lambda sub: position[sub[0]]) for subtableGlyphs in groups if subtableGlyphs]
+
+def getCcmpLookupSize(ttx,subtables,extension):
+	# bytes of the lookup addCcmpLookup() adds, for the ccmpSubs of each subtable
+	size = 6 + 2 * len(subtables)
+	for ccmpSubs in subtables:
+		size += 6 + 2 * len(ccmpSubs) # MultipleSubst with Sequence offsets
+		size += estimateCoverageSize(ttx,[g[0] for g in ccmpSubs])
+		size += sum([2 + 2 * len(sequence) for sequence in set([tuple(g[1]) for g in ccmpSubs])])
+		if extension:
+			size += EXTENSION_SUBTABLE_SIZE
+	return size
+
+def needsExtensionLookup(ttx,subtables):
+	# whether 'GSUB' with the lookup for these subtables may outgrow 16-bit offsets
+	if ttx.reader is not None and "GSUB" in ttx.reader:
+		gsubSize = ttx.reader.tables["GSUB"].length
+	else:
+		gsubSize = len(ttx.getTableData("GSUB"))
+	return gsubSize + getCcmpLookupSize(ttx,subtables,0) > 0xFFFF
 
-	# create new ccmp subtable:
+def makeMultipleSubst(ccmpSubs):
 	subtable = MultipleSubst()
 	subtable.LookupType = 2
 	subtable.Format = 1
 	subtable.Coverage = Coverage()
 	subtable.Coverage.glyphs = [g[0] for g in ccmpSubs]
-	sequence = []
+	sequences = {} # glyphs with the same decomposition share its Sequence
 	for g in ccmpSubs:
-		s = Sequence()
-		s.GlyphCount = len(g[1])
-		s.Substitute = list(g[1])
-		sequence += [s]
-	subtable.Sequence = sequence
+		if tuple(g[1]) not in sequences:
+			s = Sequence()
+			s.GlyphCount = len(g[1])
+			s.Substitute = list(g[1])
+			sequences[tuple(g[1])] = s
+	subtable.Sequence = [sequences[tuple(g[1])] for g in ccmpSubs]
+	# newer fontTools compile MultipleSubst from the mapping, not from Coverage and Sequence:
+	subtable.mapping = dict((g[0], sequences[tuple(g[1])].Substitute) for g in ccmpSubs)
+	return subtable
+
+def makeExtensionSubst(subtable):
+	extension = ExtensionSubst()
+	extension.Format = 1
+	extension.ExtensionLookupType = subtable.LookupType
+	extension.ExtSubTable = subtable
+	return extension
+
+def addCcmpLookup(ttx,ccmpSubs):
+	if not ccmpSubs:
+		return
 
-	# create new lookup as wrapper for subtable:
+	# create new ccmp subtables:
+	subtables = splitCcmpSubs(ccmpSubs)
+
+	# create new lookup as wrapper for subtables:
 	lookup = Lookup()
-	lookup.LookupType = 2
 	lookup.LookupFlag = 0
-	lookup.SubTable = [subtable]
-	lookup.SubTableCount = 1
+	if needsExtensionLookup(ttx,subtables):
+		lookup.LookupType = 7
+		lookup.SubTable = [makeExtensionSubst(makeMultipleSubst(s)) for s in subtables]
+	else:
+		lookup.LookupType = 2
+		lookup.SubTable = [makeMultipleSubst(s) for s in subtables]
+	lookup.SubTableCount = len(lookup.SubTable)
 	
 	# add lookup to lookup list:
 	ttx["GSUB"].table.LookupList.Lookup += [lookup]
@@ -682,6 +1698,11 @@ def addCcmpLookup(ttx,ccmpSubs):
 		if r.FeatureTag == "ccmp":
 			r.Feature.LookupListIndex += [int(newLookupIdx)]
 		featureTags += [r.FeatureTag]
+	# and to the ccmp features that FeatureVariations substitute for them:
+	substitutionRecords = getFeatureSubstitutionRecords(ttx["GSUB"].table)
+	for s in substitutionRecords:
+		if featureTags[s.FeatureIndex] == "ccmp" and int(newLookupIdx) not in s.Feature.LookupListIndex:
+			s.Feature.LookupListIndex += [int(newLookupIdx)]
 	if "ccmp" not in featureTags:
 		# determine location of feature record:
 		featureTags += ["ccmp"]
@@ -695,6 +1716,9 @@ def addCcmpLookup(ttx,ccmpSubs):
 		fr.Feature.LookupCount     = 1
 		fr.Feature.LookupListIndex = [int(newLookupIdx)]
 		ttx["GSUB"].table.FeatureList.FeatureRecord[ccmpIdx:ccmpIdx] = [fr]
+		for s in substitutionRecords:
+			if s.FeatureIndex >= ccmpIdx:
+				s.FeatureIndex += 1 # the FeatureVariations refer to the features that follow by index too
 		# add feature to script/lang:
 		for scriptRecord in ttx["GSUB"].table.ScriptList.ScriptRecord:
 			# add feature's idx to scriptRecord.Script.DefaultLangSys:
@@ -719,175 +1743,2704 @@ def removePostNames(ttx):
 
 def addDummyDSIG(ttx):
 	dsig = newTable("DSIG")
-	dsig.data = "\x00\x00\x00\01\x00\x00\x00\x00"
+	# version 1, no signatures, no flags; compiles to "\x00\x00\x00\01\x00\x00\x00\x00":
+	dsig.ulVersion = 1
+	dsig.usNumSigs = 0
+	dsig.usFlag = 0
+	dsig.signatureRecords = []
 	ttx["DSIG"] = dsig
 
-def main(inPath, outPath): 
-	if VERBOSE: print "Dieting %s..." % (os.path.basename(inPath))
-	try:
-		ttx = TTFont(inPath)
-	except TTLibError:
-		print "Cannot open %s" % inPath
-		sys.exit(2)
-	cmap = ttx["cmap"].getcmap(3,10)
-	if not cmap: 
-		cmap = ttx["cmap"].getcmap(3,1)
-	if cmap: 
-		umap = dict((u,n) for u, n in cmap.cmap.iteritems() )
-#		nmap = dict((umap[k], k) for k in umap)
-# glyph may be associated with more than one u!!!
-		nmap = {}
-		for k in umap:
-			nmap.setdefault(umap[k],[]).append(k)
-	else:
-		if VERBOSE: print "'cmap' table misses a Windows-platform subtable."
+def getDietedTables(options,decomposed):
+	# tags of the tables dietFont() may change with these options;
+	# all other tables are only read from
+	tags = set(["head"]) # modification timestamp
+	if decomposed:
+		if options.removePrecomposedOutlines:
+			tags.update(["glyf", "loca", "CFF ", "CFF2", "hmtx", "hhea", "gvar", "HVAR", "VVAR", "vmtx", "vhea", "VORG", "LTSH"])
+		if options.removePrecomposedFromGposKern:
+			tags.update(["GPOS", "kern"])
+		if options.decomposePrecomposedInCcmp:
+			tags.add("GSUB")
+	tags.add("GDEF") # testFont() adds missing mark glyphs to the GlyphClassDef even without correctMarkClass
+	if options.removeAllButWinCmapSubtables:
+		tags.add("cmap")
+	if options.removeAllButWinNameRecords or options.renameFont:
+		tags.add("name")
+	if options.removePostGlyphnames:
+		tags.add("post")
+	if options.addDummyDsig:
+		tags.add("DSIG")
+	if options.removeDuplicateOutlines:
+		tags.update(["glyf", "loca", "hmtx", "hhea", "maxp", "cmap", "gvar", "HVAR", "VVAR", "vmtx", "vhea", "VORG", "LTSH"])
+	return tags
+
+def passThroughTables(ttx,dietedTables):
+	# forgets the decompiled tables the diet only read from,
+	# so that ttx.save() copies their raw bytes instead of recompiling them
+	if ttx.reader is None:
 		return
+	for tag in list(ttx.tables.keys()):
+		if tag not in dietedTables and tag in ttx.reader:
+			del ttx.tables[tag]
 
-	def getDecompositionData(u,missingMarks):
-	# inside so we can use umap, nmap ...
-			udec = None
-			try: 
-				dec = unicodedata.decomposition(unichr(u))
-				if len(dec) > 1:
-					if not dec[:1] == "<":
-						udec = [int(s, 16) for s in dec.split()]
-						decall = 0
-						for ud in udec:
-							if ud in SKIP_MARKS_FINAL: # if mark is in SKIP_MARKS_FINAL we don't want to do any decomposition
-								return 0
-							if ud in umap:
-								decall += 1
-							else:
-								if  ud not in SKIP_MARKS_FINAL \
-								and ud     in MARK_GLYPH_CODEPOINT_RANGE:
-									missingMarks += [unicodeIntToHexstr(ud)]
-	#					if decall == len(udec) and decall == 1:
-	#						print "SAME:",umap[u],[umap[ud] for ud in udec]
-						if decall == len(udec) and decall > 1: # the last condition may go for the sake of allowing reference to same-shape glyphs
-							return umap[u],[umap[ud] for ud in udec],udec[0] # last one is the one to check next
-			except ValueError: 
-				return 0
-			return 0
+def trimGlyphPadding(glyfTable):
+	# the raw glyph data still carries the input's padding,
+	# which fontTools would drop when recompiling the glyphs
+	for glyph in glyfTable.glyphs.itervalues():
+		glyph.trim()
 
-	markGlyphs = getMarkGlyphs(ttx)
-	
-	if not testFont(ttx,umap,nmap,markGlyphs):
-		if VERBOSE: print "This font is useless. Ignoring it."
+def getGlyphBounds(glyph,glyfTable):
+	# (xMin, yMin, xMax, yMax) of a glyf glyph, or None if it is empty;
+	# read from the raw glyph header, so the glyph is not expanded
+	if hasattr(glyph, "data"):
+		if len(glyph.data) < 10:
+			return None
+		numberOfContours, xMin, yMin, xMax, yMax = unpack(">hhhhh", glyph.data[:10])
+		if numberOfContours == 0:
+			return None
+		return xMin, yMin, xMax, yMax
+	if glyph.numberOfContours == 0:
+		return None
+	if not hasattr(glyph, "xMax"):
+		glyph.recalcBounds(glyfTable)
+	return glyph.xMin, glyph.yMin, glyph.xMax, glyph.yMax
+
+def getOutlineBounds(ttx,names):
+	# {name: (xMin, yMin, xMax, yMax)} of the glyphs of names that aren't empty; 'glyf'
+	# bounds come from the raw glyph headers, CFF bounds from drawing the charstrings
+	bounds = {}
+	if "glyf" in ttx:
+		glyfTable = ttx["glyf"]
+		for name in names:
+			b = getGlyphBounds(glyfTable.glyphs[name], glyfTable)
+			if b:
+				bounds[name] = b
+	elif getCffTag(ttx):
+		charStrings = getCharStrings(ttx)
+		for name in names:
+			pen = BoundsPen(None)
+			charStrings[name].draw(pen)
+			if pen.bounds:
+				bounds[name] = intRect(pen.bounds)
+	return bounds
+
+def recalcBounds(ttx):
+	# the 'head' bounding box and the 'hhea' extents, as fontTools computes them
+	# with recalcBBoxes, but without expanding every glyph when saving
+	metrics   = ttx["hmtx"].metrics
+	head      = ttx["head"]
+	hhea      = ttx["hhea"]
+	bounds = getOutlineBounds(ttx, ttx.getGlyphOrder())
+	hhea.advanceWidthMax = max(m[0] for m in metrics.values())
+	if not bounds:
+		head.xMin = head.yMin = head.xMax = head.yMax = 0
+		hhea.minLeftSideBearing = hhea.minRightSideBearing = hhea.xMaxExtent = 0
 		return
+	head.xMin = min(b[0] for b in bounds.values())
+	head.yMin = min(b[1] for b in bounds.values())
+	head.xMax = max(b[2] for b in bounds.values())
+	head.yMax = max(b[3] for b in bounds.values())
+	if "CFF " in ttx:
+		getCharStrings(ttx) # loads the top dict
+		ttx["CFF "].cff.topDictIndex[0].FontBBox = [head.xMin, head.yMin, head.xMax, head.yMax]
+	lsbs    = []
+	rsbs    = []
+	extents = []
+	allXMinIsLsb = 1
+	for name, (xMin, yMin, xMax, yMax) in bounds.iteritems():
+		advanceWidth, lsb = metrics[name]
+		lsbs    += [lsb]
+		rsbs    += [advanceWidth - lsb - (xMax - xMin)]
+		extents += [lsb + (xMax - xMin)]
+		if lsb != xMin:
+			allXMinIsLsb = 0
+	hhea.minLeftSideBearing  = min(lsbs)
+	hhea.minRightSideBearing = min(rsbs)
+	hhea.xMaxExtent          = max(extents)
+	if allXMinIsLsb:
+		head.flags = head.flags | 0x2
+	else:
+		head.flags = head.flags & ~0x2
 
-	glyphOrder = ttx.getGlyphOrder()
+def finishDiet(ttx,options,ccmpSubs):
+	# for fonts opened by openFont(): recalculates the bounds that fontTools doesn't
+	# (recalcBBoxes is off) and forgets the tables the diet only read from
+	if not ttx.recalcBBoxes and ttx.isLoaded("glyf"):
+		trimGlyphPadding(ttx["glyf"])
+		recalcBounds(ttx)
+	passThroughTables(ttx, getDietedTables(options, ccmpSubs))
 
-	glyphs_removeOutlinesAndInstructions = []
-	ccmpSubsDict = {}
-	linesDict = {}
-	missingMarks = []
-	if umap:
-		for u in umap:
-			decomp = getDecompositionData(u,missingMarks)
-			decompLast = deepcopy(decomp)
-			while decomp:
-				decomp = getDecompositionData(decomp[2],missingMarks) # check if the base char is a composed one too!
-				# cf: 01E0;LATIN CAPITAL LETTER A WITH DOT ABOVE AND MACRON;Lu;0;L;0226 0304;;;;N;LATIN CAPITAL LETTER A DOT MACRON;;;01E1;
-				if decomp:
-					decompLast[1][0:1] = deepcopy(decomp[1])
-			if decompLast:
-				ccmpSubsDict[decompLast[0]] = decompLast[1]
-				linesDict[   decompLast[0]] = "  sub %s by %s;" % (decompLast[0], " ".join(decompLast[1]))
-				glyphs_removeOutlinesAndInstructions += [decompLast[0]]
-	# sort by glyph order!
-	ccmpSubs = []
-	lines    = []
-	for g in glyphOrder:
-		try:    ccmpSubs += [(g,ccmpSubsDict[g])]
-		except: pass
-		try:    lines    += [ linesDict[g] ]
-		except: pass
-	if len(ccmpSubsDict) != len(ccmpSubs):
-		if VERBOSE: print "(Lost substitutions when creating ccmpSubs.)"
-	if len(linesDict) != len(lines):
-		if VERBOSE: print "(Lost substitutions when creating lines.)"
+# tables compiled first, because compiling them changes other tables
+# ('glyf' sets the 'loca' offsets and head.indexToLocFormat, 'hmtx' sets
+# hhea.numberOfHMetrics, 'vmtx' vhea.numberOfVMetrics); 'head' comes last:
+COMPILE_ORDER = {"glyf": 0, "loca": 1, "hmtx": 2, "vmtx": 2, "head": 4}
 
-	# report missing marks:
-	missingMarks = cleanUpList(missingMarks)
-	missingMarks.sort()
-	if missingMarks:
-		if VERBOSE: print "For more effective decomposition you might add the following marks:"
-		if VERBOSE: print " ".join(missingMarks)
-	
-	# output AFDKO syntax .fea file:
-	if len(lines):
-		ccmpfea  = [ "lookup ccmpUnicodeDecomp {" ]
-		ccmpfea += lines
-		ccmpfea += [ "} ccmpUnicodeDecomp;"       ]
-		if SAVE_FEA_FILE:
-			saveFile("\n".join(ccmpfea),os.path.splitext(outPath)[0]+".ccmp.fea")
-	else:
-		if VERBOSE: print "Nothing there to decompose."
-
-	if REMOVE_PRECOMPOSED_OUTLINES       and lines: # only makes sense if there's something to decompose
-		removeOutlines(ttx,glyphs_removeOutlinesAndInstructions)
-	if REMOVE_PRECOMPOSED_FROM_GPOS_KERN and lines: # only makes sense if there's something to decompose
-		removeGPOSkern(ttx,glyphs_removeOutlinesAndInstructions)
-	if REMOVE_ALL_BUT_WIN_CMAP_SUBTABLES:
-		removeAllButWinCmapSubtable(ttx)
-	if REMOVE_ALL_BUT_WIN_NAME_RECORDS \
-	or RENAME_FONT: # enforce removing non-Win records when renaming the font!
-		removeAllButWinNameRecords( ttx)
-	if RENAME_FONT:
-		renameFont(                 ttx)
-	if ADD_DUMMY_DSIG:
-		addDummyDSIG(               ttx)
-	if DECOMPOSE_PRECOMPOSED_IN_CCMP     and lines:# only makes sense if there's something to decompose
-		addCcmpLookup(              ttx,ccmpSubs)
-	if REMOVE_POST_GLYPHNAMES:
-		removePostNames(            ttx)
-
-	tempPath = outPath+"temp"
-	if VERBOSE: print "Saving %s..." % (outPath)
-	ttx.save( outPath )
-	ttx.close()
-	ttx = None
-	inSize = os.path.getsize(inPath)
-	outSize = os.path.getsize(outPath)
-	if VERBOSE: print "Diet efficiency: %s%% (from %s to %s bytes)" % (float(int((1 - float(outSize)/inSize) * 10000))/100, inSize, outSize)
+def canWriteFont(ttx):
+	# writeFont() handles plain sfnt fonts read from a file or bytes
+	return ttx.reader is not None and ttx.flavor is None
 
-	# validate:
-	if OTS_SANITISE: 
-		error = 0
-		try:
-			p = Popen([r"%s" % OTS_PATH_OR_COMMAND, r"%s" % outPath, r"%s" % tempPath ],stderr=PIPE)
-		except:
-			p = 0
-			if VERBOSE and OTS_SANITISE: print "ot-sanitise not found. Install https://github.com/khaledhosny/ots"
-		if p:
-			stdoutdata, stderrdata = p.communicate()
-			if stderrdata: # if no problems are found, ot-sanitise doesn't output anything
-				error = 1
-				if OTS_SANITISE:
-					print "ot-sanitise did not validate the simplified font. ", 
-					if OTS_SANITISE > 1: print "Deleting it."
-				else:
-					if VERBOSE: print "ot-sanitise validated this font."
-				for line in stderrdata.strip().replace("\r\n","\n").replace("\r","\n").split("\n"):
-					if VERBOSE: print "    %s" % line.strip()
-		p=None; stderrdata=None; stdoutdata=None
-		if error:
-			# delete ot-sanitise file
-			# and the font file since it is invalid anyway:
-			if os.path.exists( tempPath ):
-				os.remove( tempPath )
-			if os.path.exists( outPath  ) and OTS_SANITISE > 1:
-				os.remove( outPath  )
+def writeFont(ttx,outFile,inData=None):
+	# Writes ttx as an sfnt to outFile. Only the tables loaded in ttx are compiled;
+	# all others are copied as they are, from inData (the input font file, for example
+	# an mmap, written through buffer() so the bytes aren't copied in Python) or from
+	# ttx.reader, with their checksums from the input's table directory. The tables
+	# keep their order from the input. Returns the number of bytes written.
+	reader = ttx.reader
+	ttx["head"] # always compiled, for the timestamp and the checksum adjustment
+	compiled = {}
+	for tag in sorted(ttx.tables.keys(), key=lambda tag: COMPILE_ORDER.get(tag, 3)):
+		compiled[tag] = ttx.getTableData(tag)
+	compiled["head"] = compiled["head"][:8] + "\0\0\0\0" + compiled["head"][12:]
+	inputOrder = dict((tag, reader.tables[tag].offset) for tag in reader.keys())
+	tags = sorted(set(reader.keys()) | set(compiled.keys()), key=lambda tag: (inputOrder.get(tag, sys.maxint), tag))
+
+	# table directory:
+	numTables = len(tags)
+	offset = 12 + 16 * numTables
+	entries = {}
+	for tag in tags:
+		if tag in compiled:
+			length   = len(compiled[tag])
+			checkSum = calcChecksum(compiled[tag])
+		else:
+			length   = reader.tables[tag].length
+			checkSum = reader.tables[tag].checkSum
+		entries[tag] = (checkSum, offset, length)
+		offset += (length + 3) & ~3
+	searchRange, entrySelector, rangeShift = getSearchRange(numTables, 16)
+	directory = ttx.sfntVersion + pack(">HHHH", numTables, searchRange, entrySelector, rangeShift)
+	for tag in sorted(tags):
+		directory += pack(">4sLLL", tag, *entries[tag])
+
+	# the checksum of the whole font must be 0xB1B0AFBA:
+	checkSum = calcChecksum(directory) + sum([entries[tag][0] for tag in tags])
+	head = compiled["head"]
+	compiled["head"] = head[:8] + pack(">L", (0xB1B0AFBA - checkSum) & 0xFFFFFFFF) + head[12:]
+
+	outFile.write(directory)
+	for tag in tags:
+		if tag in compiled:
+			outFile.write(compiled[tag])
+		elif inData is not None:
+			outFile.write(buffer(inData, reader.tables[tag].offset, reader.tables[tag].length))
 		else:
-			# always delete ot-sanitise file:
-			if os.path.exists( tempPath ):
-				os.remove( tempPath )
-	outPath=None; tempPath=None
+			outFile.write(reader[tag])
+		length = entries[tag][2]
+		outFile.write("\0" * (((length + 3) & ~3) - length))
+	return offset
+
+def writeCollection(faces,outFile,inData=None):
+	# Writes the faces as a TrueType Collection to outFile, each like writeFont() writes a
+	# font. A table loaded in several faces is compiled once, and a table several faces
+	# use, in the input or as compiled, is written once. The checksum adjustment of a
+	# 'head' table that faces share is that of the first of them. Returns the number
+	# of bytes written.
+	compiled = {}   # id of a table: its data
+	blocks   = []   # the table data in the order written: compiled data, or (offset, length) in the input
+	entries  = {}   # block: (checkSum, length)
+	readers  = {}   # block in the input: (reader, tag)
+	directories = []
+	for face in faces:
+		reader = face.reader
+		face["head"] # always compiled, for the timestamp and the checksum adjustment
+		tables = {}
+		for tag in sorted(face.tables.keys(), key=lambda tag: COMPILE_ORDER.get(tag, 3)):
+			table = face.tables[tag]
+			if id(table) not in compiled:
+				data = face.getTableData(tag)
+				if tag == "head":
+					data = data[:8] + "\0\0\0\0" + data[12:]
+				compiled[id(table)] = data
+			tables[tag] = compiled[id(table)]
+		inputOrder = dict((tag, reader.tables[tag].offset) for tag in reader.keys())
+		directory = []
+		for tag in sorted(set(reader.keys()) | set(tables.keys()), key=lambda tag: (inputOrder.get(tag, sys.maxint), tag)):
+			if tag in tables:
+				block = tables[tag]
+				if block not in entries:
+					entries[block] = (calcChecksum(block), len(block))
+					blocks += [block]
+			else:
+				block = (reader.tables[tag].offset, reader.tables[tag].length)
+				if block not in entries:
+					entries[block] = (reader.tables[tag].checkSum, reader.tables[tag].length)
+					readers[block] = (reader, tag)
+					blocks += [block]
+			directory += [(tag, block)]
+		directories += [directory]
+
+	# the TTC header, all table directories, then the tables:
+	offset = 12 + 4 * len(faces) + sum([12 + 16 * len(directory) for directory in directories])
+	offsets = {}
+	for block in blocks:
+		offsets[block] = offset
+		offset += (entries[block][1] + 3) & ~3
+	header = pack(">4sLL", "ttcf", 0x00010000, len(faces))
+	directoryOffset = len(header) + 4 * len(faces)
+	compiledDirectories = []
+	adjusted = {}
+	for face, directory in zip(faces, directories):
+		header += pack(">L", directoryOffset)
+		numTables = len(directory)
+		searchRange, entrySelector, rangeShift = getSearchRange(numTables, 16)
+		data = face.sfntVersion + pack(">HHHH", numTables, searchRange, entrySelector, rangeShift)
+		for tag, block in sorted(directory):
+			data += pack(">4sLLL", tag, entries[block][0], offsets[block], entries[block][1])
+		# the checksum of each font must be 0xB1B0AFBA:
+		checkSum = calcChecksum(data) + sum([entries[block][0] for tag, block in directory])
+		head = dict(directory)["head"]
+		if head not in adjusted:
+			adjusted[head] = head[:8] + pack(">L", (0xB1B0AFBA - checkSum) & 0xFFFFFFFF) + head[12:]
+		compiledDirectories += [data]
+		directoryOffset += len(data)
+
+	outFile.write(header)
+	for data in compiledDirectories:
+		outFile.write(data)
+	for block in blocks:
+		if block in adjusted:
+			outFile.write(adjusted[block])
+		elif block in readers:
+			reader, tag = readers[block]
+			if inData is not None:
+				outFile.write(buffer(inData, block[0], block[1]))
+			else:
+				outFile.write(reader[tag])
+		else:
+			outFile.write(block)
+		length = entries[block][1]
+		outFile.write("\0" * (((length + 3) & ~3) - length))
+	return offset
+
+def getFileMode():
+	# the permissions of a newly created file, i.e. 0666 without the umask
+	umask = os.umask(0)
+	os.umask(umask)
+	return 0666 & ~umask
+
+def replaceFile(outPath,write):
+	# calls write(outFile) on a temp file next to outPath, which is then renamed
+	# to outPath, so outPath is never left half-written; returns what write() returns
+	outPath = os.path.abspath(outPath)
+	directory = os.path.dirname(outPath)
+	ensureFolder(directory)
+	fd, tempPath = tempfile.mkstemp(prefix=os.path.basename(outPath)+".", suffix=".tmp", dir=directory)
+	try:
+		outFile = os.fdopen(fd, "wb")
+		try:
+			result = write(outFile)
+		finally:
+			outFile.close()
+		os.chmod(tempPath, getFileMode()) # mkstemp creates files only the user can read
+		if os.name == "nt" and os.path.exists(outPath):
+			os.remove(outPath) # rename doesn't replace files on Windows
+		os.rename(tempPath, outPath)
+	except:
+		if os.path.exists(tempPath):
+			os.remove(tempPath)
+		raise
+	return result
+
+def saveFont(ttx,outPath,inData=None):
+	# writes ttx to outPath; returns the number of bytes written
+	def write(outFile):
+		if canWriteFont(ttx):
+			return writeFont(ttx, outFile, inData)
+		ttx.save(outFile)
+		return outFile.tell()
+	return replaceFile(outPath, write)
+
+def saveCollection(collection,outPath,inData=None):
+	# writes a collection opened by openCollection() to outPath; returns the number of bytes written
+	return replaceFile(outPath, lambda outFile: writeCollection(collection.fonts, outFile, inData))
+
+def saveData(data,outPath):
+	# writes a string of bytes to outPath; returns the number of bytes written
+	def write(outFile):
+		outFile.write(data)
+		return len(data)
+	return replaceFile(outPath, write)
+
+def compressFont(data,flavor):
+	# the sfnt font data as a WOFF or WOFF2 font; tables are copied raw,
+	# except those that WOFF2 transforms
+	ttx = TTFont(BytesIO(data), lazy=True, recalcBBoxes=False, recalcTimestamp=False)
+	ttx.flavor = flavor
+	output = BytesIO()
+	ttx.save(output, reorderTables=False)
+	ttx.close()
+	return output.getvalue()
+
+def getFormatPath(outPath,format):
+	# the outputfont path for a format: outPath for "ttf", else with the format's extension
+	if format == "ttf":
+		return outPath
+	return os.path.splitext(outPath)[0] + "." + format
+
+def fanOut(data,inData,outPath,formats):
+	# Saves the dieted font data in all formats. The dieted and the original font
+	# (inData) are compressed in parallel threads (zlib and brotli release the GIL),
+	# so the savings can be reported per format.
+	# Returns a list of (format, path, inSize, outSize).
+	def convert(job):
+		source, format = job
+		if FONT_FLAVORS[format] is None:
+			return source
+		return compressFont(source, FONT_FLAVORS[format])
+	jobs = [(data, f) for f in formats] + [(inData, f) for f in formats]
+	pool = multiprocessing.pool.ThreadPool(len(jobs))
+	try:
+		converted = pool.map(convert, jobs, 1)
+	finally:
+		pool.close()
+		pool.join()
+	sizes = []
+	for f, dieted, original in zip(formats, converted[:len(formats)], converted[len(formats):]):
+		path = getFormatPath(outPath, f)
+		saveData(dieted, path)
+		sizes += [(f, path, len(original), len(dieted))]
+	return sizes
+
+#########################################################################################################
+
+# Instrumentation: a DietTrace passed to diet(), dietFile() or estimateDiet()
+# records the wall time, memory and glyph or pair counts of each phase of the
+# diet. Tables are decompiled lazily, so a phase includes decompiling the
+# tables it is the first to read. Memory comes from the resident set size of
+# the process, which a trace only reads, so it never changes the peak other
+# code in the process measures.
+
+def getProcStatus(field):
+	# a memory field of /proc/self/status in bytes, or None if there is none
+	try:
+		status = open("/proc/self/status")
+		try:
+			for line in status:
+				if line.startswith(field + ":"):
+					return int(line.split()[1]) * 1024
+		finally:
+			status.close()
+	except IOError:
+		pass
+	return None
+
+def getPeakMemory():
+	# peak resident set size of the process in bytes, or None if unknown;
+	# on Linux, ru_maxrss keeps the peak of the forked parent across exec, VmHWM does not
+	peak = getProcStatus("VmHWM")
+	if peak is not None or resource is None:
+		return peak
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":
+		return peak
+	return peak * 1024
+
+class DietTrace(object):
+	# The phases are a list of dicts with "name", "start" and "seconds" (from the
+	# start of the trace), "memory" (change during the phase), "peakMemory" (how
+	# much the phase raised the peak of the process, 0 if it stayed below an
+	# earlier peak) and the counts given by the caller, in bytes. With profile,
+	# cProfile runs during the phases; see saveProfile().
+
+	def __init__(self, profile=0):
+		self.phases = []
+		self.start = time.time()
+		if getProcStatus("VmRSS") is not None:
+			self.memorySource = "rss"
+		else:
+			self.memorySource = None
+		self.profiler = None
+		if profile:
+			import cProfile
+			self.profiler = cProfile.Profile()
+
+	def getMemory(self):
+		# (current, peak) memory in bytes
+		if self.memorySource == "rss":
+			return getProcStatus("VmRSS"), getProcStatus("VmHWM")
+		return None, None
+
+	@contextmanager
+	def phase(self, name, **counts):
+		# times the with-block; the caller may add counts to the yielded dict
+		record = dict(counts)
+		record["name"] = name
+		memoryBefore, peakBefore = self.getMemory()
+		if self.profiler:
+			self.profiler.enable()
+		start = time.time()
+		try:
+			yield record
+		finally:
+			end = time.time()
+			if self.profiler:
+				self.profiler.disable()
+			memory, peak = self.getMemory()
+			record["start"] = round(start - self.start, 6)
+			record["seconds"] = round(end - start, 6)
+			record["memory"] = memory - memoryBefore if memory is not None and memoryBefore is not None else None
+			record["peakMemory"] = peak - peakBefore if peak is not None and peakBefore is not None else None
+			self.phases.append(record)
+
+	def close(self):
+		pass
+
+	def getJson(self, font=None):
+		return {
+			"font":         font,
+			"ttfdiet":      TOOL_VERSION,
+			"memorySource": self.memorySource,
+			"seconds":      round(sum(p["seconds"] for p in self.phases), 6),
+			"phases":       self.phases,
+			}
+
+	def getChromeTrace(self, font=None):
+		# complete ("X") events in microseconds, counts and memory as args
+		events = []
+		for p in self.phases:
+			events += [{
+				"name": p["name"],
+				"cat":  "ttfdiet",
+				"ph":   "X",
+				"ts":   int(p["start"] * 1000000),
+				"dur":  int(p["seconds"] * 1000000),
+				"pid":  os.getpid(),
+				"tid":  0,
+				"args": dict((k, v) for k, v in p.items() if k not in ("name", "start", "seconds")),
+				}]
+		return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"font": font, "ttfdiet": TOOL_VERSION, "memorySource": self.memorySource}}
+
+	def save(self, path, format=TRACE_FORMAT, font=None):
+		if format == "chrome":
+			data = self.getChromeTrace(font)
+		else:
+			data = self.getJson(font)
+		traceFile = open(path, "wb")
+		try:
+			traceFile.write(json.dumps(data, indent=1, separators=(",", ": "), sort_keys=True).encode("utf-8"))
+		finally:
+			traceFile.close()
+
+	def saveProfile(self, path):
+		# the cProfile statistics, for pstats or snakeviz
+		if self.profiler:
+			self.profiler.dump_stats(path)
+
+class NoTrace(DietTrace):
+	def __init__(self):
+		self.phases = []
+		self.profiler = None
+	@contextmanager
+	def phase(self, name, **counts):
+		yield {}
+
+NO_TRACE = NoTrace()
+
+def getTracePath(path, inPath):
+	# in batch mode, one trace file per font: "trace.json" becomes "trace.Font-Regular.json"
+	base, ext = os.path.splitext(path)
+	return "%s.%s%s" % (base, os.path.splitext(os.path.basename(inPath))[0], ext)
+
+def getInputSize(fontOrPath):
+	# size of the inputfont in bytes, or None if it cannot be known
+	try:
+		if isinstance(fontOrPath, TTFont):
+			if fontOrPath.reader is None:
+				return None
+			f = fontOrPath.reader.file
+		elif hasattr(fontOrPath, "read"):
+			f = fontOrPath
+		elif isFontData(fontOrPath):
+			return len(fontOrPath)
+		else:
+			return os.path.getsize(fontOrPath)
+		pos = f.tell()
+		f.seek(0, 2)
+		size = f.tell()
+		f.seek(pos)
+		return size
+	except (IOError, OSError, AttributeError):
+		return None
+
+def isFontData(fontOrPath):
+	# paths never contain NUL bytes, font data always does
+	return isinstance(fontOrPath, bytearray) or (isinstance(fontOrPath, str) and "\x00" in fontOrPath)
+
+def openFont(fontOrPath):
+	if isinstance(fontOrPath, TTFont):
+		return fontOrPath
+	try:
+		# tables are decompiled when the diet first needs them, and bounding boxes
+		# are recalculated by recalcBounds() rather than by expanding all glyphs:
+		if isFontData(fontOrPath):
+			return TTFont(BytesIO(str(fontOrPath)), lazy=True, recalcBBoxes=False)
+		return TTFont(fontOrPath, lazy=True, recalcBBoxes=False)
+	except (TTLibError, IOError), e:
+		if isFontData(fontOrPath) or hasattr(fontOrPath, "read"):
+			raise DietError("Cannot open font data: %s" % e)
+		raise DietError("Cannot open %s" % fontOrPath)
+
+def isCollection(fontOrPath):
+	# whether fontOrPath (as for openFont(), or a TTCollection) is a TrueType Collection
+	if isinstance(fontOrPath, TTCollection):
+		return 1
+	if isinstance(fontOrPath, TTFont):
+		return 0
+	if isFontData(fontOrPath):
+		return fontOrPath[:4] == "ttcf"
+	try:
+		if hasattr(fontOrPath, "read"):
+			pos = fontOrPath.tell()
+			tag = fontOrPath.read(4)
+			fontOrPath.seek(pos)
+			return tag == "ttcf"
+		f = open(fontOrPath, "rb")
+		try:
+			return f.read(4) == "ttcf"
+		finally:
+			f.close()
+	except (IOError, OSError):
+		return 0
+
+def openCollection(fontOrPath):
+	# like openFont(), for a TrueType Collection; the faces share the tables
+	# they share in the file, and the glyph names of the largest face
+	if isinstance(fontOrPath, TTCollection):
+		return fontOrPath
+	try:
+		if isFontData(fontOrPath):
+			fontOrPath = BytesIO(str(fontOrPath))
+		collection = TTCollection(fontOrPath, shareTables=True, lazy=True, recalcBBoxes=False)
+		faces = collection.fonts
+		numGlyphs = [face["maxp"].numGlyphs for face in faces]
+		# the names come from a face of its own, whose 'cmap' and 'post' aren't shared:
+		largest = numGlyphs.index(max(numGlyphs))
+		glyphOrder = TTFont(faces[largest].reader.file, fontNumber=largest, lazy=True).getGlyphOrder()
+	except (TTLibError, IOError, AssertionError), e:
+		if isFontData(fontOrPath) or hasattr(fontOrPath, "read"):
+			raise DietError("Cannot open collection data: %s" % e)
+		raise DietError("Cannot open %s" % fontOrPath)
+	for face, count in zip(faces, numGlyphs):
+		face.setGlyphOrder(glyphOrder[:count])
+	return collection
+
+def planDiet(ttx,options,log,trace=NO_TRACE,memo=None):
+	# finds the precomposed glyphs to blank and their decompositions; changes nothing
+	# in ttx except the mark class corrections of testFont(); returns
+	# (glyphs, ccmpSubs, lines, missingMarks), or None if the font is not suitable for a diet.
+	# A DietMemo given as memo provides the decompositions of an earlier font with the same
+	# 'cmap', glyph order and skip marks, such as another member of the family; the checks
+	# of testFont() run for each font.
+	cmap = ttx["cmap"].getcmap(3,10)
+	if not cmap: 
+		cmap = ttx["cmap"].getcmap(3,1)
+	if cmap: 
+		umap = dict((u,n) for u, n in cmap.cmap.iteritems() )
+#		nmap = dict((umap[k], k) for k in umap)
+# glyph may be associated with more than one u!!!
+		nmap = {}
+		for k in umap:
+			nmap.setdefault(umap[k],[]).append(k)
+	else:
+		log("'cmap' table misses a Windows-platform subtable.")
+		return None
+
+	with trace.phase("getUnicodeTables"):
+		getUnicodeTables()
+
+	with trace.phase("getMarkGlyphs") as counts:
+		markGlyphs = getMarkGlyphs(ttx)
+		counts["marks"] = len(markGlyphs)
+	
+	with trace.phase("testFont"):
+		fontIsFine = testFont(ttx,umap,nmap,markGlyphs,options,log)
+	if not fontIsFine:
+		log("This font is useless. Ignoring it.")
+		return None
+
+	glyphOrder = ttx.getGlyphOrder()
+	key = getPlanKey(umap,glyphOrder,options.skipMarks,memo)
+	plan = None
+	if key is not None:
+		plan = memo.get(key)
+	if plan is not None:
+		log("Reusing the decompositions of an earlier font with the same 'cmap'.")
+		plan = deepcopy(plan)
+	else:
+		plan = decomposeCodepoints(umap,glyphOrder,options.skipMarks,log,trace)
+		if key is not None:
+			memo.put(key, deepcopy(plan))
+	glyphs_removeOutlinesAndInstructions, ccmpSubs, lines, missingMarks = plan
+
+	# report missing marks:
+	if missingMarks:
+		log("For more effective decomposition you might add the following marks:")
+		log(" ".join(missingMarks))
+	
+	if not lines:
+		log("Nothing there to decompose.")
+
+	return plan
+
+def getPlanKey(umap,glyphOrder,skipMarks,memo):
+	# what decomposeCodepoints() depends on: a hash of the 'cmap', the glyph order, the
+	# skip marks and the Unicode version; None without a memo
+	if memo is None:
+		return None
+	digest = hashlib.sha1(repr(sorted(umap.iteritems())))
+	digest.update(repr(glyphOrder))
+	digest.update(repr(sorted(skipMarks)))
+	digest.update(getUnicodeTables().version)
+	return "plan", digest.digest()
+
+def decomposeCodepoints(umap,glyphOrder,skipMarks,log,trace=NO_TRACE):
+	# the part of planDiet() that only depends on the 'cmap' (as umap), the glyph order
+	# and the skip marks; returns (glyphs, ccmpSubs, lines, missingMarks)
+	unicodeTables  = getUnicodeTables()
+	decompositions = unicodeTables.decompositions
+	markCodepoints = unicodeTables.marks
+	skipMarks      = frozenset(skipMarks)
+
+	def getDecompositionData(u,missingMarks):
+	# inside so we can use umap, nmap ...
+			udec = decompositions.get(u)
+			if udec is None:
+				return 0
+			decall = 0
+			for ud in udec:
+				if ud in skipMarks: # if mark is in skipMarks we don't want to do any decomposition
+					return 0
+				if ud in umap:
+					decall += 1
+				else:
+					if ud in markCodepoints:
+						missingMarks += [unicodeIntToHexstr(ud)]
+#			if decall == len(udec) and decall == 1:
+#				print "SAME:",umap[u],[umap[ud] for ud in udec]
+			if decall == len(udec) and decall > 1: # the last condition may go for the sake of allowing reference to same-shape glyphs
+				return umap[u],[umap[ud] for ud in udec],udec[0] # last one is the one to check next
+			return 0
+
+	glyphs_removeOutlinesAndInstructions = []
+	ccmpSubsDict = {}
+	linesDict = {}
+	missingMarks = []
+	with trace.phase("decompose", codepoints=len(umap)) as counts:
+		if umap:
+			# only the codepoints that have a canonical decomposition:
+			for u in [u for u in umap if u in decompositions]:
+				decomp = getDecompositionData(u,missingMarks)
+				decompLast = decomp # getDecompositionData returns a new list each time, so no need to copy
+				while decomp:
+					decomp = getDecompositionData(decomp[2],missingMarks) # check if the base char is a composed one too!
+					# cf: 01E0;LATIN CAPITAL LETTER A WITH DOT ABOVE AND MACRON;Lu;0;L;0226 0304;;;;N;LATIN CAPITAL LETTER A DOT MACRON;;;01E1;
+					if decomp:
+						decompLast[1][0:1] = decomp[1]
+				if decompLast:
+					ccmpSubsDict[decompLast[0]] = decompLast[1]
+					linesDict[   decompLast[0]] = "  sub %s by %s;" % (decompLast[0], " ".join(decompLast[1]))
+					glyphs_removeOutlinesAndInstructions += [decompLast[0]]
+		counts["decomposed"] = len(glyphs_removeOutlinesAndInstructions)
+	# sort by glyph order!
+	ccmpSubs = []
+	lines    = []
+	for g in glyphOrder:
+		try:    ccmpSubs += [(g,ccmpSubsDict[g])]
+		except: pass
+		try:    lines    += [ linesDict[g] ]
+		except: pass
+	if len(ccmpSubsDict) != len(ccmpSubs):
+		log("(Lost substitutions when creating ccmpSubs.)")
+	if len(linesDict) != len(lines):
+		log("(Lost substitutions when creating lines.)")
+
+	missingMarks = cleanUpList(missingMarks)
+	missingMarks.sort()
+	return glyphs_removeOutlinesAndInstructions, ccmpSubs, lines, missingMarks
+
+def dietFont(ttx,options,log,trace=NO_TRACE,memo=None):
+	# applies the diet to ttx in place;
+	# returns (ccmpSubs, lines, missingMarks), or None if the font is not suitable for a diet
+	plan = planDiet(ttx,options,log,trace,memo)
+	if not plan:
+		return None
+	return applyDiet(ttx,options,plan,log,trace,memo=memo)
+
+def isFirstChange(ttx,tag,changed):
+	# whether a change that must not be repeated is yet to be made to ttx[tag]; changed is
+	# None for a font, or the set of the ids of the tables changed so far in a collection,
+	# whose faces may share the table
+	if changed is None:
+		return 1
+	if id(ttx[tag]) in changed:
+		return 0
+	changed.add(id(ttx[tag]))
+	return 1
+
+def applyDiet(ttx,options,plan,log,trace=NO_TRACE,changed=None,memo=None):
+	# applies a plan of planDiet() to ttx in place; returns (ccmpSubs, lines, missingMarks).
+	# For the faces of a collection, changed is the set isFirstChange() keeps. A DietMemo
+	# given as memo provides the 'GPOS' and 'GSUB' tables of an earlier, equal diet.
+	glyphs_removeOutlinesAndInstructions, ccmpSubs, lines, missingMarks = plan
+	glyphCount = len(glyphs_removeOutlinesAndInstructions)
+	if changed is not None or options.removeDuplicateOutlines or ttx.reader is None:
+		memo = None # shared tables, or tables read again after their diet
+
+	if options.verifyDecompositions and ccmpSubs: # before the outlines are removed
+		with trace.phase("verifyDecompositions", glyphs=len(ccmpSubs)) as counts:
+			counts["deviating"] = verifyDecompositions(ttx,ccmpSubs,options.verifyDecompositions,log)
+
+	if options.removePrecomposedOutlines     and glyphCount: # only makes sense if there's something to decompose
+		with trace.phase("removeOutlines", glyphs=glyphCount):
+			removeOutlines(ttx,glyphs_removeOutlinesAndInstructions,log)
+	if options.removePrecomposedFromGposKern and glyphCount: # only makes sense if there's something to decompose
+		key = getMemoKey(ttx,"GPOS",glyphs_removeOutlinesAndInstructions,memo)
+		if not useMemoTable(ttx,"GPOS",key,memo,log,trace):
+			with trace.phase("removeGPOSkern", glyphs=glyphCount) as counts:
+				counts["removedPairs"], counts["removedClasses"] = removeGPOSkern(ttx,glyphs_removeOutlinesAndInstructions,log)
+			storeMemoTable(ttx,"GPOS",key,memo,trace)
+		if "kern" in ttx:
+			with trace.phase("removeKernTablePairs", glyphs=glyphCount) as counts:
+				counts["removedPairs"] = removeKernTablePairs(ttx,glyphs_removeOutlinesAndInstructions)
+	if options.removeAllButWinCmapSubtables:
+		with trace.phase("removeAllButWinCmapSubtable"):
+			removeAllButWinCmapSubtable(ttx)
+	if options.removeAllButWinNameRecords \
+	or options.renameFont: # enforce removing non-Win records when renaming the font!
+		with trace.phase("removeAllButWinNameRecords"):
+			removeAllButWinNameRecords( ttx)
+	if options.renameFont and isFirstChange(ttx,"name",changed):
+		with trace.phase("renameFont"):
+			renameFont(                 ttx,options.renameFontAddition)
+	if options.addDummyDsig:
+		with trace.phase("addDummyDSIG"):
+			addDummyDSIG(               ttx)
+	if options.decomposePrecomposedInCcmp    and ccmpSubs and isFirstChange(ttx,"GSUB",changed):
+		key = getMemoKey(ttx,"GSUB",ccmpSubs,memo)
+		if not useMemoTable(ttx,"GSUB",key,memo,log,trace):
+			with trace.phase("addCcmpLookup", substitutions=len(ccmpSubs)):
+				addCcmpLookup(          ttx,ccmpSubs)
+			storeMemoTable(ttx,"GSUB",key,memo,trace)
+	if options.removePostGlyphnames:
+		with trace.phase("removePostNames"):
+			removePostNames(            ttx)
+	if options.removeDuplicateOutlines: # after the other passes, which may use or blank duplicates
+		with trace.phase("removeDuplicateOutlines") as counts:
+			counts["composites"], counts["aliased"], counts["savedBytes"] = removeDuplicateOutlines(ttx,log)
+
+	return ccmpSubs, lines, missingMarks
+
+# Collections: the faces of a TrueType Collection often share their 'glyf' table and
+# others. They are read with fontTools' table sharing, so a table the faces share is
+# one object, which the diet changes once, and writeCollection() writes once. Every
+# face gets the glyph names of the largest face, so that the names in a shared table
+# stand for the same glyphs in every face that reads it.
+
+def getGlyfKey(ttx,faceIndex):
+	# faces with the same key share their outlines, in 'glyf' or a CFF table
+	for tag in ["glyf"] + CFF_TAGS:
+		if tag in ttx.reader:
+			return ttx.reader.tables[tag].offset
+	return ("face", faceIndex)
+
+def getTableKey(ttx,tag,faceIndex):
+	# faces with the same key share the table
+	if tag in ttx.reader:
+		return tag, ttx.reader.tables[tag].offset
+	return tag, "face", faceIndex
+
+def getCmapGlyphs(ttx):
+	# the glyphs the Windows Unicode 'cmap' subtables map codepoints to
+	glyphs = set()
+	for table in ttx["cmap"].tables:
+		if table.platformID == 3 and table.platEncID in [1, 10]:
+			glyphs.update(table.cmap.values())
+	return glyphs
+
+def planCollectionDiet(faces,options,log,trace=NO_TRACE):
+	# Plans the diet of each face with planDiet(). The faces that share a 'glyf' table
+	# blank a glyph only if each of them that maps it in its 'cmap' can decompose it,
+	# and faces that share a 'GSUB' table decompose all glyphs any of them blanks.
+	# Returns a plan for each face, or None if no face is suitable for a diet.
+	plans = []
+	for i, face in enumerate(faces):
+		log("Planning face %d of %d..." % (i + 1, len(faces)))
+		plans += [planDiet(face,options,log,trace)]
+	if not [plan for plan in plans if plan]:
+		return None
+	kept    = set() # (glyf key, glyph)
+	blanked = {}    # glyf key: set of glyphs
+	for i, (face, plan) in enumerate(zip(faces, plans)):
+		decomposable = set(plan[0]) if plan else set()
+		key = getGlyfKey(face, i)
+		kept.update([(key, g) for g in getCmapGlyphs(face) if g not in decomposable])
+		blanked.setdefault(key, set())
+	for i, (face, plan) in enumerate(zip(faces, plans)):
+		if plan:
+			key = getGlyfKey(face, i)
+			blanked[key].update([g for g in plan[0] if (key, g) not in kept])
+	substitutions = {} # GSUB key: {glyph: decomposition}
+	for i, (face, plan) in enumerate(zip(faces, plans)):
+		subs = substitutions.setdefault(getTableKey(face, "GSUB", i), {})
+		if plan:
+			for g, decomposition in plan[1]:
+				if g in blanked[getGlyfKey(face, i)]:
+					subs.setdefault(g, decomposition)
+	facePlans = []
+	for i, (face, plan) in enumerate(zip(faces, plans)):
+		glyphs   = blanked[getGlyfKey(face, i)]
+		subs     = substitutions[getTableKey(face, "GSUB", i)]
+		ccmpSubs = [(g, subs[g]) for g in face.getGlyphOrder() if g in subs]
+		lines    = ["  sub %s by %s;" % (g, " ".join(decomposition)) for g, decomposition in ccmpSubs]
+		facePlans += [([g for g in face.getGlyphOrder() if g in glyphs], ccmpSubs, lines, plan[3] if plan else [])]
+	return facePlans
+
+def shareGlyphVariations(faces):
+	# the faces that share a 'gvar' table share one RawGlyphVariations, read before
+	# any face blanks its glyphs
+	shared = {}
+	for face in faces:
+		if "gvar" in face:
+			offset = face.reader.tables["gvar"].offset
+			if offset in shared:
+				face.tables["gvar"] = shared[offset]
+			else:
+				shared[offset] = getGlyphVariations(face)
+
+def shareLoadedTables(faces):
+	# fontTools hands a face the table another face has decompiled from the same data,
+	# but doesn't add it to the face's tables; adds it, so that every face that shares
+	# a dieted table saves it, rather than copying the input's
+	loaded = {}
+	for face in faces:
+		for tag, table in face.tables.items():
+			if tag in face.reader:
+				entry = face.reader.tables[tag]
+				loaded.setdefault((tag, entry.length, entry.checkSum), []).append((face, table))
+	for face in faces:
+		for tag in face.reader.keys():
+			if face.isLoaded(tag):
+				continue
+			entry = face.reader.tables[tag]
+			for other, table in loaded.get((tag, entry.length, entry.checkSum), []):
+				if other.reader.tables[tag].offset == entry.offset or other.reader[tag] == face.reader[tag]:
+					face.tables[tag] = table
+					break
+
+def dietCollection(collection,options,log,trace=NO_TRACE):
+	# Applies the diet to all faces of a collection opened by openCollection(), in place.
+	# Returns (ccmpSubs, lines, missingMarks) of all faces together, or None if no face
+	# is suitable for a diet.
+	faces = collection.fonts
+	if options.removeDuplicateOutlines:
+		log("Duplicate outlines are not merged in collections.")
+		options = options._replace(removeDuplicateOutlines=0)
+	plans = planCollectionDiet(faces,options,log,trace)
+	if not plans:
+		return None
+	shareGlyphVariations(faces)
+	changed = set()
+	decomposed = set()
+	ccmpSubs = []
+	lines = []
+	missingMarks = []
+	for i, (face, plan) in enumerate(zip(faces, plans)):
+		log("Dieting face %d of %d..." % (i + 1, len(faces)))
+		faceSubs, faceLines, faceMissingMarks = applyDiet(face,options,plan,log,trace,changed)
+		for sub, line in zip(faceSubs, faceLines):
+			if sub[0] not in decomposed:
+				decomposed.add(sub[0])
+				ccmpSubs += [sub]
+				lines += [line]
+		missingMarks += faceMissingMarks
+	shareLoadedTables(faces)
+	return ccmpSubs, lines, cleanUpList(missingMarks)
+
+def finishCollectionDiet(collection,options,ccmpSubs):
+	# finishDiet() for each face of a collection opened by openCollection()
+	for face in collection.fonts:
+		finishDiet(face,options,ccmpSubs)
+
+# Visual check: a blanked glyph should look like its decomposition, the base glyph
+# with the marks positioned by the 'mark' and 'mkmk' anchors. The check compares
+# their bounding boxes (from the raw glyph headers, or the drawn CFF charstrings)
+# and advance widths; the anchors are resolved per glyph, the boxes of all
+# decompositions are combined and compared at once with NumPy, so the check also
+# suits pan-Unicode fonts.
+
+def getMarkAttachments(ttx,glyphs):
+	# [(lookup type, {mark: (class, (x, y))}, {base or mark2: {class: (x, y)}})] of the
+	# MarkBasePos and MarkMarkPos subtables of the 'mark' and 'mkmk' lookups, in lookup order;
+	# only for glyphs, so the anchors of the other glyphs aren't decompiled
+	if "GPOS" not in ttx:
+		return []
+	def getAnchor(anchor):
+		return (anchor.XCoordinate, anchor.YCoordinate)
+	attachments = []
+	for lIdx in getFeatureLookupIndices(ttx["GPOS"].table,["mark","mkmk"]):
+		lookup = ttx["GPOS"].table.LookupList.Lookup[lIdx]
+		for s in lookup.SubTable:
+			if lookup.LookupType == 9:
+				lookupType = s.ExtensionLookupType
+				subtable = s.ExtSubTable
+			else:
+				lookupType = lookup.LookupType
+				subtable = s
+			if lookupType == 4:
+				markCoverage, markArray = subtable.MarkCoverage, subtable.MarkArray
+				baseCoverage, baseRecords, anchorsName = subtable.BaseCoverage, subtable.BaseArray.BaseRecord, "BaseAnchor"
+			elif lookupType == 6:
+				markCoverage, markArray = subtable.Mark1Coverage, subtable.Mark1Array
+				baseCoverage, baseRecords, anchorsName = subtable.Mark2Coverage, subtable.Mark2Array.Mark2Record, "Mark2Anchor"
+			else:
+				continue
+			marks = dict((g, (r.Class, getAnchor(r.MarkAnchor))) for g, r in zip(markCoverage.glyphs, markArray.MarkRecord) if g in glyphs)
+			bases = {}
+			for g, r in zip(baseCoverage.glyphs, baseRecords):
+				if g in glyphs:
+					bases[g] = dict((c, getAnchor(a)) for c, a in enumerate(getattr(r, anchorsName)) if a)
+			attachments += [(lookupType, marks, bases)]
+	return attachments
+
+def positionMarks(decomposition,attachments,baseAdvance):
+	# the (x, y) position of each glyph of decomposition, a base followed by marks, and the
+	# marks that no anchor attaches; like a layout engine, every lookup that attaches a
+	# mark moves it, so 'mkmk' moves the marks 'mark' put on the base onto the mark before
+	positions = [(0, 0)]
+	unattached = []
+	for i, mark in enumerate(decomposition[1:]):
+		position = None
+		for lookupType, marks, bases in attachments:
+			if mark not in marks:
+				continue
+			markClass, (markX, markY) = marks[mark]
+			target = i if lookupType == 6 else 0 # the mark before, or the base
+			anchor = bases.get(decomposition[target], {}).get(markClass)
+			if anchor is not None:
+				position = (positions[target][0] + anchor[0] - markX, positions[target][1] + anchor[1] - markY)
+		if position is None:
+			position = (baseAdvance, 0) # where a layout engine leaves an unattached mark
+			unattached += [mark]
+		positions += [position]
+	return positions, unattached
+
+def verifyDecompositions(ttx,ccmpSubs,tolerance,log):
+	# compares each blanked glyph of ccmpSubs with its decomposition and reports those whose
+	# bounds or advance differ by more than tolerance (1/1000 em); returns their number
+	if numpy is None:
+		raise DietError("The visual check needs the numpy module")
+	if "glyf" not in ttx and not getCffTag(ttx):
+		log("This font has no 'glyf', 'CFF ' or 'CFF2' table. Won't compare glyphs with their decompositions.")
+		return 0
+	if not ccmpSubs:
+		return 0
+	metrics     = ttx["hmtx"].metrics
+	names = sorted(set([g for g, decomposition in ccmpSubs] + [g for g, decomposition in ccmpSubs for g in decomposition]))
+	attachments = getMarkAttachments(ttx, frozenset(names))
+	index = dict((n, i) for i, n in enumerate(names))
+	# empty glyphs get a box that doesn't widen any union:
+	inf = float("inf")
+	outlineBounds = getOutlineBounds(ttx, names)
+	bounds = numpy.array([outlineBounds.get(n, (inf, inf, -inf, -inf)) for n in names], dtype=float)
+	advances = numpy.array([metrics[n][0] for n in names], dtype=float)
+
+	components = []
+	offsets    = []
+	starts     = []
+	unattachedMarks = {}
+	for g, decomposition in ccmpSubs:
+		positions, unattached = positionMarks(decomposition, attachments, metrics[decomposition[0]][0])
+		if unattached:
+			unattachedMarks[g] = unattached
+		starts     += [len(components)]
+		components += [index[n] for n in decomposition]
+		offsets    += [(x, y, x, y) for x, y in positions]
+	boxes = bounds[components] + numpy.array(offsets, dtype=float)
+	starts = numpy.array(starts)
+	decomposed = numpy.column_stack([
+		numpy.minimum.reduceat(boxes[:, 0], starts),
+		numpy.minimum.reduceat(boxes[:, 1], starts),
+		numpy.maximum.reduceat(boxes[:, 2], starts),
+		numpy.maximum.reduceat(boxes[:, 3], starts),
+		])
+	precomposed = numpy.array([index[g] for g, decomposition in ccmpSubs])
+	with numpy.errstate(invalid="ignore"):
+		boundsDeviation = numpy.abs(decomposed - bounds[precomposed]).max(axis=1)
+	boundsDeviation[numpy.isnan(boundsDeviation)] = 0 # both empty
+	advanceDeviation = numpy.abs(advances[precomposed] - advances[numpy.array(components)[starts]])
+
+	limit = tolerance * ttx["head"].unitsPerEm / 1000.0
+	deviating = numpy.nonzero((boundsDeviation > limit) | (advanceDeviation > limit))[0]
+	for i in deviating:
+		g, decomposition = ccmpSubs[i]
+		message = "Glyph '%s' differs from its decomposition %s by %s units (bounds) and %s units (advance)." % (
+			g, " ".join(decomposition), formatDeviation(boundsDeviation[i]), formatDeviation(advanceDeviation[i]))
+		if g in unattachedMarks:
+			message += " No anchor attaches %s." % ", ".join(["'%s'" % m for m in unattachedMarks[g]])
+		log(message)
+	log("Visual check: %s of %s dieted glyphs differ from their decompositions by more than %s units." % (len(deviating), len(ccmpSubs), formatDeviation(limit)))
+	return len(deviating)
+
+def formatDeviation(units):
+	if units == float("inf"):
+		return "all" # one of the two is empty
+	return "%g" % units
+
+def getFea(lines):
+	# the 'ccmp' lookup in AFDKO syntax, or None
+	if not lines:
+		return None
+	ccmpfea  = [ "lookup ccmpUnicodeDecomp {" ]
+	ccmpfea += lines
+	ccmpfea += [ "} ccmpUnicodeDecomp;"       ]
+	return "\n".join(ccmpfea)
+
+#########################################################################################################
+
+# Size estimates: estimateDiet() plans the diet like diet() does, but instead of
+# changing, compiling and saving the font, it adds up the bytes each enabled option
+# would remove or add, mostly from the raw tables. Table padding and the exact
+# coverage and class def formats fontTools chooses are not modeled.
+
+def getValueRecordSize(valueFormat):
+	# bytes of a 'GPOS' ValueRecord, without device tables
+	return 2 * bin(valueFormat or 0).count("1")
+
+def getValueRecordKey(valueRecord):
+	# a ValueRecord's values as a hashable key
+	if valueRecord is None:
+		return None
+	return tuple(sorted(valueRecord.__dict__.items()))
+
+def getPairSetRecords(pairSet,recordSize,glyphs,glyphIDs):
+	# the PairValueRecords of a PairSet as (second glyph is in glyphs, hashable record);
+	# a PairSet that the lazily loaded font hasn't decompiled yet is read from its raw
+	# bytes (PairValueCount, then records starting with the second glyph ID)
+	reader = pairSet.__dict__.get("reader")
+	if reader is not None:
+		data  = reader.data
+		pos   = reader.offset + 2
+		count = unpack(">H", data[reader.offset:pos])[0]
+		records = []
+		for i in range(count):
+			record = data[pos:pos+recordSize]
+			records += [(unpack(">H", record[:2])[0] in glyphIDs, record)]
+			pos += recordSize
+		return records
+	return [(r.SecondGlyph in glyphs, (r.SecondGlyph, getValueRecordKey(getattr(r, "Value1", None)), getValueRecordKey(getattr(r, "Value2", None)))) for r in pairSet.PairValueRecord]
+
+def getGlyfSavings(ttx,glyphs):
+	# {glyph: bytes} of the blanked glyphs, from the 'loca' offsets
+	if "glyf" not in ttx:
+		return {}
+	locations = ttx["loca"].locations
+	savings = {}
+	for g in glyphs:
+		gid = ttx.getGlyphID(g)
+		savings[g] = locations[gid+1] - locations[gid]
+	return savings
+
+def estimateGlyfSaving(ttx,glyphs):
+	return sum(getGlyfSavings(ttx,glyphs).values())
+
+def getCharStringSavings(ttx,glyphs):
+	# {glyph: bytes} of the emptied charstrings; doesn't count the subroutines that only they call
+	tag = getCffTag(ttx)
+	if "glyf" in ttx or not tag:
+		return {}
+	charStrings = getCharStrings(ttx)
+	metrics = ttx["hmtx"].metrics
+	savings = {}
+	for g in glyphs:
+		charString = charStrings[g]
+		blank = psCharStrings.T2CharString(program=getBlankProgram(charString, metrics[g][0], tag == "CFF2"))
+		blank.compile(isCFF2=(tag == "CFF2"))
+		savings[g] = len(charString.bytecode) - len(blank.bytecode)
+	return savings
+
+def estimateCharStringSaving(ttx,glyphs):
+	return sum(getCharStringSavings(ttx,glyphs).values())
+
+def getGvarSavings(ttx,glyphs):
+	# {glyph: bytes} of the 'gvar' deltas of the outlines of the blanked glyphs
+	gvar = readGlyphVariations(ttx)
+	if gvar is None or "glyf" not in ttx:
+		return {}
+	return dict((ttx.getGlyphName(glyphID), len(gvar.glyphData[glyphID]) - len(data)) for glyphID, data in getBlankedGlyphVariationData(ttx, gvar, glyphs).iteritems())
+
+def estimateGvarSaving(ttx,glyphs):
+	return sum(getGvarSavings(ttx,glyphs).values())
+
+def estimateDuplicateSaving(ttx,options,glyphs):
+	# bytes saved by making the duplicate glyphs references, from the raw 'glyf'
+	# data; doesn't count the glyphs that can be mapped in 'cmap' instead, nor 'gvar'
+	if "glyf" not in ttx.reader:
+		return 0
+	locations = ttx["loca"].locations
+	glyfData = ttx.reader["glyf"]
+	blanked = set()
+	if options.removePrecomposedOutlines:
+		blanked = set([ttx.getGlyphID(g) for g in glyphs])
+	glyphDatas = [glyfData[locations[i]:locations[i+1]] if i not in blanked else "" for i in range(len(locations) - 1)]
+	gvar = readGlyphVariations(ttx)
+	duplicates = findDuplicateGlyphs(glyphDatas, gvar.glyphData if gvar else None)
+	return sum([(getPaddedSize(len(glyphDatas[canonical])) - COMPOSITE_REFERENCE_SIZE) * len(dups) for canonical, dups in duplicates])
+
+def estimateGPOSkernSaving(ttx,glyphs):
+	# bytes of the pair records, classes and coverage entries removeGPOSkern() removes
+	glyphs   = frozenset(glyphs)
+	glyphIDs = frozenset([ttx.getGlyphID(g) for g in glyphs])
+	saving = 0
+	for subtable in getKernSubtables(ttx):
+		if subtable.Format == 1:
+			# identical PairSets are stored once, so they are counted by their content:
+			recordSize = 2 + getValueRecordSize(subtable.ValueFormat1) + getValueRecordSize(subtable.ValueFormat2)
+			pairSetsBefore = set()
+			pairSetsAfter  = set()
+			for g, p in zip(subtable.Coverage.glyphs, subtable.PairSet):
+				records = getPairSetRecords(p,recordSize,glyphs,glyphIDs)
+				pairSetsBefore.add(tuple([key for removed, key in records]))
+				if g in glyphs:
+					saving += 4 # coverage entry, PairSet offset
+				else:
+					pairSetsAfter.add(tuple([key for removed, key in records if not removed]))
+			for pairSets, sign in [(pairSetsBefore, 1), (pairSetsAfter, -1)]:
+				for records in pairSets:
+					saving += sign * (2 + recordSize * len(records))
+		elif subtable.Format == 2:
+			recordSize = getValueRecordSize(subtable.ValueFormat1) + getValueRecordSize(subtable.ValueFormat2)
+			class1After, class2After = getPairPosFormat2Classes(subtable,glyphs)
+			saving += recordSize * (subtable.Class1Count * subtable.Class2Count - len(class1After) * len(class2After))
+			saving += 2 * len(glyphs.intersection(subtable.Coverage.glyphs))
+			saving += 2 * len(glyphs.intersection(subtable.ClassDef1.classDefs))
+			saving += 2 * len(glyphs.intersection(subtable.ClassDef2.classDefs))
+	return saving
+
+def estimateKernTableSaving(ttx,glyphs):
+	# bytes of the pairs removeKernTablePairs() removes, 6 each
+	glyphs = frozenset(glyphs)
+	return 6 * sum([len([pair for pair in pairs if pair[0] in glyphs or pair[1] in glyphs]) for pairs in getKernTablePairs(ttx)])
+
+def estimateCoverageSize(ttx,glyphs):
+	# bytes of a Coverage table in the smaller of its two formats
+	glyphIDs = sorted([ttx.getGlyphID(g) for g in glyphs])
+	ranges = len([i for i in range(len(glyphIDs)) if i == 0 or glyphIDs[i] != glyphIDs[i-1] + 1])
+	return 4 + min(2 * len(glyphIDs), 6 * ranges)
+
+def estimateCcmpSize(ttx,ccmpSubs):
+	# bytes of the lookup addCcmpLookup() adds, and of the references to it
+	subtables = splitCcmpSubs(ccmpSubs)
+	size  = getCcmpLookupSize(ttx,subtables,needsExtensionLookup(ttx,subtables))
+	size += 2 # LookupList offset
+	ccmpRecords = [r for r in ttx["GSUB"].table.FeatureList.FeatureRecord if r.FeatureTag == "ccmp"]
+	if ccmpRecords:
+		return size + 2 * len(ccmpRecords) # lookup index in each ccmp feature
+	size += 6 + 6 # FeatureRecord, Feature with one lookup index
+	for scriptRecord in ttx["GSUB"].table.ScriptList.ScriptRecord:
+		# feature index in the default and all other LangSys:
+		size += 2 * (1 + len(scriptRecord.Script.LangSysRecord))
+	return size
+
+def estimateCmapSaving(ttx):
+	# bytes of the non-Windows subtables, from the raw 'cmap' table
+	data = ttx.reader["cmap"]
+	numSubTables = unpack(">H", data[2:4])[0]
+	winOffsets   = set()
+	otherOffsets = set()
+	saving = 0
+	for i in range(numSubTables):
+		platformID, platEncID, offset = unpack(">HHL", data[4+i*8:12+i*8])
+		if platformID == 3:
+			winOffsets.add(offset)
+		else:
+			otherOffsets.add(offset)
+			saving += 8 # encoding record
+	for offset in otherOffsets - winOffsets: # subtables shared with Windows records stay
+		format = unpack(">H", data[offset:offset+2])[0]
+		if format in [8,10,12,13]:
+			saving += unpack(">L", data[offset+4:offset+8])[0]
+		elif format == 14:
+			saving += unpack(">L", data[offset+2:offset+6])[0]
+		else:
+			saving += unpack(">H", data[offset+2:offset+4])[0]
+	return saving
+
+def estimateNameSaving(ttx,options):
+	# bytes of the non-Windows name records, minus the bytes renameFont() adds
+	saving = 0
+	addition = options.renameFontAddition.strip().strip("'").strip('"')
+	for r in ttx["name"].names:
+		if r.platformID != 3:
+			saving += 12 + len(r.toBytes())
+		elif options.renameFont and r.nameID in RENAME_NAME_IDS_WITH_SPACE:
+			saving -= 2 * (len(addition) + 1)
+		elif options.renameFont and r.nameID in RENAME_NAME_IDS_WITHOUT_SPACE:
+			saving -= 2 *  len(addition)
+	return saving
+
+def estimateSize(ttx,options,plan,inSize):
+	# the predicted outputfont size in bytes
+	glyphs, ccmpSubs, lines, missingMarks = plan
+	outSize = inSize
+	if lines:
+		if options.removePrecomposedOutlines:
+			outSize -= estimateGlyfSaving(ttx,glyphs)
+			outSize -= estimateCharStringSaving(ttx,glyphs)
+			outSize -= estimateGvarSaving(ttx,glyphs)
+			if "VORG" in ttx.reader:
+				outSize -= 4 * len(frozenset(glyphs).intersection(ttx["VORG"].VOriginRecords))
+		if options.removePrecomposedFromGposKern:
+			outSize -= estimateGPOSkernSaving(ttx,glyphs)
+			outSize -= estimateKernTableSaving(ttx,glyphs)
+		if options.decomposePrecomposedInCcmp:
+			outSize += estimateCcmpSize(ttx,ccmpSubs)
+	if options.removeAllButWinCmapSubtables:
+		outSize -= estimateCmapSaving(ttx)
+	if options.removeAllButWinNameRecords or options.renameFont:
+		outSize -= estimateNameSaving(ttx,options)
+	if options.removePostGlyphnames and "post" in ttx.reader and ttx["post"].formatType == 2.0:
+		outSize -= len(ttx.reader["post"]) - 32 # format 3 is the 32-byte header only
+	if options.removeDuplicateOutlines:
+		outSize -= estimateDuplicateSaving(ttx,options,glyphs if lines else [])
+	if options.addDummyDsig:
+		if "DSIG" in ttx.reader:
+			outSize -= len(ttx.reader["DSIG"]) - 8
+		else:
+			outSize += 8 + 16 # table and its table directory entry
+	return outSize
+
+def diet(fontOrPath, options=None, log=None, trace=None, memo=None):
+	# Diets one font and returns a DietResult. fontOrPath may be a path, a file
+	# object, a string of font bytes or an open TTFont (which is dieted in place);
+	# a TrueType Collection (or a TTCollection) is dieted as a whole, see dietCollection().
+	# Messages are collected in the result and also passed to log(message) if given.
+	# Nothing is printed and no module state is changed, so diet() may be called
+	# from several threads at once (with different fonts). A DietTrace given as
+	# trace records the phases of the diet, and a DietMemo given as memo reuses
+	# layout tables from earlier diets.
+	if options is None:
+		options = dietOptions()
+	if trace is None:
+		trace = NO_TRACE
+	messages = []
+	def report(message):
+		messages.append(message)
+		if log: log(message)
+
+	inSize = getInputSize(fontOrPath)
+	if isCollection(fontOrPath):
+		with trace.phase("load", bytes=inSize):
+			ttx = openCollection(fontOrPath)
+		dieted = dietCollection(ttx,options,report,trace)
+	else:
+		with trace.phase("load", bytes=inSize):
+			ttx = openFont(fontOrPath)
+		dieted = dietFont(ttx,options,report,trace,memo)
+	if not dieted:
+		return DietResult(None, None, inSize, None, [], [], messages)
+	ccmpSubs, lines, missingMarks = dieted
+
+	# AFDKO syntax .fea file:
+	fea = getFea(lines)
+
+	output = BytesIO()
+	if ttx is not fontOrPath:
+		# we opened ttx, so nothing but the diet has changed it:
+		with trace.phase("finishDiet"):
+			if isinstance(ttx, TTCollection):
+				finishCollectionDiet(ttx,options,ccmpSubs)
+			else:
+				finishDiet(ttx,options,ccmpSubs)
+	with trace.phase("save") as counts:
+		if isinstance(ttx, TTCollection):
+			writeCollection(ttx.fonts, output)
+		elif ttx is not fontOrPath and canWriteFont(ttx):
+			writeFont(ttx, output)
+		else:
+			ttx.save( output )
+		counts["bytes"] = output.tell()
+	data = output.getvalue()
+	if ttx is not fontOrPath:
+		for face in getattr(ttx, "fonts", [ttx]):
+			face.close()
+	ttx = None
+	return DietResult(data, fea, inSize, len(data), ccmpSubs, missingMarks, messages)
+
+def dietFile(inPath, outPath, options=None, log=None, trace=None, memo=None):
+	# Like diet(), but for a font file: the inputfont is read through a memory map,
+	# and the dieted font is saved to outPath by saveFont(), which copies the tables
+	# the diet doesn't change straight from the map. Returns a DietResult whose data
+	# is None; outSize is None if the font was not suitable for a diet.
+	if options is None:
+		options = dietOptions()
+	if trace is None:
+		trace = NO_TRACE
+	messages = []
+	def report(message):
+		messages.append(message)
+		if log: log(message)
+
+	try:
+		inFile = open(inPath, "rb")
+	except IOError:
+		raise DietError("Cannot open %s" % inPath)
+	try:
+		try:
+			inData = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+		except (ValueError, EnvironmentError): # empty file
+			raise DietError("Cannot open %s" % inPath)
+		try:
+			collection = isCollection(inData)
+			with trace.phase("load", bytes=len(inData)):
+				if collection:
+					ttx = openCollection(inData)
+				else:
+					ttx = openFont(inData)
+			if collection:
+				dieted = dietCollection(ttx,options,report,trace)
+			else:
+				dieted = dietFont(ttx,options,report,trace,memo)
+			if not dieted:
+				return DietResult(None, None, len(inData), None, [], [], messages)
+			ccmpSubs, lines, missingMarks = dieted
+			with trace.phase("finishDiet"):
+				if collection:
+					finishCollectionDiet(ttx,options,ccmpSubs)
+				else:
+					finishDiet(ttx,options,ccmpSubs)
+			report("Saving %s..." % (outPath))
+			with trace.phase("save") as counts:
+				if collection:
+					outSize = counts["bytes"] = saveCollection(ttx, outPath, inData)
+				else:
+					outSize = counts["bytes"] = saveFont(ttx, outPath, inData)
+			return DietResult(None, getFea(lines), len(inData), outSize, ccmpSubs, missingMarks, messages)
+		finally:
+			inData.close()
+	finally:
+		inFile.close()
+
+def estimateDiet(fontOrPath, options=None, log=None, trace=None):
+	# Predicts the outputfont size of diet(fontOrPath, options) without changing,
+	# compiling or saving the font. Returns a DietResult whose data is None and
+	# whose outSize is the estimate, or None if the font is not suitable for a diet.
+	if options is None:
+		options = dietOptions()
+	if trace is None:
+		trace = NO_TRACE
+	messages = []
+	def report(message):
+		messages.append(message)
+		if log: log(message)
+
+	if isCollection(fontOrPath):
+		raise DietError("Cannot estimate the diet of a collection")
+	inSize = getInputSize(fontOrPath)
+	with trace.phase("load", bytes=inSize):
+		ttx = openFont(fontOrPath)
+	if ttx.reader is None:
+		raise DietError("Cannot estimate the diet of a font that was not read from a file")
+	if inSize is None:
+		inSize = sum([len(ttx.reader[tag]) for tag in ttx.reader.keys()])
+	plan = planDiet(ttx,options,report,trace)
+	if not plan:
+		return DietResult(None, None, inSize, None, [], [], messages)
+	glyphs, ccmpSubs, lines, missingMarks = plan
+	if options.verifyDecompositions and lines:
+		with trace.phase("verifyDecompositions", glyphs=len(ccmpSubs)) as counts:
+			counts["deviating"] = verifyDecompositions(ttx,ccmpSubs,options.verifyDecompositions,report)
+	with trace.phase("estimateSize") as counts:
+		outSize = counts["bytes"] = estimateSize(ttx,options,plan,inSize)
+	if ttx is not fontOrPath:
+		ttx.close()
+	ttx = None
+	return DietResult(None, getFea(lines), inSize, outSize, ccmpSubs, missingMarks, messages)
+
+#########################################################################################################
+
+# Size report: the bytes of each table before and after the diet, and for each blanked
+# glyph the bytes of its outline and 'gvar' deltas, the kerning pairs that go with it
+# and the bytes its decomposition adds to the 'ccmp' lookup. The table sizes come from
+# the table directories of the inputfont and the outputfont; the glyph figures come from
+# the size estimates of a diet planned again from the inputfont, so a diet restored
+# from the cache gets the same report.
+
+REPORT_OPTIONS = [ # long option name, DietOptions field of the options a table row names
+	("glyf",       "removePrecomposedOutlines"),
+	("kern",       "removePrecomposedFromGposKern"),
+	("ccmp",       "decomposePrecomposedInCcmp"),
+	("cmap",       "removeAllButWinCmapSubtables"),
+	("name",       "removeAllButWinNameRecords"),
+	("rename",     "renameFont"),
+	("post",       "removePostGlyphnames"),
+	("duplicates", "removeDuplicateOutlines"),
+	("dsig",       "addDummyDsig"),
+	]
+REPORT_GLYPH_FIELDS = ["outlineBytes", "variationBytes", "kernPairs", "kernBytes", "ccmpBytes", "netBytes"]
+REPORT_CSV_FIELDS = ["kind", "name", "inBytes", "outBytes", "savedBytes", "changedBy", "codepoints", "decomposition"] + REPORT_GLYPH_FIELDS
+
+def getTableSizes(path):
+	# {tag: uncompressed bytes} of the tables of a font or collection; a table that
+	# faces of a collection share is counted once
+	if isCollection(path):
+		faces = TTCollection(path, lazy=True).fonts
+	else:
+		faces = [TTFont(path, lazy=True)]
+	sizes = {}
+	counted = set()
+	for face in faces:
+		for tag, entry in face.reader.tables.items():
+			if (tag, entry.offset) not in counted:
+				counted.add((tag, entry.offset))
+				sizes[tag] = sizes.get(tag, 0) + getattr(entry, "origLength", entry.length)
+		face.close()
+	return sizes
+
+def getTableOptions(options):
+	# {tag: [long names of the enabled options that change the table]}
+	noOptions = options._replace(**dict((field, 0) for name, field in REPORT_OPTIONS))
+	unchanged = getDietedTables(noOptions, 1)
+	tableOptions = {}
+	for name, field in REPORT_OPTIONS:
+		if getattr(options, field):
+			for tag in getDietedTables(noOptions._replace(**{field: getattr(options, field)}), 1) - unchanged:
+				tableOptions.setdefault(tag, []).append(name)
+	return tableOptions
+
+def getKernSavings(ttx,glyphs):
+	# {glyph: (pairs, bytes)} of the kerning removeGPOSkern() and removeKernTablePairs()
+	# remove with each blanked glyph: the pair records of 'GPOS' PairPos format 1 and of
+	# the 'kern' table, and the coverage and class def entries of PairPos format 2, whose
+	# class pairs aren't attributed to single glyphs. A pair of two blanked glyphs counts
+	# for the first. Like estimateGPOSkernSaving(), identical PairSets are stored once,
+	# so their bytes count once, for the first glyph, and not if a kept glyph has one too.
+	glyphs   = frozenset(glyphs)
+	glyphIDs = frozenset([ttx.getGlyphID(g) for g in glyphs])
+	pairs  = dict((g, 0) for g in glyphs)
+	saving = dict((g, 0) for g in glyphs)
+	for subtable in getKernSubtables(ttx) if "GPOS" in ttx else []:
+		if subtable.Format == 1:
+			recordSize = 2 + getValueRecordSize(subtable.ValueFormat1) + getValueRecordSize(subtable.ValueFormat2)
+			pairSets = [(g, getPairSetRecords(p,recordSize,glyphs,glyphIDs)) for g, p in zip(subtable.Coverage.glyphs, subtable.PairSet)]
+			counted = set([tuple([key for removed, key in records]) for g, records in pairSets if g not in glyphs])
+			keptPairSets = set(counted)
+			for g, records in pairSets:
+				pairSet = tuple([key for removed, key in records])
+				if g in glyphs:
+					pairs[g]  += len(records)
+					saving[g] += 4 # coverage entry, PairSet offset
+					if pairSet not in counted:
+						counted.add(pairSet)
+						saving[g] += 2 + recordSize * len(records)
+					continue
+				for removed, key in records:
+					if removed:
+						second = ttx.getGlyphName(unpack(">H", key[:2])[0]) if isinstance(key, str) else key[0]
+						pairs[second] += 1
+						if pairSet in keptPairSets:
+							saving[second] += recordSize
+				keptPairSets.discard(pairSet)
+		elif subtable.Format == 2:
+			for classGlyphs in [subtable.Coverage.glyphs, subtable.ClassDef1.classDefs, subtable.ClassDef2.classDefs]:
+				for g in glyphs.intersection(classGlyphs):
+					saving[g] += 2
+	for kernPairs in getKernTablePairs(ttx):
+		for left, right in kernPairs:
+			g = left if left in glyphs else right
+			if g in glyphs:
+				pairs[g]  += 1
+				saving[g] += 6
+	return dict((g, (pairs[g], saving[g])) for g in glyphs)
+
+def getCcmpCosts(ccmpSubs):
+	# {glyph: bytes} the 'ccmp' lookup adds for each glyph: its Coverage entry and Sequence
+	# offset, and for the first glyph of each decomposition the Sequence they share
+	costs = {}
+	sequences = set()
+	for g, decomposition in ccmpSubs:
+		costs[g] = 4
+		if tuple(decomposition) not in sequences:
+			sequences.add(tuple(decomposition))
+			costs[g] += 2 + 2 * len(decomposition)
+	return costs
+
+def getGlyphReport(inPath,options):
+	# a row for each glyph the diet of inPath decomposes, in glyph order; the faces of a
+	# collection that share a table add its figures once
+	if isCollection(inPath):
+		faces = openCollection(inPath).fonts
+		plans = planCollectionDiet(faces,options._replace(removeDuplicateOutlines=0),ignoreMessage) or []
+	else:
+		faces = [openFont(inPath)]
+		plans = [planDiet(faces[0],options,ignoreMessage)]
+	rows = {}
+	counted = set()
+	for i, (face, plan) in enumerate(zip(faces, plans)):
+		if not plan or not plan[2]:
+			continue
+		glyphs, ccmpSubs, lines, missingMarks = plan
+		cmap = face["cmap"].getcmap(3,10) or face["cmap"].getcmap(3,1)
+		for g, decomposition in ccmpSubs:
+			rows.setdefault(g, dict([("name", g), ("codepoints", []), ("decomposition", decomposition)] + [(field, 0) for field in REPORT_GLYPH_FIELDS]))
+		for u, g in cmap.cmap.iteritems():
+			if g in rows and unicodeIntToHexstr(u) not in rows[g]["codepoints"]:
+				rows[g]["codepoints"] += [unicodeIntToHexstr(u)]
+		key = ("glyf", getGlyfKey(face, i))
+		if options.removePrecomposedOutlines and key not in counted:
+			counted.add(key)
+			for g, saving in getGlyfSavings(face,glyphs).items() + getCharStringSavings(face,glyphs).items():
+				rows[g]["outlineBytes"] += saving
+			for g, saving in getGvarSavings(face,glyphs).items():
+				rows[g]["variationBytes"] += saving
+		key = tuple([getTableKey(face, tag, i) for tag in ["GPOS", "kern"] if tag in face.reader])
+		if options.removePrecomposedFromGposKern and key not in counted:
+			counted.add(key)
+			for g, (pairs, saving) in getKernSavings(face,glyphs).items():
+				rows[g]["kernPairs"] += pairs
+				rows[g]["kernBytes"] += saving
+		key = getTableKey(face, "GSUB", i)
+		if options.decomposePrecomposedInCcmp and key not in counted:
+			counted.add(key)
+			for g, cost in getCcmpCosts(ccmpSubs).items():
+				rows[g]["ccmpBytes"] += cost
+	glyphOrder = faces[0].getGlyphOrder()
+	for face in faces:
+		face.close()
+	for row in rows.values():
+		row["codepoints"].sort()
+		row["netBytes"] = row["outlineBytes"] + row["variationBytes"] + row["kernBytes"] - row["ccmpBytes"]
+	return [rows[g] for g in glyphOrder if g in rows]
+
+def getSizeReport(inPath,sizes,options):
+	# the size report of the diet of inPath into sizes, as dietToFiles() returns them
+	inTables  = getTableSizes(inPath)
+	outTables = getTableSizes(sizes[0][1])
+	tableOptions = getTableOptions(options)
+	tables = []
+	for tag in sorted(set(inTables) | set(outTables)):
+		inBytes, outBytes = inTables.get(tag, 0), outTables.get(tag, 0)
+		tables += [{"name": tag, "inBytes": inBytes, "outBytes": outBytes, "savedBytes": inBytes - outBytes, "changedBy": tableOptions.get(tag, [])}]
+	glyphs = getGlyphReport(inPath,options)
+	return {
+		"input":   inPath,
+		"outputs": [{"format": format, "path": path, "inSize": inSize, "outSize": outSize} for format, path, inSize, outSize in sizes],
+		"tables":  tables,
+		"glyphs":  glyphs,
+		"totals":  dict([("glyphs", len(glyphs))] + [(field, sum([row[field] for row in glyphs])) for field in REPORT_GLYPH_FIELDS]),
+		}
+
+def saveSizeReport(report,path):
+	# as CSV, one row per table and per glyph, if path ends with .csv, else as JSON
+	if os.path.splitext(path)[1].lower() != ".csv":
+		saveFile(json.dumps(report, indent=1, separators=(",", ": "), sort_keys=True).encode("utf-8"), path)
+		return
+	data = BytesIO()
+	writer = csv.DictWriter(data, REPORT_CSV_FIELDS, restval="", lineterminator="\n")
+	writer.writeheader()
+	for kind, rows in [("table", report["tables"]), ("glyph", report["glyphs"])]:
+		for row in rows:
+			writer.writerow(dict([(field, " ".join(value) if isinstance(value, list) else value) for field, value in row.items()], kind=kind))
+	saveFile(data.getvalue(), path)
+
+# ot-sanitise runs in subprocesses that threads of a Sanitiser wait on, so
+# the next font can be dieted meanwhile. The sanitised font is written to the
+# null device: ot-sanitise reads the saved outputfont and writes no file.
+SanitiseResult = namedtuple("SanitiseResult", [
+	"path",
+	"status",       # "passed", "failed", "timeout", or "missing" if ot-sanitise was not found
+	"returncode",
+	"seconds",
+	"messages",     # ot-sanitise's error output, as a list of lines
+	])
+
+def runSanitiser(path,otsPathOrCommand,timeout=0):
+	# runs ot-sanitise on the font file at path, killing it after timeout seconds
+	# (0 means no timeout); returns a SanitiseResult
+	start = time.time()
+	# on POSIX, in a process group of its own, so that a timeout also stops
+	# the processes of a wrapper script, which would keep the pipes open:
+	newGroup = os.name == "posix"
+	try:
+		p = Popen([otsPathOrCommand, path, os.devnull], stdout=PIPE, stderr=PIPE, preexec_fn=os.setsid if newGroup else None)
+	except OSError:
+		return SanitiseResult(path, "missing", None, 0, [])
+	timedOut = []
+	def kill():
+		timedOut.append(True)
+		try:
+			if newGroup:
+				os.killpg(p.pid, signal.SIGKILL)
+			else:
+				p.kill()
+		except OSError: # already finished
+			pass
+	timer = None
+	if timeout:
+		timer = threading.Timer(timeout, kill)
+		timer.start()
+	try:
+		stdoutdata, stderrdata = p.communicate()
+	finally:
+		if timer:
+			timer.cancel()
+	messages = [l.strip() for l in stderrdata.decode("utf-8", "replace").splitlines() if l.strip()]
+	if timedOut:
+		status = "timeout"
+		messages += ["ot-sanitise did not finish within %s seconds" % timeout]
+	elif p.returncode or messages: # if no problems are found, ot-sanitise doesn't output anything
+		status = "failed"
+	else:
+		status = "passed"
+	return SanitiseResult(path, status, p.returncode, round(time.time() - start, 3), messages)
+
+class Sanitiser(object):
+	# Runs ot-sanitise on up to jobs fonts at once. submit() returns at once;
+	# getResults() returns the (key, SanitiseResult) of the finished runs.
+
+	def __init__(self, options, jobs=0):
+		self.options = options
+		self.pool = multiprocessing.pool.ThreadPool(jobs or multiprocessing.cpu_count())
+		self.finished = Queue.Queue()
+		self.pending = 0
+
+	def submit(self, path, key=None):
+		def run():
+			try:
+				return key, runSanitiser(path, self.options.otsPathOrCommand, self.options.otsTimeout)
+			except Exception, e:
+				return key, SanitiseResult(path, "failed", None, 0, ["%s: %s" % (e.__class__.__name__, e)])
+		self.pending += 1
+		self.pool.apply_async(run, callback=self.finished.put)
+
+	def getResults(self, wait=False):
+		# the runs finished so far, or with wait, all submitted runs
+		results = []
+		while self.pending:
+			try:
+				results += [self.finished.get(wait)]
+			except Queue.Empty:
+				break
+			self.pending -= 1
+		return results
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+def removeUnsanitised(result,options):
+	# with -S 2, deletes an outputfont that ot-sanitise did not validate
+	if result.status in ("failed", "timeout") and options.otsSanitise > 1 and os.path.exists(result.path):
+		os.remove(result.path)
+
+def reportSanitised(result,options,log):
+	# reports a SanitiseResult of the single-font command line; returns 1 on failure
+	if result.status == "missing":
+		log("ot-sanitise not found. Install https://github.com/khaledhosny/ots")
+		return 0
+	if result.status == "passed":
+		log("ot-sanitise validated %s." % result.path)
+		return 0
+	print "ot-sanitise did not validate the simplified font %s." % result.path,
+	if options.otsSanitise > 1: print "Deleting it.",
+	print
+	for line in result.messages:
+		log("    %s" % line)
+	removeUnsanitised(result,options)
+	return 1
+
+def sanitiseFont(outPath,options,log):
+	# returns 1 if ot-sanitise did not validate the font
+	return reportSanitised(runSanitiser(outPath, options.otsPathOrCommand, options.otsTimeout), options, log)
+
+#########################################################################################################
+
+# Result cache: the outputfonts, .fea and report of a diet, stored under a key
+# made from the inputfont bytes and everything else that decides the output.
+# Each result is a folder <key[:2]>/<key> with font.<format> files, ccmp.fea
+# and report.json, whose modification time is its last use.
+
+CACHE_IGNORED_OPTIONS = ["verbose", "saveFeaFile", "otsSanitise", "otsPathOrCommand", "otsTimeout", "estimate",
+	"traceFile", "traceFormat", "profileFile", "reportFile", "cache", "cacheFolder", "cacheSize"] # don't change the outputfont
+
+cacheUsage = {} # cache folder: bytes as of this process's last walk, plus what it stored since
+
+def getCacheFolder(cacheFolder):
+	return cacheFolder or os.path.join(UNICODE_TABLES_FOLDER, "results")
+
+def getCacheKey(inPath,options):
+	# SHA-256 of the inputfont and of the options that change the outputfont, including
+	# the resolved skip marks, the rename string and the output formats, and of the
+	# versions of ttfdiet, fontTools and the Unicode data
+	sha = hashlib.sha256()
+	inFile = open(inPath, "rb")
+	try:
+		while True:
+			chunk = inFile.read(1 << 20)
+			if not chunk:
+				break
+			sha.update(chunk)
+	finally:
+		inFile.close()
+	settings = dict((k, v) for k, v in options._asdict().items() if k not in CACHE_IGNORED_OPTIONS)
+	settings["versions"] = [TOOL_VERSION, fontTools.version, unicodedata.unidata_version]
+	sha.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+	return sha.hexdigest()
+
+def getCachePath(options,key):
+	return os.path.join(getCacheFolder(options.cacheFolder), key[:2], key)
+
+def getFileDigest(path):
+	# (bytes, SHA-256) of the file at path
+	sha = hashlib.sha256()
+	size = 0
+	inFile = open(path, "rb")
+	try:
+		while True:
+			chunk = inFile.read(1 << 20)
+			if not chunk:
+				break
+			sha.update(chunk)
+			size += len(chunk)
+	finally:
+		inFile.close()
+	return [size, sha.hexdigest()]
+
+def restoreFile(sourcePath,outPath,digest):
+	# copies a cached file to outPath, never links it, so tools that later edit
+	# outPath in place don't change the cache; raises IOError if the cached file
+	# doesn't match the digest stored with it, and outPath is then left as it was
+	def write(outFile):
+		sha = hashlib.sha256()
+		size = 0
+		sourceFile = open(sourcePath, "rb")
+		try:
+			while True:
+				chunk = sourceFile.read(1 << 20)
+				if not chunk:
+					break
+				sha.update(chunk)
+				size += len(chunk)
+				outFile.write(chunk)
+		finally:
+			sourceFile.close()
+		if [size, sha.hexdigest()] != digest:
+			raise ValueError("cached file changed: %s" % sourcePath)
+	replaceFile(outPath, write)
+
+def loadCachedDiet(options,key,outPath):
+	# restores a cached result to outPath (and its other formats); returns
+	# the report dict, or None if the result isn't cached
+	entryPath = getCachePath(options, key)
+	reportPath = os.path.join(entryPath, "report.json")
+	try:
+		reportFile = open(reportPath, "rb")
+		try:
+			report = json.loads(reportFile.read().decode("utf-8"))
+		finally:
+			reportFile.close()
+		files = report["files"]
+		restores = []
+		if report["suitable"]:
+			for format, inSize, outSize in report["sizes"]:
+				restores += [("font." + format, getFormatPath(outPath, format))]
+			if report["fea"] and options.saveFeaFile:
+				restores += [("ccmp.fea", os.path.splitext(outPath)[0]+".ccmp.fea")]
+		for name, path in restores: # check all sizes first, so a bad result restores nothing
+			if os.path.getsize(os.path.join(entryPath, name)) != files[name][0]:
+				raise ValueError("cached file changed: %s" % name)
+		for name, path in restores:
+			restoreFile(os.path.join(entryPath, name), path, files[name])
+		os.utime(reportPath, None) # last use, for the LRU eviction
+	except (IOError, OSError):
+		return None # not cached, or removed meanwhile by another process
+	except (ValueError, KeyError):
+		shutil.rmtree(entryPath, True) # changed by something else, or an older format: diet the font again
+		return None
+	return report
+
+def storeCachedDiet(options,key,inPath,sizes,fea,messages,missingMarks):
+	# copies the outputfonts and the .fea into the cache; sizes is None if the
+	# font was not suitable for a diet. The result is written to a temp folder
+	# that is renamed into place, so other processes never see it half-written.
+	entryPath = getCachePath(options, key)
+	if os.path.exists(entryPath):
+		return
+	report = {
+		"input":        os.path.basename(inPath),
+		"suitable":     sizes is not None,
+		"sizes":        [(format, inSize, outSize) for format, path, inSize, outSize in sizes or []],
+		"fea":          fea is not None,
+		"messages":     messages,
+		"missingMarks": missingMarks,
+		"files":        {}, # name: [bytes, SHA-256], checked before a file is restored
+		}
+	tempPath = None
+	stored = 0
+	try:
+		ensureFolder(os.path.dirname(entryPath))
+		tempPath = tempfile.mkdtemp(prefix=key+".", suffix=".tmp", dir=os.path.dirname(entryPath))
+		for format, path, inSize, outSize in sizes or []:
+			shutil.copyfile(path, os.path.join(tempPath, "font." + format))
+		if fea is not None:
+			saveFile(fea, os.path.join(tempPath, "ccmp.fea"))
+		for name in os.listdir(tempPath):
+			report["files"][name] = getFileDigest(os.path.join(tempPath, name))
+			stored += report["files"][name][0]
+		reportFile = open(os.path.join(tempPath, "report.json"), "wb")
+		try:
+			reportFile.write(json.dumps(report, indent=1, separators=(",", ": "), sort_keys=True).encode("utf-8"))
+		finally:
+			reportFile.close()
+		os.rename(tempPath, entryPath)
+		tempPath = None
+	except (IOError, OSError):
+		return # another process stored the same result, or the cache is not writable
+	finally:
+		if tempPath:
+			shutil.rmtree(tempPath, True)
+	# only walk the cache when this process has not yet, or when the result
+	# may have pushed it over the limit; batchMain() evicts once more at the end
+	cacheFolder = getCacheFolder(options.cacheFolder)
+	usage = cacheUsage.get(cacheFolder)
+	if usage is None or usage + stored > options.cacheSize * 1024 * 1024:
+		evictCache(cacheFolder, options.cacheSize)
+	else:
+		cacheUsage[cacheFolder] = usage + stored
+
+def getCacheEntries(cacheFolder):
+	# (last use, bytes, path) of each cached result, oldest first
+	entries = []
+	if not os.path.isdir(cacheFolder):
+		return entries
+	for prefix in os.listdir(cacheFolder):
+		prefixPath = os.path.join(cacheFolder, prefix)
+		if len(prefix) != 2 or not os.path.isdir(prefixPath):
+			continue
+		for name in os.listdir(prefixPath):
+			entryPath = os.path.join(prefixPath, name)
+			try:
+				lastUse = os.path.getmtime(os.path.join(entryPath, "report.json"))
+				size = sum([os.path.getsize(os.path.join(entryPath, f)) for f in os.listdir(entryPath)])
+			except OSError: # a temp folder, or removed meanwhile
+				continue
+			entries += [(lastUse, size, entryPath)]
+	entries.sort()
+	return entries
+
+def evictCache(cacheFolder,cacheSize):
+	# removes the least recently used results until the cache fits in cacheSize megabytes
+	entries = getCacheEntries(cacheFolder)
+	total = sum([size for lastUse, size, entryPath in entries])
+	limit = cacheSize * 1024 * 1024
+	for lastUse, size, entryPath in entries:
+		if total <= limit:
+			break
+		shutil.rmtree(entryPath, True)
+		total -= size
+	cacheUsage[cacheFolder] = total
+
+def clearCache(cacheFolder):
+	for lastUse, size, entryPath in getCacheEntries(cacheFolder):
+		shutil.rmtree(entryPath, True)
+
+def printCacheStats(cacheFolder,cacheSize):
+	entries = getCacheEntries(cacheFolder)
+	total = sum([size for lastUse, size, entryPath in entries])
+	print "Cache folder: %s" % cacheFolder
+	print "Results:      %s" % len(entries)
+	print "Size:         %.1f of %g MB (%.0f%%)" % (total / 1048576.0, cacheSize, 100.0 * total / (cacheSize * 1048576.0) if cacheSize else 0)
+	if entries:
+		print "Oldest use:   %s" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entries[0][0]))
+		print "Latest use:   %s" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entries[-1][0]))
+
+def printMessage(message):
+	print message
+
+def ignoreMessage(message):
+	pass
+
+def dietEfficiency(inSize,outSize):
+	# the saving in percent, with two decimals
+	return float(int((1 - float(outSize)/inSize) * 10000))/100
+
+def main(inPath, outPath, options, memo=None):
+	# command-line diet of one font; returns (sizes, error), or None if the font was skipped;
+	# sizes is a list of (format, path, inSize, outSize), one for each output format
+	try:
+		return dietMain(inPath, outPath, options, memo)
+	except DietError, e:
+		print e
+		sys.exit(2)
+
+def dietMain(inPath, outPath, options, memo=None):
+	# main() without the exit: diets one font to files, logging and tracing as the
+	# options say, and raises DietError if the font cannot be read
+	if options.verbose: 
+		log = printMessage
+	else:
+		log = ignoreMessage
+	trace = NO_TRACE
+	if options.traceFile or options.profileFile:
+		trace = DietTrace(options.profileFile)
+	try:
+		dieted = dietToFiles(inPath, outPath, options, log, trace, memo)
+		if dieted is None:
+			return None
+		sizes, missingMarks = dieted
+		if options.estimate:
+			return sizes, 0
+		return reportDiet(sizes, options, log, trace)
+	finally:
+		trace.close()
+		if options.traceFile:
+			trace.save(options.traceFile, options.traceFormat, inPath)
+		if options.profileFile:
+			trace.saveProfile(options.profileFile)
+
+def dietToFiles(inPath, outPath, options, log, trace, memo=None):
+	# diets inPath into outPath and its other formats, through the result cache;
+	# returns (sizes, missingMarks), or None if the font was skipped. Nothing is
+	# printed, and a font that cannot be read raises DietError.
+	if options.formats != ["ttf"] and isCollection(inPath):
+		log("%s is a collection, which is only saved as a collection." % (os.path.basename(inPath)))
+		options = options._replace(formats=["ttf"])
+	if options.estimate:
+		log("Estimating the diet of %s..." % (os.path.basename(inPath)))
+	else:
+		log("Dieting %s..." % (os.path.basename(inPath)))
+	cacheKey = None
+	if options.cache and not options.estimate:
+		try:
+			cacheKey = getCacheKey(inPath, options)
+		except IOError:
+			raise DietError("Cannot open %s" % inPath)
+		with trace.phase("loadCachedDiet"):
+			report = loadCachedDiet(options, cacheKey, outPath)
+		if report is not None:
+			for message in report["messages"]:
+				log(message)
+			if not report["suitable"]:
+				return None
+			log("Restored %s from the cache." % (", ".join([getFormatPath(outPath, f) for f, inSize, outSize in report["sizes"]])))
+			sizes = [(f, getFormatPath(outPath, f), inSize, outSize) for f, inSize, outSize in report["sizes"]]
+			if options.reportFile:
+				reportSizes(inPath, sizes, options, log, trace)
+			return sizes, report.get("missingMarks", [])
+	if options.estimate:
+		result = estimateDiet(inPath, options, log, trace)
+	elif options.formats == ["ttf"]:
+		result = dietFile(inPath, outPath, options, log, trace, memo)
+	else:
+		# one diet in memory, saved in all formats:
+		result = diet(inPath, options, log, trace, memo)
+	if result.outSize is None:
+		if cacheKey:
+			storeCachedDiet(options, cacheKey, inPath, None, None, result.messages, [])
+		return None
+	if options.estimate:
+		log("Estimated diet efficiency: %s%% (from %s to about %s bytes)" % (dietEfficiency(result.inSize, result.outSize), result.inSize, result.outSize))
+		return [("ttf", outPath, result.inSize, result.outSize)], result.missingMarks
+
+	if result.fea and options.saveFeaFile:
+		saveFile(result.fea,os.path.splitext(outPath)[0]+".ccmp.fea")
+	if result.data is None:
+		sizes = [("ttf", outPath, result.inSize, result.outSize)]
+	else:
+		log("Saving %s..." % (", ".join([getFormatPath(outPath, f) for f in options.formats])))
+		inFile = open(inPath, "rb")
+		inData = inFile.read()
+		inFile.close()
+		with trace.phase("fanOut", formats=len(options.formats)):
+			sizes = fanOut(result.data, inData, outPath, options.formats)
+	if cacheKey:
+		# without the "Saving" message, as the next outPath may differ:
+		messages = [m for m in result.messages if m != "Saving %s..." % (outPath)]
+		with trace.phase("storeCachedDiet", formats=len(sizes)):
+			storeCachedDiet(options, cacheKey, inPath, sizes, result.fea, messages, result.missingMarks)
+	if options.reportFile:
+		reportSizes(inPath, sizes, options, log, trace)
+	return sizes, result.missingMarks
+
+def reportSizes(inPath, sizes, options, log, trace):
+	with trace.phase("saveSizeReport") as counts:
+		report = getSizeReport(inPath, sizes, options)
+		counts["glyphs"] = report["totals"]["glyphs"]
+		saveSizeReport(report, options.reportFile)
+	log("Saved the size report to %s." % options.reportFile)
+
+def reportDiet(sizes, options, log, trace):
+	# reports the diet efficiency of each format, and validates the outputfonts;
+	# returns (sizes, error)
+	if options.formats == ["ttf"]:
+		format, path, inSize, outSize = sizes[0]
+		log("Diet efficiency: %s%% (from %s to %s bytes)" % (dietEfficiency(inSize, outSize), inSize, outSize))
+	else:
+		for format, path, inSize, outSize in sizes:
+			log("Diet efficiency (%s): %s%% (from %s to %s bytes)" % (format, dietEfficiency(inSize, outSize), inSize, outSize))
+
+	# validate:
+	error = 0
+	if options.otsSanitise: 
+		# all formats at once:
+		sanitiser = Sanitiser(options, len(sizes))
+		with trace.phase("sanitiseFont", fonts=len(sizes)):
+			for format, path, inSize, outSize in sizes:
+				sanitiser.submit(path)
+			for key, sanitised in sanitiser.getResults(wait=True):
+				error = reportSanitised(sanitised,options,log) or error
+		sanitiser.close()
+	return sizes, error
+
+#########################################################################################################
+
+familyMemo = None # the DietMemo of a pool process in family mode
+
+def initBatchWorker(family):
+	global familyMemo
+	getUnicodeTables()
+	if family:
+		familyMemo = DietMemo()
+
+def batchDiet(job, memo=None):
+	inPath, outPath, options = job
+	try:
+		result = dietMain(inPath, outPath, options, memo or familyMemo)
+	except DietError, e:
+		return inPath, "failed", str(e), []
+	except Exception, e:
+		return inPath, "failed", "%s: %s" % (e.__class__.__name__, e), []
+	if not result:
+		return inPath, "skipped", "font not suitable for a diet", []
+	sizes, error = result
+	if error:
+		return inPath, "failed", "ot-sanitise did not validate the font", sizes
+	return inPath, "ok", "", sizes
+
+def printBatchResult(inPath, status, message, sizes, options):
+	# the summary line of a font in batch or watch mode
+	if status == "ok" and options.estimate:
+		format, path, inSize, outSize = sizes[0]
+		print "ok      %s: about %s%% (from %s to about %s bytes)" % (inPath, dietEfficiency(inSize, outSize), inSize, outSize)
+	elif status == "ok":
+		print "ok      %s -> %s" % (inPath, "; ".join(["%s: %s%% (from %s to %s bytes)" % (path, dietEfficiency(inSize, outSize), inSize, outSize) for format, path, inSize, outSize in sizes]))
+	elif status == "skipped":
+		print "skipped %s: %s" % (inPath, message)
+	else:
+		print "FAILED  %s: %s" % (inPath, message)
+	sys.stdout.flush()
+
+def getBatchJobOptions(options, inPath):
+	# one trace, profile and report file per font
+	if options.traceFile:
+		options = options._replace(traceFile=getTracePath(options.traceFile, inPath))
+	if options.profileFile:
+		options = options._replace(profileFile=getTracePath(options.profileFile, inPath))
+	if options.reportFile:
+		options = options._replace(reportFile=getTracePath(options.reportFile, inPath))
+	return options
+
+def batchMain(jobs, options, batch):
+	if not jobs:
+		print "No inputfonts found."
+		return 2
+	workers = batch.jobs or multiprocessing.cpu_count()
+	workers = max(1, min(workers, len(jobs)))
+	if options.verbose: print "Dieting %s fonts with %s worker process(es)..." % (len(jobs), workers)
+	counts = {"ok": 0, "skipped": 0, "failed": 0}
+	# the workers stay warm (fontTools imported, Unicode tables loaded)
+	# for all fonts they get; the parent prints one summary line per font:
+	# ot-sanitise runs in the parent, so that it overlaps with the diets:
+	workerOptions = options._replace(verbose=0, otsSanitise=0)
+	sanitiser = None
+	if options.otsSanitise and not options.estimate:
+		sanitiser = Sanitiser(options, workers)
+	unsanitised = {} # inPath: [sizes, SanitiseResults]
+	sanitiseCounts = {"passed": 0, "failed": 0, "timeout": 0, "missing": 0}
+	def printResult(inPath, status, message, sizes):
+		counts[status] += 1
+		printBatchResult(inPath, status, message, sizes, options)
+	def printSanitised(wait=False):
+		# prints the fonts whose outputfonts have all been sanitised
+		for inPath, sanitised in sanitiser.getResults(wait):
+			sanitiseCounts[sanitised.status] += 1
+			removeUnsanitised(sanitised, options)
+			sizes, results = unsanitised[inPath]
+			results += [sanitised]
+			if len(results) < len(sizes):
+				continue
+			del unsanitised[inPath]
+			failed = [r for r in results if r.status in ("failed", "timeout")]
+			if failed:
+				printResult(inPath, "failed", "ot-sanitise did not validate %s" % "; ".join(["%s (%s%s)" % (r.path, r.status, ": " + r.messages[0] if r.messages else "") for r in failed]), sizes)
+			else:
+				printResult(inPath, "ok", "", sizes)
+	def getJobOptions(inPath):
+		return getBatchJobOptions(workerOptions, inPath)
+	getUnicodeTables() # load once here, so forked workers inherit the tables
+	# the output folders, before the workers write into them:
+	for folder in cleanUpList([os.path.dirname(os.path.abspath(outPath)) for inPath, outPath in jobs]):
+		try:
+			ensureFolder(folder)
+		except OSError:
+			pass # the fonts that go there fail
+	pool = multiprocessing.Pool(workers, initBatchWorker, (batch.family,))
+	try:
+		# chunksize 1: fonts differ a lot in size, so hand them out one by one
+		for inPath, status, message, sizes in pool.imap_unordered(batchDiet, [(i, o, getJobOptions(i)) for i, o in jobs], 1):
+			if status == "ok" and sanitiser:
+				unsanitised[inPath] = [sizes, []]
+				for format, path, inSize, outSize in sizes:
+					sanitiser.submit(path, inPath)
+			else:
+				printResult(inPath, status, message, sizes)
+			if sanitiser:
+				printSanitised()
+		pool.close()
+		if sanitiser:
+			printSanitised(wait=True)
+			sanitiser.close()
+	except KeyboardInterrupt:
+		pool.terminate()
+		raise
+	pool.join()
+	if options.cache:
+		evictCache(getCacheFolder(options.cacheFolder), options.cacheSize) # the workers only know what they stored
+	if options.verbose: print "Dieted %s fonts, skipped %s, failed %s." % (counts["ok"], counts["skipped"], counts["failed"])
+	if options.verbose and sanitiser:
+		print "ot-sanitise: %s passed, %s failed, %s timed out%s." % (sanitiseCounts["passed"], sanitiseCounts["failed"], sanitiseCounts["timeout"], ", %s not run (ot-sanitise not found)" % sanitiseCounts["missing"] if sanitiseCounts["missing"] else "")
+	if counts["failed"]:
+		return 1
+	return 0
+
+#########################################################################################################
+
+# Option sweep: diets a font with each combination of the core diet options and keeps
+# the smallest outputfont that ot-sanitise validates. The font is read once: each -s
+# value is planned once, and the dieted 'GPOS' and 'GSUB' tables of each plan are
+# compiled once into a DietMemo. The forked pool processes inherit the font data, the
+# plans and the memo, and diet each combination from a lazily opened copy of the data,
+# so a combination decompiles and compiles only the tables it changes and writeFont()
+# copies all others. ot-sanitise runs in the parent while the next combinations are
+# dieted.
+SWEEP_OPTIONS = [ # option letter, DietOptions field
+	("g", "removePrecomposedOutlines"),
+	("k", "removePrecomposedFromGposKern"),
+	("C", "decomposePrecomposedInCcmp"),
+	("c", "removeAllButWinCmapSubtables"),
+	("n", "removeAllButWinNameRecords"),
+	("p", "removePostGlyphnames"),
+	]
+
+sweepState = None # (font data, plans, DietMemo) of the font the pool processes sweep
+
+def getSweepCombinations(options):
+	# the DietOptions of each combination of SWEEP_OPTIONS and -s values (the given skip
+	# marks, and none); glyphs are only blanked, and their kerning only removed, if the
+	# 'ccmp' lookup decomposes them, and combinations that make the same diet are left out
+	options = options._replace(verbose=0, otsSanitise=0, verifyDecompositions=0, saveFeaFile=0, formats=["ttf"],
+		traceFile="", profileFile="", reportFile="", cache=0)
+	combinations = []
+	for skipMarks in [tuple(options.skipMarks)] + [()] * bool(options.skipMarks):
+		for values in itertools.product([1, 0], repeat=len(SWEEP_OPTIONS)):
+			combination = options._replace(skipMarks=list(skipMarks), **dict([(field, value) for (letter, field), value in zip(SWEEP_OPTIONS, values)]))
+			if (combination.removePrecomposedOutlines or combination.removePrecomposedFromGposKern) and not combination.decomposePrecomposedInCcmp:
+				continue
+			combination = combination._replace(removeAllButWinNameRecords=combination.removeAllButWinNameRecords or combination.renameFont)
+			if combination not in combinations:
+				combinations += [combination]
+	return combinations
+
+def getSweepLabel(options):
+	# the command-line options of a combination
+	label = " ".join(["-%s %s" % (letter, getattr(options, field)) for letter, field in SWEEP_OPTIONS])
+	return "%s -s %s" % (label, ",".join([unicodeIntToHexstr(m) for m in options.skipMarks]) or "0")
+
+def planSweep(inData,combinations,log):
+	# {skip marks: (plan, 'GDEF' data)} of the -s values of combinations, and a DietMemo
+	# with the dieted 'GPOS' and 'GSUB' tables of each plan; None if the font is not
+	# suitable for a diet. testFont() corrects the mark classes in 'GDEF' while planning,
+	# so the corrected table is kept with the plan.
+	plans = {}
+	memo = DietMemo(2 * len(combinations))
+	for options in combinations:
+		if tuple(options.skipMarks) in plans:
+			continue
+		ttx = openFont(inData)
+		plan = planDiet(ttx,options,log if not plans else ignoreMessage) # the messages of one plan
+		if not plan:
+			return None
+		gdefData = ttx.getTableData("GDEF")
+		# the diet of the layout tables only, for the memo:
+		applyDiet(ttx,options._replace(**dict([(field, 0) for letter, field in SWEEP_OPTIONS] +
+			[("removePrecomposedFromGposKern", 1), ("decomposePrecomposedInCcmp", 1), ("renameFont", 0), ("addDummyDsig", 0), ("removeDuplicateOutlines", 0)])),
+			plan,ignoreMessage,memo=memo)
+		ttx.close()
+		plans[tuple(options.skipMarks)] = (plan, gdefData)
+	return plans, memo
+
+def initSweepWorker(inData, plans, memo):
+	global sweepState
+	sweepState = inData, plans, memo
+
+def sweepDiet(job):
+	# diets one combination into folder; returns (index, path, size, error message)
+	index, options, folder = job
+	inData, plans, memo = sweepState
+	plan, gdefData = plans[tuple(options.skipMarks)]
+	path = os.path.join(folder, "%d.ttf" % index)
+	try:
+		ttx = openFont(inData)
+		ccmpSubs, lines, missingMarks = applyDiet(ttx,options,plan,ignoreMessage,memo=memo)
+		gdef = DefaultTable("GDEF")
+		gdef.data = gdefData
+		ttx.tables["GDEF"] = gdef
+		finishDiet(ttx,options,ccmpSubs)
+		size = saveFont(ttx, path, inData)
+		ttx.close()
+	except Exception, e:
+		return index, None, None, "%s: %s" % (e.__class__.__name__, e)
+	return index, path, size, ""
+
+def sweepFont(inPath, outPath, options, workers):
+	# sweeps the options of one font and saves the smallest valid outputfont; returns
+	# the status ("ok", "skipped" or "failed"), a message and the sizes of the outputfonts
+	log = printMessage if options.verbose else ignoreMessage
+	if isCollection(inPath):
+		return "failed", "cannot sweep the options of a collection", []
+	try:
+		inFile = open(inPath, "rb")
+		try:
+			inData = inFile.read()
+		finally:
+			inFile.close()
+	except IOError:
+		return "failed", "cannot open font", []
+	combinations = getSweepCombinations(options)
+	log("Planning %s..." % (os.path.basename(inPath)))
+	try:
+		planned = planSweep(inData,combinations,log)
+	except DietError, e:
+		return "failed", str(e), []
+	except Exception, e:
+		return "failed", "%s: %s" % (e.__class__.__name__, e), []
+	if not planned:
+		return "skipped", "font not suitable for a diet", []
+	plans, memo = planned
+	log("Dieting %s with %s combinations of options in %s process(es)..." % (os.path.basename(inPath), len(combinations), workers))
+	folder = tempfile.mkdtemp(prefix="ttfdiet-sweep.")
+	results = {} # index: (size, status, message)
+	sanitiser = Sanitiser(options, workers)
+	pool = multiprocessing.Pool(workers, initSweepWorker, (inData, plans, memo))
+	try:
+		def collectSanitised(wait=False):
+			for index, sanitised in sanitiser.getResults(wait):
+				size, status, message = results[index]
+				results[index] = (size, sanitised.status, sanitised.messages[0] if sanitised.messages else "")
+		jobs = [(i, combination, folder) for i, combination in enumerate(combinations)]
+		for index, path, size, message in pool.imap_unordered(sweepDiet, jobs, 1):
+			if path is None:
+				results[index] = (None, "failed", message)
+			else:
+				results[index] = (size, "unchecked", "")
+				sanitiser.submit(path, index)
+			collectSanitised()
+		pool.close()
+		collectSanitised(wait=True)
+		sanitiser.close()
+		pool.join()
+
+		ranking = sorted(results.items(), key=lambda (index, (size, status, message)): (size is None, size, index))
+		for index, (size, status, message) in ranking:
+			log("  %s: %s%s" % (getSweepLabel(combinations[index]), "%s bytes, %s" % (size, status) if size else status, ": " + message if message else ""))
+		missing = [index for index, (size, status, message) in ranking if status == "missing"]
+		if missing:
+			log("ot-sanitise not found, so the outputfonts are not validated. Install https://github.com/khaledhosny/ots")
+		valid = [index for index, (size, status, message) in ranking if status in ("passed", "missing")]
+		if not valid:
+			return "failed", "ot-sanitise validated none of the %s combinations" % len(combinations), []
+		best = combinations[valid[0]]
+		dataFile = open(os.path.join(folder, "%d.ttf" % valid[0]), "rb")
+		try:
+			data = dataFile.read()
+		finally:
+			dataFile.close()
+	except KeyboardInterrupt:
+		pool.terminate()
+		raise
+	finally:
+		shutil.rmtree(folder, True)
+	log("Smallest valid outputfont: %s" % getSweepLabel(best))
+	sizes = fanOut(data, inData, outPath, options.formats)
+	if options.reportFile:
+		reportSizes(inPath, sizes, best._replace(reportFile=options.reportFile), log, NO_TRACE)
+	return "ok", getSweepLabel(best), sizes
+
+def sweepMain(jobs, options, batch):
+	if not jobs:
+		print "No inputfonts found."
+		return 2
+	workers = batch.jobs or multiprocessing.cpu_count()
+	getUnicodeTables() # load once here, so forked workers inherit the tables
+	failed = 0
+	for inPath, outPath in jobs:
+		status, message, sizes = sweepFont(inPath, outPath, getBatchJobOptions(options, inPath) if batch.mode else options, workers)
+		if status == "ok":
+			print "ok      %s -> %s with %s" % (inPath, "; ".join(["%s: %s%% (from %s to %s bytes)" % (path, dietEfficiency(inSize, outSize), inSize, outSize) for format, path, inSize, outSize in sizes]), message)
+		else:
+			printBatchResult(inPath, status, message, sizes, options)
+			failed += status == "failed"
+		sys.stdout.flush()
+	if options.verbose: print "Done."
+	if failed:
+		return 1
+	return 0
+
+#########################################################################################################
+
+# Watch mode: one process keeps fontTools and the Unicode tables loaded and re-diets
+# the inputfonts that change. A font counts as changed when its modification time,
+# size or inode differ from the last check, and is re-dieted once they have stayed
+# the same for WATCH_DELAY seconds, so a font that is still being written is dieted
+# once. On Linux, inotify wakes the loop up when a watched folder changes; elsewhere
+# the inputfonts are checked every WATCH_POLL_INTERVAL seconds.
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_WATCH_MASK  = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+class PollingWatcher(object):
+	# waits for the next check of the inputfonts
+
+	def watch(self, folders):
+		pass
+
+	def wait(self, timeout):
+		if timeout is None:
+			timeout = WATCH_POLL_INTERVAL
+		time.sleep(min(timeout, WATCH_POLL_INTERVAL))
+
+	def close(self):
+		pass
+
+class InotifyWatcher(object):
+	# waits until a watched folder changes, through the inotify calls of the C library
+
+	def __init__(self):
+		if ctypes is None or not sys.platform.startswith("linux"):
+			raise OSError("inotify is not available")
+		libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		self.addWatch = libc.inotify_add_watch
+		self.addWatch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		self.fd = libc.inotify_init()
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init failed")
+		self.folders = set()
+
+	def watch(self, folders):
+		for folder in folders:
+			if folder not in self.folders and os.path.isdir(folder):
+				if self.addWatch(self.fd, folder, IN_WATCH_MASK) >= 0:
+					self.folders.add(folder)
+
+	def wait(self, timeout):
+		# the events themselves don't matter, as the inputfonts are checked after each
+		readable = select.select([self.fd], [], [], timeout)[0]
+		while readable:
+			os.read(self.fd, 65536)
+			readable = select.select([self.fd], [], [], 0)[0]
+
+	def close(self):
+		os.close(self.fd)
+
+class DietMemo(object):
+	# the dieted 'GPOS' and 'GSUB' tables of the last diets, compiled, by getMemoKey(), so
+	# that a font whose edit changed neither those tables nor the plan skips their diet,
+	# which is most of the time of a diet; and the decompositions of the last fonts, by
+	# getPlanKey(), so that the members of a family are planned once; keeps the size most
+	# recently used of each
+
+	def __init__(self, size=WATCH_MEMO_SIZE):
+		self.size   = size
+		self.tables = OrderedDict()
+		self.plans  = OrderedDict()
+
+	def getItems(self, key):
+		if key[0] == "plan":
+			return self.plans
+		return self.tables
+
+	def get(self, key):
+		items = self.getItems(key)
+		data = items.pop(key, None)
+		if data is not None:
+			items[key] = data
+		return data
+
+	def put(self, key, data):
+		items = self.getItems(key)
+		items.pop(key, None)
+		items[key] = data
+		while len(items) > self.size:
+			items.popitem(last=False)
+
+def getMemoKey(ttx,tag,plan,memo):
+	# what the diet of the table depends on: its input data, the glyph order and the
+	# part of the plan it uses; None without a memo or the table
+	if memo is None or tag not in ttx.reader:
+		return None
+	digest = hashlib.sha1(ttx.reader[tag])
+	digest.update(repr(ttx.getGlyphOrder()))
+	digest.update(repr(plan))
+	return tag, digest.digest()
+
+def useMemoTable(ttx,tag,key,memo,log,trace=NO_TRACE):
+	# puts the memo's table for key into ttx; returns whether it had one
+	if key is None or memo.get(key) is None:
+		return 0
+	log("Reusing the dieted '%s' table of an earlier diet." % tag)
+	with trace.phase("useMemoTable", table=tag):
+		table = DefaultTable(tag)
+		table.data = memo.get(key)
+		ttx.tables[tag] = table
+	return 1
+
+def storeMemoTable(ttx,tag,key,memo,trace=NO_TRACE):
+	# compiles the dieted table now, rather than when saving, to keep it in the memo
+	if key is None:
+		return
+	with trace.phase("storeMemoTable", table=tag) as counts:
+		table = DefaultTable(tag)
+		table.data = counts["bytes"] = ttx.getTableData(tag)
+		ttx.tables[tag] = table
+		memo.put(key, table.data)
+
+def getWatcher():
+	try:
+		return InotifyWatcher()
+	except (OSError, AttributeError):
+		return PollingWatcher()
+
+def getFileState(path):
+	# what tells whether a file has changed, or None if it doesn't exist
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return st.st_mtime, st.st_size, st.st_ino
+
+def getWatchedFolders(jobs, batch):
+	# the folders whose changes may change the inputfonts or add new ones
+	folders = set([os.path.dirname(os.path.abspath(inPath)) for inPath, outPath in jobs])
+	for a in batch.inputs:
+		if a.startswith("@"):
+			folders.add(os.path.dirname(os.path.abspath(a[1:])))
+		elif os.path.isdir(a):
+			for root, dirs, files in os.walk(a):
+				folders.add(os.path.abspath(root))
+		elif isGlobPattern(a):
+			folder = os.path.dirname(a)
+			while isGlobPattern(folder):
+				folder = os.path.dirname(folder)
+			folders.add(os.path.abspath(folder))
+	return folders
+
+def watchMain(jobs, options, batch):
+	# diets the inputfonts, then re-diets each one that changes, until interrupted
+	watcher = getWatcher()
+	if options.verbose: print "Watching %s for changes (%s); press Ctrl-C to stop..." % (
+		"%s font(s)" % len(jobs) if batch.mode else jobs[0][0],
+		"inotify" if isinstance(watcher, InotifyWatcher) else "polling every %s seconds" % WATCH_POLL_INTERVAL)
+	getUnicodeTables() # once, before the first font changes
+	memo = DietMemo()
+	states = {}  # inPath: state of the last check
+	changed = {} # inPath: time of the last change not yet dieted
+	try:
+		while 1:
+			if batch.mode:
+				jobs = collectBatchJobs(batch.inputs, batch.outdir)
+			watcher.watch(getWatchedFolders(jobs, batch))
+			now = time.time()
+			for inPath, outPath in jobs:
+				state = getFileState(inPath)
+				if state != states.get(inPath, 0):
+					states[inPath] = state
+					if state is None:
+						changed.pop(inPath, None)
+					else:
+						changed[inPath] = now
+			for inPath, outPath in jobs:
+				if inPath in changed and now - changed[inPath] >= WATCH_DELAY:
+					del changed[inPath]
+					start = time.time()
+					inPath, status, message, sizes = batchDiet((inPath, outPath, getBatchJobOptions(options, inPath) if batch.mode else options), memo)
+					printBatchResult(inPath, status, message, sizes, options)
+					if options.verbose: print "(%.2f seconds)" % (time.time() - start)
+					sys.stdout.flush()
+			if changed:
+				# until the first pending change has settled:
+				watcher.wait(max(0, min(changed.values()) + WATCH_DELAY - time.time()) + 0.01)
+			else:
+				watcher.wait(None)
+	except KeyboardInterrupt:
+		if options.verbose: print "Stopped watching."
+	finally:
+		watcher.close()
+	return 0
+
+#########################################################################################################
+
+# Worker mode: a long-lived process for build systems, which would otherwise start
+# Python, import fontTools and load the Unicode tables for every font. Each line on
+# stdin is a JSON request, for example:
+#   {"id": 7, "input": "a.ttf", "output": "out/a.ttf", "options": {"kern": 0, "formats": "ttf,woff2"}}
+# with "data" (the base64 inputfont) instead of "input". The options use the long
+# command-line names and default to the options the worker was started with. The
+# fonts are dieted in a pool of warm processes, and each result is written as one
+# JSON line to stdout as soon as it is done, so results may come in another order
+# than the requests; "id" is copied from the request.
+
+def getWorkerOptions(request, defaults):
+	# the DietOptions of a worker request; raises DietError for unknown options or values
+	options = deepcopy(defaults)
+	changes = request.get("options") or {}
+	if not isinstance(changes, dict):
+		raise DietError("'options' must be an object")
+	for name, value in changes.items():
+		if not hasattr(options, name) or name in WORKER_IGNORED_OPTIONS:
+			raise DietError("Unknown option '%s'" % name)
+		if isinstance(value, bool):
+			value = int(value) # true/false, as the 1/0 of the command line
+		setattr(options, name, value if isinstance(value, basestring) else str(value))
+	try:
+		return getDietSettings(options)._replace(verbose=0)
+	except ValueError, e:
+		raise DietError("Invalid option value: %s" % e)
+
+def workerDiet(job):
+	# diets the font of one worker request in a pool process; returns the result dict
+	request, defaults, received = job
+	start = time.time()
+	result = {"id": request.get("id"), "status": "failed", "message": "", "input": request.get("input"),
+		"outputs": [], "missingMarks": [], "sanitise": [], "messages": [], "timings": {}}
+	tempFolder = None
+	returnData = False
+	try:
+		options = getWorkerOptions(request, defaults)
+		inPath = request.get("input")
+		outPath = request.get("output")
+		if request.get("data") is not None:
+			# the font bytes go through a temp file, so that they take the path of
+			# an inputfont (memory map, result cache); without an output path, the
+			# outputfonts are returned in the result as base64:
+			tempFolder = tempfile.mkdtemp(prefix="ttfdiet.")
+			inPath = os.path.join(tempFolder, "font.ttf")
+			saveData(base64.b64decode(request["data"]), inPath)
+			if not outPath:
+				outPath = os.path.join(tempFolder, "font.diet.ttf")
+				returnData = True
+		elif not inPath:
+			raise DietError("The request has neither 'input' nor 'data'")
+		elif not outPath:
+			outPath = defaultOutPath(inPath)
+		dieted = dietToFiles(inPath, outPath, options, result["messages"].append, NO_TRACE, familyMemo)
+		dietTime = time.time()
+		if dieted is None:
+			result["status"] = "skipped"
+			result["message"] = "font not suitable for a diet"
+		else:
+			sizes, missingMarks = dieted
+			result["status"] = "ok"
+			result["missingMarks"] = missingMarks
+			for format, path, inSize, outSize in sizes:
+				output = {"format": format, "path": path, "inSize": inSize, "outSize": outSize}
+				if options.estimate or returnData:
+					output["path"] = None
+				if returnData and not options.estimate:
+					dataFile = open(path, "rb")
+					output["data"] = base64.b64encode(dataFile.read())
+					dataFile.close()
+				result["outputs"] += [output]
+			if options.otsSanitise and not options.estimate:
+				sanitiser = Sanitiser(options, len(sizes))
+				for format, path, inSize, outSize in sizes:
+					sanitiser.submit(path)
+				for key, sanitised in sanitiser.getResults(wait=True):
+					removeUnsanitised(sanitised, options)
+					result["sanitise"] += [dict(sanitised._asdict(), path=None if returnData else sanitised.path)]
+					if sanitised.status in ("failed", "timeout"):
+						result["status"] = "failed"
+						result["message"] = "ot-sanitise did not validate the font"
+				sanitiser.close()
+		result["timings"] = {"queued": round(start - received, 3), "diet": round(dietTime - start, 3), "sanitise": round(time.time() - dietTime, 3)}
+	except Exception, e:
+		result["status"] = "failed"
+		result["message"] = str(e) if isinstance(e, DietError) else "%s: %s" % (e.__class__.__name__, e)
+	finally:
+		if tempFolder:
+			shutil.rmtree(tempFolder, True)
+	result["timings"]["total"] = round(time.time() - received, 3)
+	return result
+
+def initWorker(family):
+	# in each pool process: nothing but the results may go to stdout
+	sys.stdout = sys.stderr
+	initBatchWorker(family)
+
+def workerMain(options, batch):
+	# answers the requests on stdin until it is closed
+	workers = batch.jobs or multiprocessing.cpu_count()
+	output = sys.stdout
+	sys.stdout = sys.stderr # stray prints go to stderr
+	lock = threading.Lock()
+	def writeResult(result):
+		# called by the pool's result thread, and by the main thread for bad requests
+		line = json.dumps(result, sort_keys=True, separators=(",", ":"))
+		with lock:
+			output.write(line + "\n")
+			output.flush()
+	if options.verbose: print "Worker ready with %s process(es); waiting for requests on stdin..." % workers
+	getUnicodeTables() # load once here, so forked workers inherit the tables
+	pool = multiprocessing.Pool(workers, initWorker, (batch.family,))
+	try:
+		# readline() doesn't wait for a full read-ahead buffer, as iterating over stdin does:
+		for line in iter(sys.stdin.readline, ""):
+			if not line.strip():
+				continue
+			received = time.time()
+			try:
+				request = json.loads(line)
+				if not isinstance(request, dict):
+					raise ValueError("not an object")
+			except ValueError, e:
+				writeResult({"id": None, "status": "failed", "message": "Invalid request: %s" % e})
+				continue
+			pool.apply_async(workerDiet, [(request, batch.defaults, received)], callback=writeResult)
+		pool.close()
+	except KeyboardInterrupt:
+		pool.terminate()
+		raise
+	pool.join()
+	return 0
 
 if __name__ == "__main__":
 	args = sys.argv
-	if len(args) < 2: 
+	if len(args) < 2:
 		args.append("-h")
-	inPath, outPath = handleOptions()
-	main(inPath, outPath)
-	if VERBOSE: print "Done."
+	options, batch, jobs = handleOptions()
+	if batch.worker:
+		sys.exit(workerMain(options, batch))
+	if batch.watch:
+		sys.exit(watchMain(jobs, options, batch))
+	if batch.sweep:
+		sys.exit(sweepMain(jobs, options, batch))
+	if batch.mode:
+		status = batchMain(jobs, options, batch)
+		if options.verbose: print "Done."
+		sys.exit(status)
+	inPath, outPath = jobs[0]
+	main(inPath, outPath, options)
+	if options.verbose: print "Done."
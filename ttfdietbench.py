@@ -0,0 +1,412 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ttfdietbench -- speed, memory and output size of ttfdiet
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs the full diet and each option group alone on the bundled test fonts
+# and on synthetically scaled fonts (tens of thousands of glyphs and kerning
+# pairs), and records wall time, peak memory and output bytes as JSON.
+# A stored result can be given as baseline, then slower runs, more memory
+# and bigger outputfonts are reported as regressions (exit status 1).
+#
+# Every case runs in a fresh Python process, so that peak memory is the
+# diet's own and not left over from an earlier case.
+#
+# usage: python ttfdietbench.py [options] [font.ttf ...]
+#
+#   python ttfdietbench.py -o baseline.json
+#   python ttfdietbench.py -b baseline.json
+#
+# Without -b, the outputfont sizes are compared with docs/bench-baseline.json,
+# the results of the bundled and scaled fonts when it was last updated; its
+# times and memory come from another machine and are not compared.
+#
+# -P 1 instead compares the set-based kerning and outline passes of
+# ttfdiet.py with the list-based reference implementation they replaced,
+# on the same glyph set, and checks that both produce the same kerning, and
+# the same glyph data and metrics.
+
+#########################################################################################################
+
+import os
+import os.path
+import sys
+import json
+import optparse
+import random
+import shutil
+import tempfile
+import time
+from subprocess import PIPE, Popen
+
+import ttfdiet
+import fontTools
+from fontTools.ttLib import TTFont
+from fontTools.ttLib.tables._g_l_y_f import Glyph
+from fontTools.otlLib import builder
+
+BENCH_FOLDER      = os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs")
+BENCH_FONTS       = [os.path.join(BENCH_FOLDER, "LatoKernTest-Regular.ttf"), os.path.join(BENCH_FOLDER, "DroidSerif-Regular.ttf")]
+BENCH_SCALED_FONT = os.path.join(BENCH_FOLDER, "DroidSerif-Regular.ttf") # the font the scaled fonts are built from
+BENCH_SCALED      = [(20000, 20000), (50000, 60000)] # (glyphs, kerning pairs) of each scaled font
+BENCH_SEED        = 1
+BENCH_PAIRS_PER_SUBTABLE = 4000 # keeps the PairPos offsets in 16 bits
+BENCH_REPEAT      = 3    # wall time is the fastest of this many runs
+BENCH_PASS_REPEAT = 20
+BENCH_TOLERANCE   = 0.25 # allowed slowdown or memory growth against the baseline
+BENCH_MIN_SECONDS = 0.005 # differences below these are noise
+BENCH_MIN_MEMORY  = 1 << 20
+BENCH_FORMAT      = 1
+BENCH_BASELINE    = os.path.join(BENCH_FOLDER, "bench-baseline.json") # compared with unless -b is given
+
+# each case is the default diet, or all option groups off but one:
+BENCH_GROUPS_OFF = dict(
+	removePrecomposedOutlines     = 0,
+	removePrecomposedFromGposKern = 0,
+	removeAllButWinCmapSubtables  = 0,
+	removeAllButWinNameRecords    = 0,
+	removePostGlyphnames          = 0,
+	decomposePrecomposedInCcmp    = 0,
+	renameFont                    = 0,
+	)
+BENCH_CASES = [
+	("full", {}),
+	("-g",   dict(BENCH_GROUPS_OFF, removePrecomposedOutlines=1)),
+	("-k",   dict(BENCH_GROUPS_OFF, removePrecomposedFromGposKern=1)),
+	("-c",   dict(BENCH_GROUPS_OFF, removeAllButWinCmapSubtables=1)),
+	("-n",   dict(BENCH_GROUPS_OFF, removeAllButWinNameRecords=1)),
+	("-p",   dict(BENCH_GROUPS_OFF, removePostGlyphnames=1)),
+	("-C",   dict(BENCH_GROUPS_OFF, decomposePrecomposedInCcmp=1)),
+	]
+
+#########################################################################################################
+
+def buildScaledFont(basePath, glyphCount, pairCount, outPath, seed=BENCH_SEED):
+	# Adds unencoded copies of the glyphs of basePath up to glyphCount glyphs, and
+	# PairPos Format 1 kerning up to pairCount more pairs. The first glyph of each
+	# pair is an encoded glyph (so the precomposed ones are kerned too) or one of
+	# the copies, the second glyph is any glyph. The same seed builds the same font.
+	ttx = TTFont(basePath, recalcBBoxes=False)
+	glyphOrder = ttx.getGlyphOrder()
+	glyf = ttx["glyf"]
+	metrics = ttx["hmtx"].metrics
+	sources = [g for g in glyphOrder if getattr(glyf.glyphs[g], "data", "")] # empty glyphs have no data
+	newGlyphs = ["scaled%05d" % i for i in range(max(0, glyphCount - len(glyphOrder)))]
+	for i, g in enumerate(newGlyphs):
+		source = sources[i % len(sources)]
+		# raw data: component glyph IDs stay valid, the new glyphs only go at the end
+		glyf.glyphs[g] = Glyph(glyf.glyphs[source].data)
+		metrics[g] = metrics[source]
+	glyphOrder = glyphOrder + newGlyphs
+	ttx.setGlyphOrder(glyphOrder)
+	glyf.glyphOrder = glyphOrder
+
+	rand = random.Random(seed)
+	firstGlyphs = sorted(set(ttx.getBestCmap().values())) + newGlyphs[:len(newGlyphs)//10]
+	pairs = {}
+	while len(pairs) < pairCount:
+		pairs[(rand.choice(firstGlyphs), rand.choice(glyphOrder))] = (builder.buildValue({"XAdvance": -rand.randint(1, 100)}), None)
+	kern = ttx["GPOS"].table.LookupList.Lookup[ttfdiet.getFeatureLookupIndices(ttx["GPOS"].table, ["kern"])[0]]
+	reverseGlyphMap = ttx.getReverseGlyphMap()
+	pairs = sorted(pairs.items(), key=lambda p: (reverseGlyphMap[p[0][0]], reverseGlyphMap[p[0][1]]))
+	for i in range(0, len(pairs), BENCH_PAIRS_PER_SUBTABLE):
+		kern.SubTable.append(builder.buildPairPosGlyphsSubtable(dict(pairs[i:i+BENCH_PAIRS_PER_SUBTABLE]), reverseGlyphMap))
+	kern.SubTableCount = len(kern.SubTable)
+	ttx.save(outPath)
+	ttx.close()
+
+def getScaledFonts(folder, scaled=BENCH_SCALED):
+	paths = []
+	for glyphCount, pairCount in scaled:
+		name, ext = os.path.splitext(os.path.basename(BENCH_SCALED_FONT))
+		path = os.path.join(folder, "%s-Scaled%sg%sp%s" % (name, glyphCount, pairCount, ext))
+		print "Building %s..." % os.path.basename(path)
+		sys.stdout.flush()
+		buildScaledFont(BENCH_SCALED_FONT, glyphCount, pairCount, path)
+		paths += [path]
+	return paths
+
+#########################################################################################################
+
+def runCase(path, caseName, repeat):
+	# runs in its own process (see benchCase); returns a result dict
+	options = ttfdiet.dietOptions(verbose=0, **dict(BENCH_CASES)[caseName])
+	ttfdiet.getUnicodeTables()
+	startRss = ttfdiet.getProcStatus("VmRSS") or ttfdiet.getPeakMemory()
+	folder = tempfile.mkdtemp()
+	try:
+		outPath = os.path.join(folder, os.path.basename(path))
+		seconds = None
+		for i in range(repeat):
+			start = time.time()
+			result = ttfdiet.dietFile(path, outPath, options)
+			seconds = min(seconds, time.time() - start) if seconds is not None else time.time() - start
+	finally:
+		shutil.rmtree(folder)
+	peakRss = ttfdiet.getPeakMemory()
+	return {
+		"font":       os.path.basename(path),
+		"case":       caseName,
+		"seconds":    round(seconds, 4),
+		"peakMemory": peakRss - startRss if peakRss is not None and startRss is not None else None,
+		"inSize":     result.inSize,
+		"outSize":    result.outSize,
+		}
+
+def benchCase(path, caseName, repeat):
+	process = Popen([sys.executable, os.path.abspath(__file__), "--case", caseName, "--repeat", str(repeat), path], stdout=PIPE)
+	output = process.communicate()[0]
+	if process.returncode:
+		raise RuntimeError("Case %s of %s failed" % (caseName, path))
+	return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+def formatMemory(peakMemory):
+	if peakMemory is None:
+		return "       ?"
+	return "%5.1f MB" % (peakMemory / 1048576.0)
+
+def compareResult(result, baseline, tolerance, timing=True):
+	# returns a list of (regression, description) against the baseline result;
+	# without timing, only the outputfont sizes are compared
+	changes = []
+	if timing:
+		if result["seconds"] > baseline["seconds"] * (1 + tolerance) and result["seconds"] - baseline["seconds"] > BENCH_MIN_SECONDS:
+			changes += [(True, "slower: %.3f s, was %.3f s" % (result["seconds"], baseline["seconds"]))]
+		elif result["seconds"] < baseline["seconds"] * (1 - tolerance) and baseline["seconds"] - result["seconds"] > BENCH_MIN_SECONDS:
+			changes += [(False, "faster: %.3f s, was %.3f s" % (result["seconds"], baseline["seconds"]))]
+	if timing and result["peakMemory"] is not None and baseline.get("peakMemory") is not None:
+		if result["peakMemory"] > baseline["peakMemory"] * (1 + tolerance) and result["peakMemory"] - baseline["peakMemory"] > BENCH_MIN_MEMORY:
+			changes += [(True, "more memory: %s, was %s" % (formatMemory(result["peakMemory"]).strip(), formatMemory(baseline["peakMemory"]).strip()))]
+	if result["outSize"] != baseline["outSize"]:
+		changes += [(result["outSize"] > baseline["outSize"], "outputfont %s bytes, was %s bytes" % (result["outSize"], baseline["outSize"]))]
+	return changes
+
+def benchFonts(paths, repeat, baseline=None, tolerance=BENCH_TOLERANCE, timing=True):
+	# returns the results as a dict, and the number of regressions
+	baselineResults = {}
+	if baseline:
+		if baseline.get("format") != BENCH_FORMAT:
+			print "Baseline has an unknown format, not comparing."
+		else:
+			for r in baseline["results"]:
+				baselineResults[(r["font"], r["case"])] = r
+	results = []
+	regressions = 0
+	print "%-40s %-5s %9s %9s %10s" % ("font", "case", "time", "memory", "bytes")
+	for path in paths:
+		for caseName, changes in BENCH_CASES:
+			result = benchCase(path, caseName, repeat)
+			results += [result]
+			print "%-40s %-5s %7.3f s %s %10s" % (result["font"], caseName, result["seconds"], formatMemory(result["peakMemory"]), result["outSize"])
+			if (result["font"], caseName) in baselineResults:
+				for regression, description in compareResult(result, baselineResults[(result["font"], caseName)], tolerance, timing):
+					regressions += regression
+					print "  %s %s" % ("REGRESSION" if regression else "changed   ", description)
+			sys.stdout.flush()
+	return {
+		"format":    BENCH_FORMAT,
+		"ttfdiet":   ttfdiet.TOOL_VERSION,
+		"fontTools": fontTools.version,
+		"python":    sys.version.split()[0],
+		"repeat":    repeat,
+		"results":   results,
+		}, regressions
+
+#########################################################################################################
+
+def referenceRemoveGPOSkern(ttx,glyphs_removeOutlinesAndInstructions):
+	# the list-based PairPosFormat1 pass of ttfdiet v0.807
+	lookupIndices = []
+	for r in ttx["GPOS"].table.FeatureList.FeatureRecord:
+		if r.FeatureTag == "kern":
+			for l in r.Feature.LookupListIndex:
+				if l not in lookupIndices:
+					lookupIndices += [int( l )]
+	for lIdx in lookupIndices:
+		lookup = ttx["GPOS"].table.LookupList.Lookup[lIdx]
+		if lookup.LookupType in [2,9]:
+			for s in lookup.SubTable:
+				if lookup.LookupType == 2:
+					subtable = s
+				elif lookup.LookupType == 9 and s.ExtensionLookupType == 2:
+					subtable = s.ExtSubTable
+				else:
+					continue
+				if subtable.Format == 1:
+					delPairSets = []
+					for gIdx in range(len(subtable.Coverage.glyphs)-1,-1,-1):
+						if subtable.Coverage.glyphs[gIdx] in glyphs_removeOutlinesAndInstructions:
+							del subtable.Coverage.glyphs[gIdx]
+							delPairSets += [int(gIdx)]
+					for pIdx in range(len(subtable.PairSet)-1,-1,-1):
+						if pIdx in delPairSets:
+							del subtable.PairSet[pIdx]
+						else:
+							p = subtable.PairSet[pIdx]
+							for pvIdx in range(len(p.PairValueRecord)-1,-1,-1):
+								if p.PairValueRecord[pvIdx].SecondGlyph in glyphs_removeOutlinesAndInstructions:
+									del p.PairValueRecord[pvIdx]
+
+def referenceRemoveOutlines(ttx,glyphs_removeOutlinesAndInstructions):
+	# the list-based outline and LSB pass of ttfdiet v0.807
+	glyphs = ttx["glyf"].glyphs
+	for n in glyphs_removeOutlinesAndInstructions:
+		glyphs[n].data = ""
+	for glyphname in ttx["hmtx"].metrics:
+		if glyphname in glyphs_removeOutlinesAndInstructions:
+			ttx["hmtx"].metrics[glyphname] = (ttx["hmtx"].metrics[glyphname][0], 0)
+
+def ignoreMessage(message):
+	pass
+
+def currentRemoveGPOSkern(ttx,glyphs):
+	ttfdiet.removeGPOSkern(ttx,glyphs,ignoreMessage)
+
+def currentRemoveOutlines(ttx,glyphs):
+	ttfdiet.removeOutlines(ttx,glyphs,ignoreMessage)
+
+def loadFonts(path,count):
+	# fonts with the tables that the passes touch already decompiled,
+	# so that only the passes themselves are timed
+	fonts = []
+	for i in range(count):
+		ttx = TTFont(path)
+		for tag in ["GPOS","glyf","hmtx"]:
+			if tag in ttx:
+				ttx[tag]
+		ttx["GPOS"].table.LookupList.Lookup
+		fonts += [ttx]
+	return fonts
+
+def getKernPairs(ttx):
+	# all PairPosFormat1 pairs as a sorted list, to compare the results
+	pairs = []
+	for lIdx in ttfdiet.getFeatureLookupIndices(ttx["GPOS"].table,["kern"]):
+		lookup = ttx["GPOS"].table.LookupList.Lookup[lIdx]
+		for s in lookup.SubTable:
+			subtable = s
+			if lookup.LookupType == 9:
+				subtable = s.ExtSubTable
+			if getattr(subtable, "Format", None) != 1 or not hasattr(subtable, "PairSet"):
+				continue
+			for g, p in zip(subtable.Coverage.glyphs, subtable.PairSet):
+				for r in p.PairValueRecord:
+					pairs += [(g, r.SecondGlyph)]
+	return sorted(pairs)
+
+def getOutlines(ttx):
+	# the glyph data and the metrics of all glyphs, to compare the results
+	glyf = ttx["glyf"]
+	outlines = []
+	for g in ttx.getGlyphOrder():
+		glyph = glyf.glyphs[g]
+		data = getattr(glyph, "data", None)
+		if data is None: # expanded
+			data = glyph.compile(glyf)
+		outlines += [(g, data)]
+	return outlines, sorted(ttx["hmtx"].metrics.items())
+
+def timePass(passFunction,fonts,glyphs):
+	start = time.time()
+	for ttx in fonts:
+		passFunction(ttx,glyphs)
+	return (time.time() - start) / len(fonts)
+
+def benchPasses(path,repeat=BENCH_PASS_REPEAT):
+	result = ttfdiet.diet(path, ttfdiet.dietOptions(verbose=0))
+	glyphs = [g for g, decomposition in result.decomposed]
+	print "%s: %s blanked glyphs" % (os.path.basename(path), len(glyphs))
+	for name, reference, current, getResult in [
+			("removeGPOSkern", referenceRemoveGPOSkern, currentRemoveGPOSkern, getKernPairs),
+			("removeOutlines", referenceRemoveOutlines, currentRemoveOutlines, getOutlines),
+			]:
+		referenceFonts = loadFonts(path,repeat)
+		currentFonts   = loadFonts(path,repeat)
+		referenceTime  = timePass(reference,referenceFonts,list(glyphs))
+		currentTime    = timePass(current,  currentFonts,  list(glyphs))
+		if getResult(referenceFonts[0]) != getResult(currentFonts[0]):
+			print "  %s: results differ!" % name
+		print "  %-16s reference %9.3f ms   current %9.3f ms   speedup %.1fx" % (name, referenceTime*1000, currentTime*1000, referenceTime/max(currentTime, 1e-9))
+
+#########################################################################################################
+
+def handleOptions():
+	parser = optparse.OptionParser(
+		usage="python %prog [options] [font.ttf ...]",
+		description="Benchmarks ttfdiet on the given fonts, or on the bundled test fonts and synthetically scaled fonts.",
+		)
+	parser.add_option("-r", "--repeat",
+		help=u"run each case this many times and record the fastest",
+		default=BENCH_REPEAT,
+		metavar=str(BENCH_REPEAT),
+		type="int" )
+	parser.add_option("-o", "--output",
+		help=u"save the results as JSON to this file",
+		default="",
+		metavar="file.json" )
+	parser.add_option("-b", "--baseline",
+		help=u"compare with the results in this JSON file, and exit with 1 on regressions; 'none' doesn't compare",
+		default=BENCH_BASELINE,
+		metavar=os.path.join("docs", os.path.basename(BENCH_BASELINE)) )
+	parser.add_option("-t", "--tolerance",
+		help=u"allowed slowdown and memory growth against the baseline, as a fraction",
+		default=BENCH_TOLERANCE,
+		metavar=str(BENCH_TOLERANCE),
+		type="float" )
+	parser.add_option("-s", "--scaled",
+		help=u"also benchmark the synthetically scaled fonts (always done if no fonts are given)",
+		default=0,
+		metavar="0",
+		type="int" )
+	parser.add_option("-P", "--passes",
+		help=u"instead compare the kerning and outline passes with the v0.807 reference implementation",
+		default=0,
+		metavar="0",
+		type="int" )
+	parser.add_option("--case", help=optparse.SUPPRESS_HELP, default="")
+	return parser.parse_args()
+
+if __name__ == "__main__":
+	options, args = handleOptions()
+	if options.case:
+		print json.dumps(runCase(args[0], options.case, options.repeat))
+		sys.exit(0)
+	if options.passes:
+		for path in args or BENCH_FONTS:
+			benchPasses(path)
+		sys.exit(0)
+	baseline = None
+	# the bundled baseline was recorded on another machine, so only its sizes are compared:
+	timing = options.baseline != BENCH_BASELINE
+	if options.baseline != "none" and (timing or os.path.exists(BENCH_BASELINE)):
+		baselineFile = open(options.baseline)
+		baseline = json.load(baselineFile)
+		baselineFile.close()
+	ttfdiet.getUnicodeTables() # build the cache once, not in every case
+	scaledFolder = tempfile.mkdtemp()
+	try:
+		paths = list(args) or list(BENCH_FONTS)
+		if options.scaled or not args:
+			paths += getScaledFonts(scaledFolder)
+		results, regressions = benchFonts(paths, options.repeat, baseline, options.tolerance, timing)
+	finally:
+		shutil.rmtree(scaledFolder)
+	if options.output:
+		outputFile = open(options.output, "w")
+		json.dump(results, outputFile, indent=1, separators=(",", ": "), sort_keys=True)
+		outputFile.close()
+	if baseline:
+		print "%s regression(s)." % regressions
+	sys.exit(1 if regressions else 0)